@@ -0,0 +1,188 @@
+#
+# Copyright (C) 2016 by frePPLe bvba
+#
+# This library is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+r'''
+Cache for the results of expensive reports and dashboard widgets.
+
+The plan only changes when a task finishes: a plan generation, a data
+import, a scenario copy... The results are cached in the Django cache
+"reports", with the end time of the last finished task of the scenario as
+part of the cache key. When a task finishes on a scenario, all results
+cached for that scenario are thus invalidated automatically, in all
+processes sharing the cache.
+Changes made to the data in the user interface don't invalidate the
+cache. Only reports and widgets showing the output of the plan should
+use it.
+
+The number of hits and misses of each report is counted in the cache as
+well, and is returned by the function getStatistics.
+
+Results can also be computed in advance, at the end of the plan generation,
+with the function setPrecomputed. These results are stored in the database
+of the scenario, such that all web server processes can use them.
+'''
+
+from datetime import datetime
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+from django.db import connections
+
+from freppledb.common.models import PrecomputedResult
+
+logger = logging.getLogger(__name__)
+
+# Name of the cache in the setting CACHES
+CACHE_ALIAS = 'reports'
+
+
+def getCache():
+  '''
+  Returns the report cache, or None when it isn't configured.
+  '''
+  try:
+    return caches[CACHE_ALIAS]
+  except InvalidCacheBackendError:
+    return None
+
+
+def getGeneration(database):
+  '''
+  Returns an identifier of the version of the plan in a scenario.
+  '''
+  cursor = connections[database].cursor()
+  cursor.execute("select max(finished) from execute_log")
+  return str(cursor.fetchone()[0])
+
+
+def isLatestTask(database, task):
+  '''
+  Returns True when a task finished and no other task finished after it.
+  Results saved by that task then describe the current plan.
+  '''
+  if not task:
+    return False
+  cursor = connections[database].cursor()
+  cursor.execute(
+    "select max(finished), max(case when id = %s then finished end) from execute_log",
+    (task,)
+    )
+  generation, finished = cursor.fetchone()
+  return finished is not None and finished == generation
+
+
+def _count(cache, name, metric):
+  key = 'frepple:stats:%s:%s' % (metric, name)
+  try:
+    cache.incr(key)
+  except ValueError:
+    cache.set(key, 1, None)
+  names = cache.get('frepple:stats', set())
+  if name not in names:
+    names.add(name)
+    cache.set('frepple:stats', names, None)
+
+
+def getCached(name, database, key, function, timeout=None):
+  '''
+  Returns the result of a function from the cache.
+  When it isn't found, the function is called and its result is stored in
+  the cache. Results larger than the setting REPORT_CACHE_MAXSIZE aren't
+  stored, and neither is the result None.
+  The name identifies the report, and the key identifies the arguments
+  of the report. The timeout in seconds overrides the timeout of the cache.
+  '''
+  cache = getCache()
+  if not cache:
+    return function()
+  cachekey = 'frepple:%s:%s:%s' % (
+    database, name,
+    hashlib.md5(('%s|%s' % (getGeneration(database), key)).encode('utf-8')).hexdigest()
+    )
+  result = cache.get(cachekey)
+  if result is not None:
+    _count(cache, name, 'hits')
+    return result
+  _count(cache, name, 'misses')
+  result = function()
+  if result is None:
+    return result
+  if not hasattr(result, '__len__') or len(result) <= getattr(settings, 'REPORT_CACHE_MAXSIZE', 10000000):
+    if timeout is None:
+      cache.set(cachekey, result)
+    else:
+      cache.set(cachekey, result, timeout)
+  else:
+    logger.debug("Result of %s too large for the report cache" % name)
+  return result
+
+
+def getStatistics():
+  '''
+  Returns a dictionary with the number of cache hits and misses per report.
+  '''
+  cache = getCache()
+  if not cache:
+    return {}
+  result = {}
+  for name in sorted(cache.get('frepple:stats', set())):
+    result[name] = {
+      'hits': cache.get('frepple:stats:hits:%s' % name, 0),
+      'misses': cache.get('frepple:stats:misses:%s' % name, 0)
+      }
+  return result
+
+
+def setPrecomputed(name, database, key, content, task=None):
+  '''
+  Stores a result computed in advance by a task.
+  '''
+  PrecomputedResult.objects.using(database).update_or_create(
+    name=name, key=hashlib.md5(key.encode('utf-8')).hexdigest(),
+    defaults={
+      'content': content,
+      'computed': datetime.now(),
+      'task': task,
+      'generation': None if task else getGeneration(database)
+      }
+    )
+
+
+def getPrecomputed(name, database, key):
+  '''
+  Returns a tuple with a result computed in advance and the time it was
+  computed, or None when it isn't available or outdated.
+  '''
+  try:
+    result = PrecomputedResult.objects.using(database).get(
+      name=name, key=hashlib.md5(key.encode('utf-8')).hexdigest()
+      )
+  except PrecomputedResult.DoesNotExist:
+    return None
+  if result.task:
+    # No other task may have finished after the task computing the result
+    if not isLatestTask(database, result.task):
+      return None
+  elif result.generation != getGeneration(database):
+    return None
+  cache = getCache()
+  if cache:
+    _count(cache, name, 'hits')
+  return (result.content, result.computed)
@@ -15,22 +15,28 @@
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from importlib import import_module
 from operator import attrgetter
+import json
 import os
 import sys
+import time
 
 from django.conf import settings
-from django.db import DEFAULT_DB_ALIAS
+from django.db import DEFAULT_DB_ALIAS, connections
 from django.utils.encoding import force_text
 
-from freppledb.execute.models import Task
+from freppledb.execute.models import Task, TaskStep
 
 
 class PlanTaskRegistry:
   reg = []
 
+  # Maximum interval in seconds between checks for a cancellation of the task
+  poll = 5
+
   @classmethod
   def register(cls, task):
     if not issubclass(task, PlanTask):
@@ -90,7 +96,10 @@ class PlanTaskRegistry:
         print("  %s: %s (weight %s)" % (i.sequence, i.description, i.weight))
 
   @classmethod
-  def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+  def run(cls, database=DEFAULT_DB_ALIAS, exclude=(), **kwargs):
+    '''
+    Runs all active steps. Steps in the exclude list are skipped.
+    '''
     cls.task = None
     if 'FREPPLE_TASKID' in os.environ:
       try:
@@ -106,6 +115,8 @@ class PlanTaskRegistry:
     task_weights = 0
     task_list = []
     for i in cls.reg:
+      if i in exclude:
+        continue
       i.weight = i.getWeight(database=database, **kwargs)
       if i.weight is not None and i.weight >= 0:
         task_weights += i.weight
@@ -113,26 +124,82 @@ class PlanTaskRegistry:
     if not task_weights:
       task_weights = 1
 
-    # Execute all tasks in the list
+    # Build the dependency graph
+    predecessors = cls.getDependencies(task_list)
+
+    # Execute all tasks in the list.
+    # A step is launched as soon as all its predecessors finished. Steps
+    # without mutual dependencies run in parallel on a pool of threads.
+    running = {}
+    finished = set()
+    progress = 0
+    error = None
+    cancelled = False
+    pool = ThreadPoolExecutor(max_workers=max(1, getattr(settings, 'PLANTASK_THREADS', 1)))
     try:
-      progress = 0
-      for step in task_list:
-        # Update status and message
+      while len(finished) < len(task_list) and (running or not (error or cancelled)):
+        # Update status and message, and check whether the task is cancelled
+        completed = progress
+        messages = []
+        for step in task_list:
+          if step in running.values():
+            try:
+              p = step.getProgress()
+            except Exception:
+              # Progress reporting mustn't break the plan generation
+              p = None
+            if p:
+              completed += step.weight * min(max(p[0], 0), 1)
+              messages.append('%s: %s' % (step.description, p[1]))
+            else:
+              messages.append(step.description)
+        if not cancelled and not cls.updateStatus(
+          database, '%d%%' % int(completed * 100.0 / task_weights), ', '.join(messages)
+          ):
+          print("\nCancelling at %s" % datetime.now().strftime("%H:%M:%S"))
+          cancelled = True
+          for step in running.values():
+            step.cancel()
+
+        # Launch all steps that are ready
+        if not (error or cancelled):
+          for step in task_list:
+            if step not in finished and step not in running.values() and predecessors[step] <= finished:
+              print("\nStart step %s '%s' at %s" % (
+                step.sequence,
+                step.description,
+                datetime.now().strftime("%H:%M:%S")
+                ))
+              running[pool.submit(cls._runStep, step, database, kwargs)] = step
+        if not running:
+          break
+
+        # Wait for a step to finish
+        done = wait(running, timeout=cls.poll, return_when=FIRST_COMPLETED)[0]
+        for f in done:
+          step = running.pop(f)
+          if f.exception():
+            if not error:
+              error = f.exception()
+            continue
+          finished.add(step)
+          progress += step.weight
+          if step.sequence > 0:
+            print("Finished '%s' at %s" % (step.description, datetime.now().strftime("%H:%M:%S")))
+      if cancelled:
         if cls.task:
-          cls.task.status = '%d%%' % int(progress * 100.0 / task_weights)
-          cls.task.message = step.description
+          cls.task.finished = datetime.now()
+          cls.task.status = 'Cancelled'
+          cls.task.message = ''
           cls.task.save(using=database)
-
-        # Run the step
-        print("\nStart step %s '%s' at %s" % (
-          step.sequence,
-          step.description,
-          datetime.now().strftime("%H:%M:%S")
+        print("\nCancelled planning at %s" % datetime.now().strftime("%H:%M:%S"))
+        sys.exit(2)
+      if error:
+        raise error
+      if len(finished) < len(task_list):
+        raise Exception("Steps waiting for steps that can't run: %s" % ', '.join(
+          step.description for step in task_list if step not in finished
           ))
-        step.run(database=database, **kwargs)
-        if step.sequence > 0:
-          print("Finished '%s' at %s" % (step.description,  datetime.now().strftime("%H:%M:%S")))
-        progress += step.weight
 
       # Final task status
       if cls.task:
@@ -148,15 +215,176 @@ class PlanTaskRegistry:
         cls.task.message = str(e)
         cls.task.save(using=database)
       raise
+    finally:
+      pool.shutdown()
+
+  @classmethod
+  def updateStatus(cls, database, status, message):
+    '''
+    Update the progress of the task.
+    Returns False when the task is being cancelled. The record isn't updated
+    in that case, so a cancellation request is never overwritten.
+    The progress stays in the task record, since the task screen and the
+    cancellation read it there. The record is only written when the
+    progress changed, otherwise the cancellation is checked with a query.
+    '''
+    if not cls.task:
+      return True
+    if cls.task.status == status and cls.task.message == message:
+      return not Task.objects.all().using(database) \
+        .filter(pk=cls.task.id, status='Canceling').exists()
+    cls.task.status = status
+    cls.task.message = message
+    return Task.objects.all().using(database) \
+      .filter(pk=cls.task.id).exclude(status='Canceling') \
+      .update(status=status, message=message) > 0
+
+  @classmethod
+  def _runStep(cls, step, database, kwargs):
+    start = datetime.now()
+    walltime = time.time()
+    cputime = time.process_time()
+    try:
+      step.run(database=database, **kwargs)
+      if cls.task:
+        cls._recordStep(step, database, start, time.time() - walltime, time.process_time() - cputime)
+    finally:
+      # Database connections are opened per thread
+      connections.close_all()
+
+  @classmethod
+  def _recordStep(cls, step, database, start, walltime, cputime):
+    '''
+    Store the performance statistics of a step.
+    The cpu time and the peak memory are measured for the complete process.
+    When steps run in parallel they are thus shared by these steps, and the
+    peak memory is the highest resident size of the process so far rather
+    than that of the step.
+    The object counts of the model are collected without logging them.
+    '''
+    try:
+      import resource
+      peakmemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+      if sys.platform == 'darwin':
+        # Reported in bytes rather than kilobytes
+        peakmemory //= 1024
+    except ImportError:
+      peakmemory = None
+    modelsize = None
+    if PlanTask.ENGINE_WRITE in step.resources:
+      try:
+        import frepple
+        modelsize = json.dumps(frepple.printsize(False))
+      except ImportError:
+        pass
+    TaskStep(
+      task=cls.task, sequence=step.sequence, description=step.description,
+      started=start, walltime=walltime, cputime=cputime,
+      peakmemory=peakmemory, modelsize=modelsize
+      ).save(using=database)
+
+  @classmethod
+  def getDependencies(cls, task_list):
+    '''
+    Returns a dictionary with the set of predecessors of each step in the list.
+
+    A step depends on an earlier step in the list when:
+      - it lists the step in its dependencies
+      - it doesn't declare its dependencies, and the other step has a lower
+        sequence number
+      - both steps use the same resource, and one of them updates it
+    Dependencies on steps that aren't in the list are replaced by the
+    dependencies of those steps. Predecessors which are already reached
+    through another predecessor are left out.
+    '''
+    reg = sorted(cls.reg, key=attrgetter('sequence'))
+    for i in task_list:
+      if i not in reg:
+        reg.append(i)
+    direct = {}
+    for idx, step in enumerate(reg):
+      direct[step] = set()
+      for prev in reg[:idx]:
+        if step.dependencies is None:
+          if prev.sequence < step.sequence:
+            direct[step].add(prev)
+            continue
+        elif prev in step.dependencies:
+          direct[step].add(prev)
+          continue
+        if step.conflictsWith(prev):
+          direct[step].add(prev)
+
+    def active(step, visited):
+      res = set()
+      for p in direct[step]:
+        if p in visited:
+          continue
+        visited.add(p)
+        if p in task_list:
+          res.add(p)
+        else:
+          res |= active(p, visited)
+      return res
+
+    result = { step: active(step, set()) for step in task_list }
+
+    # Transitive reduction
+    ancestors = {}
+
+    def allPredecessors(step):
+      if step not in ancestors:
+        ancestors[step] = set()
+        for p in result[step]:
+          ancestors[step] |= {p} | allPredecessors(p)
+      return ancestors[step]
+
+    return {
+      step: { p for p in preds if not any(p in allPredecessors(q) for q in preds if q != p) }
+      for step, preds in result.items()
+      }
 
 
 class PlanTask:
   '''
   Base class for steps in the plan generation process
+
+  Steps declare which steps need to finish before they can start, and which
+  resources they use. Steps without a dependency between them can run in
+  parallel.
+    - dependencies:
+      List of PlanTask classes this step depends on.
+      The default None makes the step depend on all steps with a lower
+      sequence number.
+    - resources:
+      List of resources the step uses. The planning engine is represented
+      by the resources ENGINE_READ and ENGINE_WRITE. Database tables are
+      represented by their name, and are always considered to be updated.
   '''
   description = ''
   sequence = None
   label = None
+  dependencies = None
+  resources = ()
+
+  ENGINE_READ = 'engine_read'
+  ENGINE_WRITE = 'engine_write'
+
+  @classmethod
+  def conflictsWith(cls, other):
+    '''
+    Returns true when two steps use a resource that one of them updates.
+    '''
+    for r in cls.resources:
+      if r == cls.ENGINE_READ:
+        if cls.ENGINE_WRITE in other.resources:
+          return True
+      elif r == cls.ENGINE_WRITE:
+        if cls.ENGINE_READ in other.resources or cls.ENGINE_WRITE in other.resources:
+          return True
+      elif r in other.resources:
+        return True
+    return False
 
   @staticmethod
   def getWeight(**kwargs):
@@ -166,6 +394,24 @@ class PlanTask:
   def run(**kwargs):
     print("Warning: PlanTask doesn't implement the run method")
 
+  @classmethod
+  def cancel(cls):
+    '''
+    Called from another thread when the task is cancelled while the step
+    is running. Long running steps can override this method to stop early.
+    '''
+    pass
+
+  @classmethod
+  def getProgress(cls):
+    '''
+    Called from another thread while the step is running, at most every
+    few seconds. Long running steps can override this method to report
+    their progress as a tuple with the completed fraction of the step and
+    a message. The default None reports no progress.
+    '''
+    return None
+
 
 if __name__ == "__main__":
   # Select database
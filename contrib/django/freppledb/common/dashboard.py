@@ -15,12 +15,22 @@
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+from concurrent.futures import ThreadPoolExecutor
 from importlib import import_module
+from time import mktime
 
 from django.conf import settings
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
-from django.http import HttpResponseNotAllowed, HttpResponseForbidden, HttpResponseServerError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import HttpRequest, HttpResponse, HttpResponseNotAllowed, HttpResponseForbidden, HttpResponseServerError, QueryDict
+from django.utils import translation
+from django.utils.encoding import force_text
+from django.utils.http import http_date
+
+from freppledb.common.cache import getCached, getPrecomputed, setPrecomputed
+from freppledb.common.middleware import _thread_locals
+from freppledb.common.models import User
 
 
 class Dashboard:
@@ -84,6 +94,18 @@ class Dashboard:
         return HttpResponseServerError("This widget is synchronous")
       if not w.has_permission(request.user):
         return HttpResponseForbidden()
+      if w.cacheable:
+        key = cls.getCacheKey(request)
+        precomputed = getPrecomputed('widget.%s' % name, request.database, key)
+        if precomputed:
+          # Content rendered at the end of the plan generation
+          response = HttpResponse(precomputed[0])
+          response['Last-Modified'] = http_date(mktime(precomputed[1].timetuple()))
+          return response
+        return HttpResponse(getCached(
+          'widget.%s' % name, request.database, key,
+          lambda: w.render(request).content
+          ))
       return w.render(request)
     except Exception as e:
       if settings.DEBUG:
@@ -92,6 +114,87 @@ class Dashboard:
         return HttpResponseServerError("Server error")
 
 
+  @classmethod
+  def getCacheKey(cls, request):
+    '''
+    Returns the key of the content of a cacheable widget. The content
+    depends on the widget arguments, the language and the report horizon
+    of the user.
+    '''
+    user = request.user
+    return repr((
+      sorted(request.GET.lists()), translation.get_language(),
+      user.horizonbuckets, user.horizonstart, user.horizonend,
+      user.horizontype, user.horizonlength, user.horizonunit
+      ))
+
+
+  @classmethod
+  def precompute(cls, database=DEFAULT_DB_ALIAS, task=None):
+    '''
+    Renders the cacheable widgets of the dashboard in advance.
+    A widget is rendered for every combination of language and report
+    horizon of the active users. For users with the language "auto" the
+    widgets are rendered in all languages. The widgets are rendered in
+    parallel on PLANTASK_THREADS threads.
+    '''
+    reg = cls.buildList()
+    widgets = []
+    for row in settings.DEFAULT_DASHBOARD:
+      for col in row['cols']:
+        for name, options in col['widgets']:
+          w = reg.get(name, None)
+          if w and w.asynchronous and w.cacheable:
+            args = w(**options).args
+            widgets.append((w, args() if callable(args) else args))
+
+    # Users with the same preferences see the same content
+    users = {}
+    for user in User.objects.using(DEFAULT_DB_ALIAS).filter(is_active=True):
+      if user.language == 'auto':
+        # The language is negotiated with the browser on each request
+        languages = [ i[0] for i in settings.LANGUAGES ]
+      else:
+        languages = [ user.language ]
+      for language in languages:
+        users.setdefault((
+          language, user.horizonbuckets, user.horizonstart, user.horizonend,
+          user.horizontype, user.horizonlength, user.horizonunit
+          ), (user, language))
+
+    def render(w, args, user, language):
+      request = HttpRequest()
+      request.method = 'GET'
+      request.GET = QueryDict(args.lstrip('?'))
+      request.user = user
+      request.database = database
+      request.prefix = database != DEFAULT_DB_ALIAS and '/%s' % database or ''
+      request.LANGUAGE_CODE = language
+      setattr(_thread_locals, 'request', request)
+      translation.activate(language)
+      try:
+        key = cls.getCacheKey(request)
+        setPrecomputed(
+          'widget.%s' % w.name, database, key,
+          force_text(w.render(request).content), task
+          )
+      finally:
+        setattr(_thread_locals, 'request', None)
+        translation.deactivate()
+        # Database connections are opened per thread
+        connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=max(1, getattr(settings, 'PLANTASK_THREADS', 1))) as pool:
+      futures = [
+        pool.submit(render, w, args, user, language)
+        for w, args in widgets
+        for user, language in users.values()
+        ]
+      for f in futures:
+        # Raise the first exception
+        f.result()
+
+
   @classmethod
   def createWidgetPermissions(cls, app):
     # Registered all permissions defined by dashboard widgets
@@ -133,6 +236,9 @@ class Widget:
       It returns a HTTPResponse object for asynchronous widgets.
     - Class attribute 'url' optionally defines a url to a report with a more
       complete content than can be displayed in the dashboard widget.
+    - Class attribute 'cacheable' can be set to true for asynchronous widgets
+      showing plan results. Their content is then kept in the report cache
+      till the next task finishes.
   '''
   name = "Undefined"
   title = "Undefined"
@@ -142,6 +248,7 @@ class Widget:
   exporturl = False     # Enable or disable a download icon
   args = ''             # Arguments passed in the url for asynchronous widgets
   javascript = ''       # Javascript called for rendering the widget
+  cacheable = False     # Cache the content of an asynchronous widget
 
   def __init__(self, **options):
     # Store all options as attributes on the instance
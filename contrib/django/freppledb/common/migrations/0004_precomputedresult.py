@@ -0,0 +1,50 @@
+#
+# Copyright (C) 2016 by frePPLe bvba
+#
+# This library is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0003_wizard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrecomputedResult',
+            fields=[
+                ('id', models.AutoField(verbose_name='identifier', primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=300, verbose_name='name', db_index=True)),
+                ('key', models.CharField(max_length=32, verbose_name='key')),
+                ('content', models.TextField(verbose_name='content')),
+                ('computed', models.DateTimeField(verbose_name='computed')),
+                ('task', models.IntegerField(blank=True, null=True, verbose_name='task')),
+                ('generation', models.CharField(blank=True, null=True, max_length=50, verbose_name='generation')),
+            ],
+            options={
+                'db_table': 'common_precomputedresult',
+                'verbose_name': 'precomputed result',
+                'verbose_name_plural': 'precomputed results',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='precomputedresult',
+            unique_together=set([('name', 'key')]),
+        ),
+    ]
@@ -438,6 +438,32 @@ class User(AbstractUser):
     verbose_name_plural = _('users')
 
 
+class PrecomputedResult(models.Model):
+  '''
+  Result of a report or dashboard widget computed in advance, typically
+  at the end of the plan generation.
+  The result is outdated as soon as a task finishes after the task which
+  computed it. Results computed without a task are outdated when any task
+  finishes.
+  '''
+  id = models.AutoField(_('identifier'), primary_key=True)
+  name = models.CharField(_('name'), max_length=300, db_index=True)
+  key = models.CharField(_('key'), max_length=32)
+  content = models.TextField(_('content'))
+  computed = models.DateTimeField(_('computed'))
+  task = models.IntegerField(_('task'), null=True, blank=True)
+  generation = models.CharField(_('generation'), max_length=50, null=True, blank=True)
+
+  class Meta:
+    db_table = "common_precomputedresult"
+    unique_together = (('name', 'key'),)
+    verbose_name = _('precomputed result')
+    verbose_name_plural = _('precomputed results')
+
+  def __str__(self):
+    return "%s %s" % (self.name, self.key)
+
+
 @receiver(pre_delete, sender=User)
 def delete_user(sender, instance, **kwargs):
   raise PermissionDenied
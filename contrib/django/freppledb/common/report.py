@@ -28,19 +28,22 @@ It provides the following functionality:
    The time buckets and time boundaries can easily be updated.
 '''
 
+import base64
 import codecs
 import collections
 import csv
 from datetime import date, datetime, timedelta
 from decimal import Decimal
 import functools
+import hashlib
 import math
 import operator
 import json
+import tempfile
 from io import StringIO, BytesIO
 from openpyxl import load_workbook, Workbook
 
-from django.db.models import Model
+from django.db.models import Model, Q
 from django.apps import apps
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_permission_codename
@@ -49,19 +52,20 @@ from django.views.decorators.csrf import csrf_protect
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.admin.utils import unquote, quote
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ValidationError, FieldDoesNotExist
 from django.core.management.color import no_style
 from django.db import connections, transaction, models
 from django.db.models.fields import Field, CharField, IntegerField, AutoField, DurationField
 from django.db.models.fields import DateField, DateTimeField, NOT_PROVIDED
 from django.db.models.fields.related import RelatedField
 from django.forms.models import modelform_factory
-from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.http import HttpResponseForbidden, HttpResponseNotAllowed
 from django.shortcuts import render
 from django.utils import translation, six
 from django.utils.decorators import method_decorator
 from django.utils.encoding import smart_str, iri_to_uri, force_text
+from django.utils.http import urlquote
 from django.utils.html import escape
 from django.utils.translation import ugettext as _
 from django.utils.formats import get_format
@@ -73,7 +77,10 @@ from django.contrib.contenttypes.models import ContentType
 from django.views.generic.base import View
 
 from freppledb.boot import getAttributes
+from freppledb.common.cache import getCached
+from freppledb.common.spreadsheet import streamWorkbook
 from freppledb.common.models import User, Comment, Wizard, Parameter, BucketDetail, Bucket, HierarchyModel
+from freppledb.execute.models import TaskStep
 from freppledb.admin import data_site
 
 
@@ -83,7 +90,8 @@ logger = logging.getLogger(__name__)
 
 # A list of models with some special, administrative purpose.
 # They should be excluded from bulk import, export and erasing actions.
-EXCLUDE_FROM_BULK_OPERATIONS = (Group, User, Comment, Wizard)
+EXCLUDE_FROM_BULK_OPERATIONS = (Group, User, Comment, Wizard, TaskStep)
+
 
 
 def getHorizon(request, future_only=False):
@@ -281,6 +289,65 @@ class GridFieldDuration(GridField):
   width = 80
 
 
+# Size of the chunks in which CSV exports are returned
+CSV_CHUNK_SIZE = 65536
+
+
+def _getModelField(model, field_name):
+  '''
+  Returns the model field of a lookup like "item__name", or None when it
+  isn't a database field.
+  '''
+  field = None
+  for name in field_name.split('__'):
+    if field:
+      model = field.related_model
+      if not model:
+        return None
+    try:
+      field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+    except FieldDoesNotExist:
+      return None
+    if not field.concrete:
+      return None
+  return field
+
+
+def _copyToCSV(database, sql):
+  '''
+  Generator returning the output of a "copy ... to stdout" statement in
+  chunks of CSV_CHUNK_SIZE characters.
+  The statement runs on the connection of the request, in the thread of the
+  generator. Its output is spooled to a temporary file, which only stays in
+  memory when it is small.
+  PostgreSQL ends the records with a line feed. It is replaced with the
+  carriage return and line feed written by the csv module for the other
+  reports. Line breaks within a quoted field are left unchanged.
+  '''
+  with tempfile.SpooledTemporaryFile(max_size=4 * CSV_CHUNK_SIZE) as f:
+    with connections[database].cursor() as cursor:
+      cursor.copy_expert(sql, f, CSV_CHUNK_SIZE)
+    f.seek(0)
+    # The database connection always uses the UTF-8 encoding.
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    quoted = False
+    while True:
+      data = f.read(CSV_CHUNK_SIZE)
+      chunk = decoder.decode(data, final=not data)
+      if chunk:
+        # Every quote character starts or ends a quoted field. An escaped
+        # quote is a pair of quotes and leaves the state unchanged.
+        parts = chunk.split('"')
+        for i in range(len(parts)):
+          if i:
+            quoted = not quoted
+          if not quoted:
+            parts[i] = parts[i].replace('\n', '\r\n')
+        yield '"'.join(parts)
+      if not data:
+        break
+
+
 def getBOM(encoding):
   try:
     # Get the official name of the encoding (since encodings can have many alias names)
@@ -401,6 +468,11 @@ class GridReport(View):
   # Define a list of actions
   actions = None
 
+  # Cache the data of the report in the report cache.
+  # Only reports showing plan results, which only change when a task
+  # finishes, can be cached.
+  cacheable = False
+
   _attributes_added = False
 
   @classmethod
@@ -408,6 +480,24 @@ class GridReport(View):
     return "%s.%s" % (cls.__module__, cls.__name__)
 
 
+  @classmethod
+  def getCacheKey(cls, request, *args):
+    '''
+    Returns a string identifying the data of the report for a request: the
+    filter, sort and page arguments, the horizon, the time buckets and the
+    language.
+    '''
+    return repr((
+      args,
+      sorted((k, v) for k, v in request.GET.lists() if k not in ('nd', '_')),
+      getattr(request, 'report_startdate', None),
+      getattr(request, 'report_enddate', None),
+      getattr(request, 'report_bucket', None),
+      request.pagesize,
+      translation.get_language()
+      ))
+
+
   @classmethod
   def getAppLabel(cls):
     '''
@@ -550,41 +640,82 @@ class GridReport(View):
 
 
   @classmethod
-  def _generate_spreadsheet_data(reportclass, request, *args, **kwargs):
-    # Create a workbook
-    wb = Workbook(write_only=True)
-    title = force_text(reportclass.model and reportclass.model._meta.verbose_name or reportclass.title)
-    ws = wb.create_sheet(title=title)
-
-    # Write a header row
-    ws.append([ force_text(f.title).title() for f in reportclass.rows if f.title and not f.hidden ])
+  def _generate_spreadsheet_rows(reportclass, request, *args, **kwargs):
+    # Header row
+    yield [ force_text(f.title).title() for f in reportclass.rows if f.title and not f.hidden ]
 
     # Loop over all records
     fields = [ i.field_name for i in reportclass.rows if i.field_name and not i.hidden]
+    query = reportclass._get_export_query(request, *args, **kwargs)
+    for row in hasattr(reportclass, 'query') and reportclass.query(request, query) or query.values(*fields).iterator():
+      if hasattr(row, "__getitem__"):
+        yield [ _getCellValue(row[f]) for f in fields ]
+      else:
+        yield [ _getCellValue(getattr(row, f)) for f in fields ]
+
 
+  @classmethod
+  def _get_export_query(reportclass, request, *args, **kwargs):
     if isinstance(reportclass.basequeryset, collections.Callable):
-      query = reportclass._apply_sort(request, reportclass.filter_items(request, reportclass.basequeryset(request, args, kwargs), False).using(request.database))
+      return reportclass._apply_sort(request, reportclass.filter_items(request, reportclass.basequeryset(request, args, kwargs), False).using(request.database))
     else:
-      query = reportclass._apply_sort(request, reportclass.filter_items(request, reportclass.basequeryset).using(request.database))
-    for row in hasattr(reportclass, 'query') and reportclass.query(request, query) or query.values(*fields):
+      return reportclass._apply_sort(request, reportclass.filter_items(request, reportclass.basequeryset).using(request.database))
 
-      if hasattr(row, "__getitem__"):
-        ws.append([ _getCellValue(row[f]) for f in fields ])
-      else:
-        ws.append([ _getCellValue(getattr(row, f)) for f in fields ])
 
-    # Write the spreadsheet from memory to a string and then to a HTTP response
-    output = BytesIO()
-    wb.save(output)
-    response = HttpResponse(
+  @classmethod
+  def _get_export_size(reportclass, request, *args, **kwargs):
+    '''
+    Returns the (estimated) number of rows in a spreadsheet export.
+    '''
+    return reportclass._count_records(request, reportclass._get_export_query(request, *args, **kwargs))[0]
+
+
+  @classmethod
+  def _get_export_filename(reportclass):
+    return force_text(reportclass.model and reportclass.model._meta.verbose_name or reportclass.title)
+
+
+  @classmethod
+  def _generate_spreadsheet_data(reportclass, request, *args, **kwargs):
+    # The workbook is streamed to the browser while the rows are read from
+    # the database.
+    title = force_text(reportclass.model and reportclass.model._meta.verbose_name or reportclass.title)
+    response = StreamingHttpResponse(
       content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-      content=output.getvalue()
+      streaming_content=streamWorkbook(title, reportclass._generate_spreadsheet_rows(request, *args, **kwargs))
       )
-    response['Content-Disposition'] = 'attachment; filename=%s.xlsx' % title
+    response['Content-Disposition'] = 'attachment; filename=%s.xlsx' % reportclass._get_export_filename()
     response['Cache-Control'] = "no-cache, no-store"
     return response
 
 
+  @classmethod
+  def _generate_spreadsheet_task(reportclass, request, *args, **kwargs):
+    '''
+    Exports the spreadsheet in a background task, and returns a redirect to
+    the task list where the file can be downloaded when the task is finished.
+    '''
+    from freppledb.execute.models import Task
+    from freppledb.execute.views import launchWorker
+    arguments = request.GET.copy()
+    for i in ('nd', '_'):
+      if i in arguments:
+        del arguments[i]
+    task = Task(
+      name='export report', submitted=datetime.now(), status='Waiting', user=request.user,
+      arguments="--report=%s --arguments=%s" % (reportclass.getKey(), urlquote(arguments.urlencode(), safe=''))
+      )
+    if args and args[0]:
+      task.arguments += " --entity=%s" % urlquote(args[0], safe='')
+    task.save(using=request.database)
+    launchWorker(request.database)
+    messages.add_message(
+      request, messages.INFO,
+      force_text(_('The export is too large to download directly. The file will be available in task %s.') % task.id)
+      )
+    return HttpResponseRedirect('%s/execute/' % request.prefix)
+
+
   @classmethod
   def _generate_csv_data(reportclass, request, *args, **kwargs):
     sf = StringIO()
@@ -614,16 +745,22 @@ class GridReport(View):
 
     # Write a header row
     yield sf.getvalue()
+    sf.seek(0)
+    sf.truncate(0)
 
     # Write the report content
     if isinstance(reportclass.basequeryset, collections.Callable):
       query = reportclass._apply_sort(request, reportclass.filter_items(request, reportclass.basequeryset(request, args, kwargs), False).using(request.database))
     else:
       query = reportclass._apply_sort(request, reportclass.filter_items(request, reportclass.basequeryset).using(request.database))
-    for row in hasattr(reportclass, 'query') and reportclass.query(request, query) or query.values(*fields):
-      # Clear the return string buffer
-      sf.seek(0)
-      sf.truncate(0)
+    if not hasattr(reportclass, 'query'):
+      # The database formats the records itself
+      sql = reportclass._get_csv_sql(query, fields, decimal_separator)
+      if sql:
+        for chunk in _copyToCSV(query.db, sql):
+          yield chunk
+        return
+    for row in hasattr(reportclass, 'query') and reportclass.query(request, query) or query.values(*fields).iterator():
       # Build the return value, encoding all output
       if hasattr(row, "__getitem__"):
         writer.writerow([
@@ -635,8 +772,53 @@ class GridReport(View):
           force_text(_localize(getattr(row, f), decimal_separator), encoding=encoding, errors='ignore') if getattr(row, f) is not None else ''
           for f in fields
           ])
-      # Return string
-      yield sf.getvalue()
+      # Return the rows in large chunks
+      if sf.tell() > CSV_CHUNK_SIZE:
+        yield sf.getvalue()
+        sf.seek(0)
+        sf.truncate(0)
+    yield sf.getvalue()
+
+
+  @classmethod
+  def _get_csv_sql(reportclass, query, fields, decimal_separator):
+    '''
+    Returns a SQL statement formatting the records of the query in the
+    same way as the function _localize, or None when the query can't be
+    exported in the database.
+    '''
+    query = query.values(*fields)
+    if query.query.extra_select or query.query.annotation_select:
+      return None
+    columns = []
+    for idx, f in enumerate(fields):
+      field = _getModelField(query.model, f)
+      if field is None:
+        return None
+      col = '"Col%d"' % (idx + 1)
+      fieldtype = field.get_internal_type()
+      if fieldtype in ('DecimalField', 'FloatField') and decimal_separator == ',':
+        col = "replace(%s::text, '.', ',')" % col
+      elif fieldtype in ('BooleanField', 'NullBooleanField'):
+        col = "case when %s then 'True' when not %s then 'False' end" % (col, col)
+      elif fieldtype == 'DurationField':
+        # Same representation as the seconds returned by timedelta.total_seconds()
+        col = "case when extract(epoch from %s) = trunc(extract(epoch from %s)) " \
+          "then trunc(extract(epoch from %s))::bigint || '.0' " \
+          "else extract(epoch from %s)::float8::text end" % (col, col, col, col)
+      elif fieldtype == 'DateTimeField':
+        col = "to_char(%s, 'YYYY-MM-DD HH24:MI:SS')" % col
+      elif fieldtype == 'DateField':
+        col = "to_char(%s, 'YYYY-MM-DD')" % col
+      else:
+        col = "%s::text" % col
+      columns.append("coalesce(%s, '')" % col)
+    sql, params = query.query.get_compiler(query.db).as_sql(with_col_aliases=True)
+    cursor = connections[query.db].cursor()
+    sql = cursor.cursor.mogrify(sql, params).decode('utf-8')
+    return "copy (select %s from (%s) data) to stdout with (format csv, delimiter '%s', force_quote *)" % (
+      ', '.join(columns), sql, decimal_separator == ',' and ';' or ','
+      )
 
 
   @classmethod
@@ -656,6 +838,9 @@ class GridReport(View):
         asc = False
     if not sort:
       return query  # No sorting
+    elif query.model and sort != query.model._meta.pk.name:
+      # The primary key makes the sort order unique
+      return query.order_by(asc and sort or ('-%s' % sort), 'pk')
     else:
       return query.order_by(asc and sort or ('-%s' % sort))
       if reportclass.model.__base__ and reportclass.model.__base__ != models.Model:
@@ -695,6 +880,162 @@ class GridReport(View):
       return "%s asc" % sort
 
 
+  @classmethod
+  def _count_records(reportclass, request, query):
+    '''
+    Returns a tuple with the number of records in the query, and a flag
+    whether this number is an estimate.
+    The argument "count" of the request selects how the records are
+    counted. The default is the setting GRID_COUNT:
+      - exact: count all records
+      - estimate: use the estimate of the database when it is above the
+        setting GRID_COUNT_THRESHOLD, and count the records otherwise
+      - none: don't count the records. The number returned is None.
+    Exact counts above GRID_COUNT_THRESHOLD are kept for GRID_COUNT_CACHE
+    seconds in the report cache, which is shared by all processes.
+    '''
+    mode = request.GET.get('count', getattr(settings, 'GRID_COUNT', 'exact'))
+    if mode == 'none':
+      return (None, True)
+    threshold = getattr(settings, 'GRID_COUNT_THRESHOLD', 100000)
+    sql, params = query.query.get_compiler(query.db).as_sql()
+    if mode == 'estimate':
+      cursor = connections[query.db].cursor()
+      cursor.execute('explain (format json) ' + sql, params)
+      plan = cursor.fetchone()[0]
+      if isinstance(plan, str):
+        plan = json.loads(plan)
+      estimate = int(plan[0]['Plan']['Plan Rows'])
+      if estimate >= threshold:
+        return (estimate, True)
+    counted = []
+
+    def count():
+      # Small counts aren't cached
+      counted.append(query.count())
+      return counted[0] if counted[0] >= threshold else None
+
+    recs = getCached(
+      'grid count', query.db, '%s|%s' % (sql, params), count,
+      getattr(settings, 'GRID_COUNT_CACHE', 60)
+      )
+    return (counted[0] if recs is None else recs, False)
+
+
+  @classmethod
+  def _get_keyset(reportclass, query):
+    '''
+    Returns the list of fields the query is sorted on, as tuples (name,
+    ascending, field). The last field is always the primary key.
+    None is returned when the sort order isn't unique or uses fields that
+    aren't stored in the database.
+    '''
+    if not query.query.order_by or not query.model:
+      return None
+    keyset = []
+    for o in query.query.order_by:
+      name = o.lstrip('-')
+      if name == 'pk':
+        name = query.model._meta.pk.name
+      opts = query.model._meta
+      try:
+        for part in name.split('__'):
+          field = opts.get_field(part)
+          if field.is_relation:
+            opts = field.related_model._meta
+      except FieldDoesNotExist:
+        return None
+      if field.is_relation or not field.concrete:
+        return None
+      keyset.append( (name, not o.startswith('-'), field) )
+    if keyset[-1][0] != query.model._meta.pk.name:
+      return None
+    return keyset
+
+
+  @classmethod
+  def _get_cursor_signature(reportclass, query):
+    sql, params = query.query.get_compiler(query.db).as_sql()
+    return hashlib.md5(('%s%s' % (sql, params)).encode('utf-8')).hexdigest()[:12]
+
+
+  @classmethod
+  def _encode_cursor(reportclass, query, page, values):
+    '''
+    Returns a token pointing at the last record of a page.
+    '''
+    key = []
+    for v in values:
+      if isinstance(v, (datetime, date)):
+        key.append(v.isoformat())
+      elif isinstance(v, timedelta):
+        key.append(v.total_seconds())
+      elif isinstance(v, Decimal):
+        key.append(str(v))
+      else:
+        key.append(v)
+    return base64.urlsafe_b64encode(json.dumps({
+      'page': page, 'sig': reportclass._get_cursor_signature(query), 'key': key
+      }).encode('utf-8')).decode('ascii')
+
+
+  @classmethod
+  def _decode_cursor(reportclass, token, query, keyset, page):
+    '''
+    Returns the values of the sort fields stored in a cursor token, or None
+    if the token doesn't point at the end of the given page of this query.
+    '''
+    try:
+      data = json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+      if data['page'] != page or data['sig'] != reportclass._get_cursor_signature(query):
+        return None
+      values = []
+      for k, v in zip(keyset, data['key']):
+        if v is None:
+          values.append(None)
+        elif isinstance(k[2], DurationField):
+          values.append(timedelta(seconds=v))
+        else:
+          values.append(k[2].to_python(v))
+      return values if len(values) == len(keyset) else None
+    except Exception:
+      return None
+
+
+  @classmethod
+  def _get_page(reportclass, request, query, page):
+    '''
+    Returns a queryset with the records of a page, plus the first record of
+    the next page, and the keyset of the query.
+    When the request has a cursor pointing at the end of the previous page,
+    the records are selected with a filter on the sort fields. Seeking the
+    records this way is much faster on large tables than skipping over
+    all records of the previous pages with an offset.
+    PostgreSQL puts null values last in ascending order and first in
+    descending order. The filter does the same.
+    '''
+    keyset = reportclass._get_keyset(query)
+    if keyset and page > 1 and 'cursor' in request.GET:
+      values = reportclass._decode_cursor(request.GET['cursor'], query, keyset, page - 1)
+      if values is not None:
+        after = Q(pk__in=[])
+        equal = Q()
+        for (name, asc, field), value in zip(keyset, values):
+          if value is None:
+            if not asc:
+              after |= equal & Q(**{'%s__isnull' % name: False})
+            equal &= Q(**{'%s__isnull' % name: True})
+          else:
+            if asc:
+              after |= equal & (Q(**{'%s__gt' % name: value}) | Q(**{'%s__isnull' % name: True}))
+            else:
+              after |= equal & Q(**{'%s__lt' % name: value})
+            equal &= Q(**{name: value})
+        return (query.filter(after)[:request.pagesize + 1], keyset)
+    cnt = (page - 1) * request.pagesize
+    return (query[cnt:cnt + request.pagesize + 1], keyset)
+
+
   @classmethod
   def _generate_json_data(reportclass, request, *args, **kwargs):
     page = 'page' in request.GET and int(request.GET['page']) or 1
@@ -702,24 +1043,41 @@ class GridReport(View):
       query = reportclass.filter_items(request, reportclass.basequeryset(request, args, kwargs), False).using(request.database)
     else:
       query = reportclass.filter_items(request, reportclass.basequeryset).using(request.database)
-    recs = query.count()
-    total_pages = math.ceil(float(recs) / request.pagesize)
-    if page > total_pages:
-      page = total_pages
+    recs, estimated = reportclass._count_records(request, query)
+    if recs is not None:
+      total_pages = math.ceil(float(recs) / request.pagesize)
+      if page > total_pages:
+        page = total_pages
     if page < 1:
       page = 1
     query = reportclass._apply_sort(request, query)
-
-    yield '{"total":%d,\n' % total_pages
-    yield '"page":%d,\n' % page
-    yield '"records":%d,\n' % recs
-    yield '"rows":[\n'
-    cnt = (page - 1) * request.pagesize + 1
-    first = True
+    pagequery, keyset = reportclass._get_page(request, query, page)
 
     # GridReport
     fields = [ i.field_name for i in reportclass.rows if i.field_name ]
-    for i in hasattr(reportclass, 'query') and reportclass.query(request, query[cnt - 1:cnt + request.pagesize]) or query[cnt - 1:cnt + request.pagesize].values(*fields):
+    keyfields = [ k[0] for k in keyset ] if keyset else []
+    keys = None
+    if hasattr(reportclass, 'query'):
+      # The query can return any number of rows for the records of the page,
+      # and all of them are returned. The records of the page, their sort
+      # fields and the first record of the next page are retrieved in a
+      # separate query.
+      keys = list(pagequery.values_list(*(keyfields or ['pk'])))
+      rows = reportclass.query(request, pagequery[:request.pagesize])
+    else:
+      rows = pagequery.values(*(fields + [ k for k in keyfields if k not in fields ]))
+
+    yield '{"rows":[\n'
+    first = True
+    count = 0
+    last = None
+    for i in rows:
+      count += 1
+      if keys is None:
+        if count > request.pagesize:
+          break
+        if keyset:
+          last = [ i[k] for k in keyfields ]
       if first:
         r = [ '{' ]
         first = False
@@ -743,7 +1101,22 @@ class GridReport(View):
           r.append(', "%s":%s' % (f.name, s))
       r.append('}')
       yield ''.join(r)
-    yield '\n]}\n'
+
+    # Generate the page information
+    if keys is not None:
+      count = len(keys)
+      if keyset and count >= request.pagesize:
+        last = keys[request.pagesize - 1]
+    more = count > request.pagesize
+    if recs is None:
+      recs = (page - 1) * request.pagesize + min(count, request.pagesize) + (1 if more else 0)
+      total_pages = page + (1 if more else 0)
+    info = [ '"records":%d' % recs, '"total":%d' % total_pages, '"page":%d' % page ]
+    if estimated:
+      info.append('"estimated":true')
+    if more and last is not None:
+      info.append('"cursor":"%s"' % reportclass._encode_cursor(query, page, last))
+    yield '\n],\n%s}\n' % ',\n'.join(info)
 
 
   @classmethod
@@ -820,14 +1193,26 @@ class GridReport(View):
       return render(request, reportclass.template, context)
     elif fmt == 'json':
       # Return JSON data to fill the grid.
+      if reportclass.cacheable:
+        content = [ getCached(
+          reportclass.getKey(), request.database, reportclass.getCacheKey(request, *args),
+          lambda: ''.join(reportclass._generate_json_data(request, *args, **kwargs))
+          ) ]
+      else:
+        content = reportclass._generate_json_data(request, *args, **kwargs)
       response = StreamingHttpResponse(
         content_type='application/json; charset=%s' % settings.DEFAULT_CHARSET,
-        streaming_content=reportclass._generate_json_data(request, *args, **kwargs)
+        streaming_content=content
         )
       response['Cache-Control'] = "no-cache, no-store"
       return response
     elif fmt in ('spreadsheetlist', 'spreadsheettable', 'spreadsheet'):
-      # Return an excel spreadsheet
+      # Return an excel spreadsheet.
+      # Very large spreadsheets are generated in a background task.
+      if not getattr(request, 'export_task', None):
+        size = reportclass._get_export_size(request, *args, **kwargs)
+        if size and size > getattr(settings, 'SPREADSHEET_BACKGROUND_RECORDS', 100000):
+          return reportclass._generate_spreadsheet_task(request, *args, **kwargs)
       return reportclass._generate_spreadsheet_data(request, *args, **kwargs)
     elif fmt in ('csvlist', 'csvtable', 'csv'):
       # Return CSV data to export the data
@@ -1604,18 +1989,29 @@ class GridPivot(GridReport):
         asc = False
       for i in reportclass.rows:
         if i.name == sort and i.search:
-          return query.order_by(asc and i.field_name or ('-%s' % i.field_name))
+          return reportclass._order_by(query, i.field_name, asc)
       # Sorting on nonexisting field
       return query
     elif reportclass.default_sort:
-      if reportclass.default_sort[1] == 'desc':
-        return query.order_by('-%s' % reportclass.rows[reportclass.default_sort[0]].field_name)
-      else:
-        return query.order_by(reportclass.rows[reportclass.default_sort[0]].field_name)
+      return reportclass._order_by(
+        query, reportclass.rows[reportclass.default_sort[0]].field_name,
+        reportclass.default_sort[1] != 'desc'
+        )
     else:
       return query
 
 
+  @classmethod
+  def _order_by(reportclass, query, field_name, asc):
+    '''
+    Sorts the query on a field. The primary key makes the sort order unique.
+    '''
+    if field_name == query.model._meta.pk.name:
+      return query.order_by(asc and field_name or ('-%s' % field_name))
+    else:
+      return query.order_by(asc and field_name or ('-%s' % field_name), 'pk')
+
+
   @classmethod
   def _apply_sort_index(reportclass, request):
     '''
@@ -1637,6 +2033,8 @@ class GridPivot(GridReport):
   @classmethod
   def _generate_json_data(reportclass, request, *args, **kwargs):
     # Prepare the query
+    estimated = False
+    cursor = None
     if args and args[0]:
       page = 1
       recs = 1
@@ -1645,32 +2043,39 @@ class GridPivot(GridReport):
     else:
       page = 'page' in request.GET and int(request.GET['page']) or 1
       if isinstance(reportclass.basequeryset, collections.Callable):
-        recs = reportclass.filter_items(request, reportclass.basequeryset(request, args, kwargs), False).using(request.database).count()
+        basequery = reportclass.filter_items(request, reportclass.basequeryset(request, args, kwargs), False).using(request.database)
       else:
-        recs = reportclass.filter_items(request, reportclass.basequeryset).using(request.database).count()
-      total_pages = math.ceil(float(recs) / request.pagesize)
-      if page > total_pages:
-        page = total_pages
+        basequery = reportclass.filter_items(request, reportclass.basequeryset).using(request.database)
+      recs, estimated = reportclass._count_records(request, basequery)
+      if recs is not None:
+        total_pages = math.ceil(float(recs) / request.pagesize)
+        if page > total_pages:
+          page = total_pages
       if page < 1:
         page = 1
-      cnt = (page - 1) * request.pagesize + 1
-      if isinstance(reportclass.basequeryset, collections.Callable):
-        query = reportclass.query(
-          request,
-          reportclass._apply_sort(request, reportclass.filter_items(request, reportclass.basequeryset(request, args, kwargs), False)).using(request.database)[cnt - 1:cnt + request.pagesize],
-          sortsql=reportclass._apply_sort_index(request)
-          )
-      else:
-        query = reportclass.query(
-          request,
-          reportclass._apply_sort(request, reportclass.filter_items(request, reportclass.basequeryset)).using(request.database)[cnt - 1:cnt + request.pagesize],
-          sortsql=reportclass._apply_sort_index(request)
-          )
+      basequery = reportclass._apply_sort(request, basequery)
+      pagequery, keyset = reportclass._get_page(request, basequery, page)
+      # The sort fields and the first record of the next page
+      keys = list(pagequery.values_list(*([ k[0] for k in keyset ] if keyset else ['pk'])))
+      more = len(keys) > request.pagesize
+      if recs is None:
+        recs = (page - 1) * request.pagesize + min(len(keys), request.pagesize) + (1 if more else 0)
+        total_pages = page + (1 if more else 0)
+      if keyset and more:
+        cursor = reportclass._encode_cursor(basequery, page, keys[request.pagesize - 1])
+      query = reportclass.query(
+        request, pagequery[:request.pagesize],
+        sortsql=reportclass._apply_sort_index(request)
+        )
 
     # Generate header of the output
     yield '{"total":%d,\n' % total_pages
     yield '"page":%d,\n' % page
     yield '"records":%d,\n' % recs
+    if estimated:
+      yield '"estimated":true,\n'
+    if cursor:
+      yield '"cursor":"%s",\n' % cursor
     yield '"rows":[\n'
 
     # Generate output
@@ -1755,14 +2160,14 @@ class GridPivot(GridReport):
       fields.extend([ capfirst(force_text(_('data field'), encoding=encoding, errors='ignore')) ])
       fields.extend([ force_text(b['name'], encoding=encoding, errors='ignore') for b in request.report_bucketlist])
     writer.writerow(fields)
-    yield sf.getvalue()
+    if sf.tell() > CSV_CHUNK_SIZE:
+      yield sf.getvalue()
+      sf.seek(0)
+      sf.truncate(0)
 
     # Write the report content
     if listformat:
       for row in query:
-        # Clear the return string buffer
-        sf.seek(0)
-        sf.truncate(0)
         # Data for rows
         if hasattr(row, "__getitem__"):
           fields = [
@@ -1786,9 +2191,11 @@ class GridPivot(GridReport):
             force_text(_localize(getattr(row, f[0]), decimal_separator), encoding=encoding, errors='ignore') if getattr(row, f[0]) is not None else ''
             for f in reportclass.crosses
             ])
-        # Return string
         writer.writerow(fields)
-        yield sf.getvalue()
+        if sf.tell() > CSV_CHUNK_SIZE:
+          yield sf.getvalue()
+          sf.seek(0)
+          sf.truncate(0)
     else:
       currentkey = None
       for row in query:
@@ -1803,9 +2210,6 @@ class GridPivot(GridReport):
           for cross in reportclass.crosses:
             if 'visible' in cross[1] and not cross[1]['visible']:
               continue
-            # Clear the return string buffer
-            sf.seek(0)
-            sf.truncate(0)
             fields = [
               force_text(row_of_buckets[0][s.name], encoding=encoding, errors='ignore')
               for s in reportclass.rows
@@ -1818,18 +2222,17 @@ class GridPivot(GridReport):
               force_text(_localize(bucket[cross[0]], decimal_separator), encoding=encoding, errors='ignore')
               for bucket in row_of_buckets
               ])
-            # Return string
             writer.writerow(fields)
-            yield sf.getvalue()
+            if sf.tell() > CSV_CHUNK_SIZE:
+              yield sf.getvalue()
+              sf.seek(0)
+              sf.truncate(0)
           currentkey = row[reportclass.rows[0].name]
           row_of_buckets = [row]
       # Write the last entity
       for cross in reportclass.crosses:
         if 'visible' in cross[1] and not cross[1]['visible']:
           continue
-        # Clear the return string buffer
-        sf.seek(0)
-        sf.truncate(0)
         fields = [
           force_text(row_of_buckets[0][s.name], encoding=encoding, errors='ignore')
           for s in reportclass.rows
@@ -1840,25 +2243,50 @@ class GridPivot(GridReport):
           force_text(_localize(bucket[cross[0]], decimal_separator), encoding=encoding, errors='ignore')
           for bucket in row_of_buckets
           ])
-        # Return string
         writer.writerow(fields)
-        yield sf.getvalue()
+        if sf.tell() > CSV_CHUNK_SIZE:
+          yield sf.getvalue()
+          sf.seek(0)
+          sf.truncate(0)
+    yield sf.getvalue()
 
 
   @classmethod
-  def _generate_spreadsheet_data(reportclass, request, *args, **kwargs):
-    # Create a workbook
-    wb = Workbook(write_only=True)
-    ws = wb.create_sheet(title=force_text(reportclass.model._meta.verbose_name))
+  def _get_export_query(reportclass, request, *args, **kwargs):
+    if args and args[0]:
+      return reportclass.basequeryset.filter(pk__exact=args[0]).using(request.database)
+    elif isinstance(reportclass.basequeryset, collections.Callable):
+      return reportclass.filter_items(request, reportclass.basequeryset(request, args, kwargs), False).using(request.database)
+    else:
+      return reportclass.filter_items(request, reportclass.basequeryset).using(request.database)
+
+
+  @classmethod
+  def _get_export_size(reportclass, request, *args, **kwargs):
+    # Each object has a row per time bucket and a row per cross
+    recs = reportclass._count_records(request, reportclass._get_export_query(request, *args, **kwargs))[0]
+    if recs is None:
+      return None
+    elif request.GET.get('format', 'spreadsheetlist') == 'spreadsheetlist':
+      return recs * len(request.report_bucketlist)
+    else:
+      return recs * len(reportclass.crosses)
+
+
+  @classmethod
+  def _get_export_filename(reportclass):
+    return force_text(reportclass.model._meta.model_name)
+
 
+  @classmethod
+  def _generate_spreadsheet_rows(reportclass, request, *args, **kwargs):
     # Prepare the query
     listformat = (request.GET.get('format', 'spreadsheetlist') == 'spreadsheetlist')
+    basequery = reportclass._get_export_query(request, *args, **kwargs)
     if args and args[0]:
-      query = reportclass.query(request, reportclass.basequeryset.filter(pk__exact=args[0]).using(request.database), sortsql="1 asc")
-    elif isinstance(reportclass.basequeryset, collections.Callable):
-      query = reportclass.query(request, reportclass.filter_items(request, reportclass.basequeryset(request, args, kwargs), False).using(request.database), sortsql=reportclass._apply_sort_index(request))
+      query = reportclass.query(request, basequery, sortsql="1 asc")
     else:
-      query = reportclass.query(request, reportclass.filter_items(request, reportclass.basequeryset).using(request.database), sortsql=reportclass._apply_sort_index(request))
+      query = reportclass.query(request, basequery, sortsql=reportclass._apply_sort_index(request))
 
     # Write a header row
     fields = [
@@ -1872,7 +2300,7 @@ class GridPivot(GridReport):
     else:
       fields.extend( [capfirst(_('data field'))])
       fields.extend([ str(b['name']) for b in request.report_bucketlist])
-    ws.append(fields)
+    yield fields
 
     # Write the report content
     if listformat:
@@ -1894,7 +2322,7 @@ class GridPivot(GridReport):
             ]
           fields.extend([ _getCellValue(getattr(row, 'bucket')) ])
           fields.extend([ _getCellValue(getattr(row, f[0])) for f in reportclass.crosses ])
-        ws.append(fields)
+        yield fields
     else:
       currentkey = None
       row_of_buckets = None
@@ -1917,7 +2345,7 @@ class GridPivot(GridReport):
               ]
             fields.extend([ _getCellValue(('title' in cross[1] and capfirst(_(cross[1]['title'])) or capfirst(_(cross[0])))) ])
             fields.extend([ _getCellValue(bucket[cross[0]]) for bucket in row_of_buckets ])
-            ws.append(fields)
+            yield fields
           currentkey = row[reportclass.rows[0].name]
           row_of_buckets = [row]
       # Write the last row
@@ -1932,18 +2360,7 @@ class GridPivot(GridReport):
             ]
           fields.extend([ _getCellValue(('title' in cross[1] and capfirst(_(cross[1]['title'])) or capfirst(_(cross[0])))) ])
           fields.extend([ _getCellValue(bucket[cross[0]]) for bucket in row_of_buckets ])
-          ws.append(fields)
-
-    # Write the spreadsheet from memory to a string and then to a HTTP response
-    output = BytesIO()
-    wb.save(output)
-    response = HttpResponse(
-      content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-      content=output.getvalue()
-      )
-    response['Content-Disposition'] = 'attachment; filename=%s.xlsx' % reportclass.model._meta.model_name
-    response['Cache-Control'] = "no-cache, no-store"
-    return response
+          yield fields
 
 
 numericTypes = (Decimal, float) + six.integer_types
@@ -0,0 +1,224 @@
+#
+# Copyright (C) 2016 by frePPLe bvba
+#
+# This library is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+r'''
+Streaming writer for Excel spreadsheets.
+
+A spreadsheet is generated as a sequence of byte chunks while the rows are
+read from the database. Only the current chunk is kept in memory, which
+allows exporting reports of any size with a constant memory footprint.
+
+The xlsx file is a zip archive. The archive is written without seeking back
+in the output: the checksum and sizes of each file follow its data in a data
+descriptor, as allowed by the zip specification. The size of the archive is
+limited to 4GB, since the zip64 extensions aren't supported.
+'''
+
+from datetime import date, datetime, time, timedelta
+import re
+import struct
+import zlib
+from xml.sax.saxutils import escape, quoteattr
+
+from django.utils import six
+
+
+# Size of the uncompressed data buffered before a chunk is compressed
+CHUNK_SIZE = 65536
+
+# Characters not allowed in a XML document
+_illegal_xml = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Characters not allowed in a sheet name
+_illegal_sheetname = re.compile(r'[\\/*?:\[\]]')
+
+_epoch = datetime(1899, 12, 30)
+
+_content_types = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>'''
+
+_rels = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>'''
+
+_workbook = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name=%s sheetId="1" r:id="rId1"/></sheets>
+</workbook>'''
+
+_workbook_rels = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>'''
+
+# Style 1 is used for date-times, style 2 for dates and style 3 for times.
+_styles = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="2"><numFmt numFmtId="164" formatCode="yyyy-mm-dd h:mm:ss"/><numFmt numFmtId="165" formatCode="h:mm:ss"/></numFmts>
+<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="4">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+</cellXfs>
+<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>
+</styleSheet>'''
+
+_sheet_start = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'''
+
+_sheet_end = '</sheetData></worksheet>'
+
+
+class ZipStream:
+  '''
+  Writes a zip archive as a sequence of byte chunks.
+  '''
+  def __init__(self):
+    self.offset = 0
+    self.entries = []
+    now = datetime.now()
+    self.dostime = (now.hour << 11) | (now.minute << 5) | (now.second // 2)
+    self.dosdate = ((now.year - 1980) << 9) | (now.month << 4) | now.day
+
+  def file(self, name, content):
+    '''
+    Generator returning the bytes of a file in the archive.
+    The content argument is an iterable of strings.
+    '''
+    name = name.encode('utf-8')
+    header = struct.pack(
+      '<4s5H3L2H', b'PK\x03\x04', 20, 0x08, 8, self.dostime, self.dosdate,
+      0, 0, 0, len(name), 0
+      ) + name
+    start = self.offset
+    self.offset += len(header)
+    yield header
+    crc = 0
+    size = 0
+    compressed = 0
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    for data in content:
+      data = data.encode('utf-8')
+      crc = zlib.crc32(data, crc)
+      size += len(data)
+      data = compressor.compress(data)
+      if data:
+        compressed += len(data)
+        yield data
+    data = compressor.flush()
+    compressed += len(data)
+    if size >= 0xffffffff or self.offset + compressed >= 0xffffffff:
+      raise Exception("Spreadsheet exceeds the maximum size of 4GB")
+    crc &= 0xffffffff
+    data += struct.pack('<4s3L', b'PK\x07\x08', crc, compressed, size)
+    self.offset += compressed + 16
+    self.entries.append( (name, crc, compressed, size, start) )
+    yield data
+
+  def close(self):
+    '''
+    Returns the bytes of the central directory, which end the archive.
+    '''
+    directory = []
+    for name, crc, compressed, size, start in self.entries:
+      directory.append(struct.pack(
+        '<4s6H3L5H2L', b'PK\x01\x02', 20, 20, 0x08, 8, self.dostime, self.dosdate,
+        crc, compressed, size, len(name), 0, 0, 0, 0, 0, start
+        ))
+      directory.append(name)
+    directory = b''.join(directory)
+    return directory + struct.pack(
+      '<4s4H2LH', b'PK\x05\x06', 0, 0, len(self.entries), len(self.entries),
+      len(directory), self.offset, 0
+      )
+
+
+def _getCell(value):
+  if value is None or value == '':
+    return '<c/>'
+  elif isinstance(value, bool):
+    return '<c t="b"><v>%d</v></c>' % value
+  elif isinstance(value, six.integer_types):
+    return '<c><v>%d</v></c>' % value
+  elif isinstance(value, datetime):
+    if value.tzinfo:
+      value = value.replace(tzinfo=None)
+    return '<c s="1"><v>%r</v></c>' % ((value - _epoch).total_seconds() / 86400)
+  elif isinstance(value, date):
+    return '<c s="2"><v>%d</v></c>' % (value - _epoch.date()).days
+  elif isinstance(value, time):
+    return '<c s="3"><v>%r</v></c>' % ((value.hour * 3600 + value.minute * 60 + value.second) / 86400)
+  elif isinstance(value, timedelta):
+    return '<c><v>%r</v></c>' % value.total_seconds()
+  else:
+    try:
+      number = float(value)
+      if number == number and abs(number) != float('inf') and not isinstance(value, six.string_types):
+        return '<c><v>%s</v></c>' % value
+    except (TypeError, ValueError):
+      pass
+    return '<c t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % escape(_illegal_xml.sub('', six.text_type(value)))
+
+
+def _getSheet(rows):
+  buf = [_sheet_start]
+  buflen = 0
+  for row in rows:
+    data = '<row>%s</row>' % ''.join([ _getCell(i) for i in row ])
+    buf.append(data)
+    buflen += len(data)
+    if buflen > CHUNK_SIZE:
+      yield ''.join(buf)
+      buf = []
+      buflen = 0
+  buf.append(_sheet_end)
+  yield ''.join(buf)
+
+
+def streamWorkbook(title, rows):
+  '''
+  Generator returning a xlsx file with a single sheet as a sequence of byte
+  chunks.
+  The rows argument is an iterable with a list of cell values for each row.
+  Cells can be numbers, strings, dates, datetimes, times and durations.
+  '''
+  title = _illegal_sheetname.sub(' ', six.text_type(title))[:31] or 'Sheet1'
+  zipstream = ZipStream()
+  for name, content in (
+    ('[Content_Types].xml', [_content_types]),
+    ('_rels/.rels', [_rels]),
+    ('xl/workbook.xml', [_workbook % quoteattr(title)]),
+    ('xl/_rels/workbook.xml.rels', [_workbook_rels]),
+    ('xl/styles.xml', [_styles]),
+    ('xl/worksheets/sheet1.xml', _getSheet(rows))
+    ):
+    for data in zipstream.file(name, content):
+      yield data
+  yield zipstream.close()
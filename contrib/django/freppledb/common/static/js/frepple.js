@@ -389,6 +389,29 @@ var grid = {
      $(this).jqGrid('setCell', id, 'select', '<input type="checkbox" onClick="opener.dismissRelatedLookupPopup(window, grid.selected);" class="btn btn-primary" style="width: 18px; height: 18px;" data-toggle="tooltip" title="'+gettext('Click to select record')+'"></input>');
    },
 
+   // Keyset pagination.
+   // The server returns with each page a cursor pointing at its last record.
+   // The cursor is passed back when requesting the next page, which allows
+   // the server to seek the records of that page instead of skipping over
+   // all records of the previous pages.
+   cursor: null,
+   cursorpage: null,
+
+   serializeGridData: function(postData)
+   {
+     if (grid.cursor && postData.page == grid.cursorpage + 1)
+       postData.cursor = grid.cursor;
+     else
+       delete postData.cursor;
+     return postData;
+   },
+
+   beforeProcessing: function(data)
+   {
+     grid.cursor = data.cursor || null;
+     grid.cursorpage = data.page;
+   },
+
    runAction: function(next_action) {
     if ($("#actions").val() != "no_action")
        actions[$("#actions").val()]();
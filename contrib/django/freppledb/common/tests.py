@@ -14,23 +14,222 @@
 # You should have received a copy of the GNU Affero General Public
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+from datetime import datetime
+from io import BytesIO
 import time
 import os
 import os.path
+from unittest.mock import patch
 
 from django.conf import settings
 from django.core import management
+from django.db import DEFAULT_DB_ALIAS
 from django.http.response import StreamingHttpResponse
-from django.test import TestCase, TransactionTestCase
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
 from django.test.utils import override_settings
+from openpyxl import load_workbook
 
+from freppledb.common.cache import getCached, getStatistics, getPrecomputed, setPrecomputed
+from freppledb.common.commands import PlanTaskRegistry, PlanTask
 from freppledb.common.models import User
+from freppledb.execute.models import Task
 import freppledb.common as common
 import freppledb.input as input
 
 from rest_framework.test import APIClient, APITestCase, APIRequestFactory
 
 
+class PlanTaskTest(SimpleTestCase):
+
+  def test_dependencies(self):
+    class Load(PlanTask):
+      sequence = 100
+      resources = (PlanTask.ENGINE_WRITE,)
+
+    class Solve(PlanTask):
+      sequence = 200
+      resources = (PlanTask.ENGINE_WRITE,)
+
+    class Inactive(PlanTask):
+      sequence = 300
+
+    class Export1(PlanTask):
+      sequence = 400
+      dependencies = (Solve,)
+      resources = (PlanTask.ENGINE_READ,)
+
+    class Export2(PlanTask):
+      sequence = 500
+      dependencies = (Inactive,)
+      resources = (PlanTask.ENGINE_READ, 'out_problem')
+
+    class Erase(PlanTask):
+      sequence = 500
+      dependencies = ()
+      resources = (PlanTask.ENGINE_WRITE,)
+
+    reg = PlanTaskRegistry.reg
+    try:
+      PlanTaskRegistry.reg = [Load, Solve, Inactive, Export1, Export2, Erase]
+      dep = PlanTaskRegistry.getDependencies([Load, Solve, Export1, Export2, Erase])
+    finally:
+      PlanTaskRegistry.reg = reg
+    self.assertEqual(dep[Load], set())
+    self.assertEqual(dep[Solve], {Load})
+    # Both exports only read the engine and can run in parallel
+    self.assertEqual(dep[Export1], {Solve})
+    self.assertEqual(dep[Export2], {Solve})
+    # Updating the engine waits for all steps using it
+    self.assertEqual(dep[Erase], {Export1, Export2})
+
+
+class PlanTaskCancelTest(TransactionTestCase):
+
+  def setUp(self):
+    self.task = Task(name='generate plan', submitted=datetime.now(), status='Waiting')
+    self.task.save()
+    os.environ['FREPPLE_TASKID'] = str(self.task.id)
+    self.reg = PlanTaskRegistry.reg
+    self.ran = []
+
+  def tearDown(self):
+    PlanTaskRegistry.reg = self.reg
+    del os.environ['FREPPLE_TASKID']
+
+  def getSteps(self):
+    ran = self.ran
+    task = self.task
+
+    class Load(PlanTask):
+      sequence = 100
+
+      @staticmethod
+      def run(database=DEFAULT_DB_ALIAS, **kwargs):
+        ran.append('load')
+        # The user cancels the task while this step is running
+        Task.objects.all().using(database).filter(pk=task.id).update(status='Canceling')
+
+    class Solve(PlanTask):
+      sequence = 200
+
+      @staticmethod
+      def run(database=DEFAULT_DB_ALIAS, **kwargs):
+        ran.append('solve')
+
+    return [Load, Solve]
+
+  def test_cancel_running(self):
+    PlanTaskRegistry.reg = self.getSteps()
+    with self.assertRaises(SystemExit):
+      PlanTaskRegistry.run()
+    # The next step isn't started after a cancellation
+    self.assertEqual(self.ran, ['load'])
+    self.assertEqual(Task.objects.get(pk=self.task.id).status, 'Cancelled')
+
+  def test_blocked_steps(self):
+    # A step waiting for a step that doesn't run fails the task
+    load, solve = self.getSteps()
+    PlanTaskRegistry.reg = [solve]
+    with patch.object(PlanTaskRegistry, 'getDependencies', return_value={solve: {load}}):
+      with self.assertRaises(Exception):
+        PlanTaskRegistry.run()
+    self.assertEqual(self.ran, [])
+    self.assertEqual(Task.objects.get(pk=self.task.id).status, 'Failed')
+
+  def test_cancel_waiting(self):
+    self.task.status = 'Canceling'
+    self.task.save()
+    PlanTaskRegistry.reg = self.getSteps()
+    with self.assertRaises(SystemExit):
+      PlanTaskRegistry.run()
+    self.assertEqual(self.ran, [])
+    self.assertEqual(Task.objects.get(pk=self.task.id).status, 'Cancelled')
+
+
+@override_settings(CACHES={
+  'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+  'reports': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test'}
+  })
+class ReportCacheTest(TestCase):
+
+  def test_report_cache(self):
+    calls = []
+
+    def compute():
+      calls.append(1)
+      return 'result %d' % len(calls)
+
+    self.assertEqual(getCached('test', DEFAULT_DB_ALIAS, 'key', compute), 'result 1')
+    self.assertEqual(getCached('test', DEFAULT_DB_ALIAS, 'key', compute), 'result 1')
+    self.assertEqual(getCached('test', DEFAULT_DB_ALIAS, 'other key', compute), 'result 2')
+    self.assertEqual(getStatistics()['test'], {'hits': 1, 'misses': 2})
+
+    # A finished task invalidates the cache
+    now = datetime.now()
+    Task(name='test', submitted=now, finished=now, status='Done').save()
+    self.assertEqual(getCached('test', DEFAULT_DB_ALIAS, 'key', compute), 'result 3')
+    self.assertEqual(getStatistics()['test'], {'hits': 1, 'misses': 3})
+
+    # The result None isn't stored
+    self.assertIsNone(getCached('empty', DEFAULT_DB_ALIAS, 'key', lambda: None))
+    self.assertIsNone(getCached('empty', DEFAULT_DB_ALIAS, 'key', lambda: None))
+    self.assertEqual(getStatistics()['empty'], {'hits': 0, 'misses': 2})
+
+  def test_precomputed(self):
+    # A result computed by a task is valid once the task finished
+    task = Task(name='generate plan', submitted=datetime.now(), status='50%')
+    task.save()
+    setPrecomputed('test', DEFAULT_DB_ALIAS, 'key', 'content', task.id)
+    self.assertIsNone(getPrecomputed('test', DEFAULT_DB_ALIAS, 'key'))
+    task.finished = datetime.now()
+    task.status = 'Done'
+    task.save()
+    self.assertEqual(getPrecomputed('test', DEFAULT_DB_ALIAS, 'key')[0], 'content')
+    self.assertIsNone(getPrecomputed('test', DEFAULT_DB_ALIAS, 'other key'))
+
+    # Another task finishing makes the result outdated
+    now = datetime.now()
+    Task(name='test', submitted=now, finished=now, status='Done').save()
+    self.assertIsNone(getPrecomputed('test', DEFAULT_DB_ALIAS, 'key'))
+
+
+@override_settings(INSTALLED_APPS=settings.INSTALLED_APPS + ('django.contrib.sessions',))
+class SpreadsheetExportTest(TestCase):
+
+  fixtures = ['demo']
+
+  def setUp(self):
+    # Login
+    if not User.objects.filter(username="admin").count():
+      User.objects.create_superuser('admin', 'your@company.com', 'admin')
+    self.client.login(username='admin', password='admin')
+
+  def test_streaming_export(self):
+    response = self.client.get('/data/input/demand/?format=spreadsheetlist')
+    if not isinstance(response, StreamingHttpResponse):
+      raise Exception("expected a streaming response")
+    wb = load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True)
+    ws = wb.worksheets[0]
+    self.assertEqual(len(list(ws.rows)), input.models.Demand.objects.count() + 1)
+
+  def test_csv_export(self):
+    response = self.client.get('/data/input/demand/?format=csvlist')
+    content = b''.join(response.streaming_content).decode(settings.CSV_CHARSET)
+    # All records end with a carriage return and line feed
+    lines = content.split('\r\n')
+    self.assertEqual(lines[-1], '')
+    self.assertEqual(len(lines) - 1, input.models.Demand.objects.count() + 1)
+
+  @override_settings(SPREADSHEET_BACKGROUND_RECORDS=1)
+  def test_background_export(self):
+    # Only check the task is queued, without starting a worker process
+    with patch('freppledb.execute.views.launchWorker') as launchWorker:
+      response = self.client.get('/data/input/demand/?format=spreadsheetlist')
+    self.assertEqual(response.status_code, 302)
+    self.assertTrue(Task.objects.filter(name='export report', status='Waiting').exists())
+    launchWorker.assert_called_once_with(DEFAULT_DB_ALIAS)
+
+
 @override_settings(INSTALLED_APPS=settings.INSTALLED_APPS + ('django.contrib.sessions',))
 class DataLoadTest(TestCase):
 
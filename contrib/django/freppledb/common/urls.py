@@ -75,4 +75,7 @@ urlpatterns = patterns(
   (r'^api/$', APIIndexView),
 
   url(r'^about/$', freppledb.common.views.AboutView, name="about"),
+
+  # Hit and miss statistics of the report cache
+  url(r'^cache/$', freppledb.common.views.CacheView, name="cache"),
 )
@@ -38,6 +38,7 @@ from django.http import Http404, HttpResponseRedirect, HttpResponse, HttpRespons
 from django.views.decorators.csrf import csrf_protect
 from django.views.decorators.debug import sensitive_variables
 
+from freppledb.common.cache import getStatistics
 from freppledb.common.models import User, Parameter, Comment, Bucket, BucketDetail, Wizard
 from freppledb.common.report import GridReport, GridFieldLastModified, GridFieldText
 from freppledb.common.report import GridFieldBool, GridFieldDateTime, GridFieldInteger
@@ -57,6 +58,14 @@ def AboutView(request):
      )
 
 
+@staff_member_required
+def CacheView(request):
+  return HttpResponse(
+     content=json.dumps(getStatistics()),
+     content_type='application/json; charset=%s' % settings.DEFAULT_CHARSET
+     )
+
+
 @staff_member_required
 def cockpit(request):
   return render_to_response('index.html', {
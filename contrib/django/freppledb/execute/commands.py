@@ -14,13 +14,18 @@
 # You should have received a copy of the GNU Affero General Public
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+import csv
+from datetime import timedelta
 import os
+import re
 
-from django.db import DEFAULT_DB_ALIAS
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
 from django.utils.translation import ugettext_lazy as _
 
 from freppledb.common.commands import PlanTaskRegistry, PlanTask
 from freppledb.common.models import Parameter
+from freppledb.execute.models import Task, TaskStep
 
 
 @PlanTaskRegistry.register
@@ -28,6 +33,7 @@ class LoadData(PlanTask):
 
   description = "Load static data"
   sequence = 100
+  resources = (PlanTask.ENGINE_WRITE,)
   filter = None
 
   @classmethod
@@ -42,6 +48,7 @@ class LoadDynamicData(PlanTask):
 
   description = "Load dynamic data"
   sequence = 110
+  resources = (PlanTask.ENGINE_WRITE,)
   filter = None
 
   @classmethod
@@ -52,13 +59,159 @@ class LoadDynamicData(PlanTask):
     frepple.printsize()
 
 
+@PlanTaskRegistry.register
+class FindChangedClusters(PlanTask):
+  '''
+  Finds the clusters with changed demands, supply or capacity since the
+  previous plan generation.
+  Only these clusters are planned and exported in the next steps.
+
+  Changes are looked for since the previous run started loading its data.
+  The operationplans written by the export of the previous run aren't
+  changes: proposed operationplans are regenerated anyway, and the other
+  ones are skipped when they were modified during the export.
+
+  Deleted records aren't detected. After deleting data a complete plan
+  needs to be generated.
+  '''
+
+  description = "Find changed clusters"
+  sequence = 190
+  resources = (PlanTask.ENGINE_READ,)
+
+  # Changes in these tables can impact all clusters
+  global_tables = ('location', 'customer', 'supplier', 'calendar', 'setupmatrix', 'setuprule', 'skill')
+
+  # Queries returning the items, operations and resources with changes
+  changes = '''
+    select 'item', item_id from demand where lastmodified > %(since)s
+    union select 'item', item_id from buffer where lastmodified > %(since)s
+    union select 'item', name from item where lastmodified > %(since)s
+    union select 'item', item_id from itemsupplier where lastmodified > %(since)s
+    union select 'item', item_id from itemdistribution where lastmodified > %(since)s
+    union select 'item', item_id from operationmaterial where lastmodified > %(since)s
+    union select 'item', item_id from operationplan where lastmodified > %(since)s and item_id is not null
+      and not (status = 'proposed' or status is null or type = 'STCK')
+      and lastmodified not between %(exportstart)s and %(exportend)s
+    union select 'item', buffer.item_id from buffer
+      inner join calendarbucket on calendarbucket.calendar_id = buffer.minimum_calendar_id
+      where calendarbucket.lastmodified > %(since)s
+    union select 'operation', name from operation where lastmodified > %(since)s
+    union select 'operation', operation_id from suboperation where lastmodified > %(since)s
+    union select 'operation', operation_id from operationmaterial where lastmodified > %(since)s
+    union select 'operation', operation_id from operationresource where lastmodified > %(since)s
+    union select 'operation', operation_id from operationplan where lastmodified > %(since)s and operation_id is not null
+      and not (status = 'proposed' or status is null or type = 'STCK')
+      and lastmodified not between %(exportstart)s and %(exportend)s
+    union select 'resource', name from resource where lastmodified > %(since)s
+    union select 'resource', resource_id from resourceskill where lastmodified > %(since)s
+    union select 'resource', resource.name from resource
+      inner join calendarbucket on calendarbucket.calendar_id = resource.maximum_calendar_id
+      where calendarbucket.lastmodified > %(since)s
+    '''
+
+  @classmethod
+  def getWeight(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+    if 'supply' in os.environ and 'FREPPLE_INCREMENTAL' in os.environ:
+      return 1
+    else:
+      return -1
+
+  @classmethod
+  def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+    SupplyPlanning.clusters = cls.getChangedClusters(database)
+    if SupplyPlanning.clusters is None:
+      print("Planning all clusters")
+    else:
+      print("Planning %d changed clusters" % len(SupplyPlanning.clusters))
+
+  @classmethod
+  def getPreviousRun(cls, database=DEFAULT_DB_ALIAS, task=None):
+    '''
+    Returns the last successful plan generation with the same plan type and
+    constraints as the current task.
+    '''
+    if not task and 'FREPPLE_TASKID' in os.environ:
+      task = int(os.environ['FREPPLE_TASKID'])
+    options = '--constraint=%s --plantype=%s' % (
+      os.environ.get('FREPPLE_CONSTRAINT', '15'), os.environ.get('FREPPLE_PLANTYPE', '1')
+      )
+    for t in Task.objects.all().using(database).filter(
+      name='generate plan', status__in=('Done', '100%'), finished__isnull=False
+      ).exclude(pk=task).order_by('-finished'):
+      args = t.arguments or ''
+      env = re.search(r'--env=(\S+)', args)
+      if env and 'supply' not in env.group(1).split(','):
+        # This run didn't generate a plan
+        continue
+      return t if args.startswith(options) else None
+    return None
+
+  @classmethod
+  def getChangedClusters(cls, database=DEFAULT_DB_ALIAS, task=None):
+    '''
+    Returns the set of clusters to replan, or None when all clusters need
+    to be planned.
+    '''
+    import frepple
+    previous = cls.getPreviousRun(database, task)
+    if not previous:
+      return None
+    # The start of the data load and the period of the export of the
+    # previous run. Without recorded steps, the changes during the previous
+    # run are ignored on the operationplans.
+    since = previous.started
+    exportstart = previous.started
+    exportend = previous.finished
+    for step in TaskStep.objects.all().using(database).filter(
+      task=previous, sequence__in=(LoadData.sequence, ExportPlan.sequence)
+      ):
+      if step.sequence == LoadData.sequence:
+        since = step.started
+      else:
+        exportstart = step.started
+        exportend = step.started + timedelta(seconds=step.walltime)
+    cursor = connections[database].cursor()
+    for t in cls.global_tables:
+      cursor.execute("select 1 from %s where lastmodified > %%s limit 1" % t, (since,))
+      if cursor.fetchone():
+        print("Changes in table %s impact all clusters" % t)
+        return None
+    clusters = set()
+    cursor.execute(cls.changes, {'since': since, 'exportstart': exportstart, 'exportend': exportend})
+    for entity, name in cursor.fetchall():
+      try:
+        if entity == 'item':
+          obj = frepple.item(name=name, action='C')
+        elif entity == 'operation':
+          obj = frepple.operation(name=name, action='C')
+        else:
+          obj = frepple.resource(name=name, action='C')
+        clusters.add(obj.cluster)
+      except:
+        # Not part of the model
+        pass
+    return clusters
+
+
 @PlanTaskRegistry.register
 class SupplyPlanning(PlanTask):
 
   description = "Generate supply plan"
   sequence = 200
+  resources = (PlanTask.ENGINE_WRITE,)
   label = ('supply', _("Generate supply plan"))
 
+  # Set of clusters to plan. None plans all clusters.
+  clusters = None
+
+  # Solver while it is running
+  solver = None
+  cancelled = False
+
+  # Number of clusters solved so far, when planning a set of clusters
+  clustersdone = 0
+
   @classmethod
   def getWeight(cls, database=DEFAULT_DB_ALIAS, **kwargs):
     if 'supply' in os.environ:
@@ -67,7 +220,11 @@ class SupplyPlanning(PlanTask):
       return -1
 
   @staticmethod
-  def run(database=DEFAULT_DB_ALIAS, **kwargs):
+  def createSolver(database=DEFAULT_DB_ALIAS):
+    '''
+    Create a solver with the plan type and constraints defined by environment
+    variables and with the parameters of the database.
+    '''
     import frepple
     # Auxiliary functions for debugging
     def debugResource(res, mode):
@@ -100,14 +257,99 @@ class SupplyPlanning(PlanTask):
       allowsplits=(Parameter.getValue('allowsplits', database, 'true').lower() == "true"),
       rotateresources=(Parameter.getValue('plan.rotateResources', database, 'true').lower() == "true"),
       plansafetystockfirst=(Parameter.getValue('plan.planSafetyStockFirst', database, 'false').lower() != "false"),
-      iterationmax=int(Parameter.getValue('plan.iterationmax', database, '0'))
+      iterationmax=int(Parameter.getValue('plan.iterationmax', database, '0')),
+      slowdemands=int(Parameter.getValue('plan.slowdemands', database, '0'))
       #userexit_resource=debugResource,
       #userexit_demand=debugDemand
       )
     print("Plan type: ", plantype)
     print("Constraints: ", constraint)
-    solver.solve()
+    return solver
+
+  @classmethod
+  def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+    import frepple
+    cls.cancelled = False
+    cls.clustersdone = 0
+    solver = cls.createSolver(database)
+    cls.solver = solver
+    try:
+      if cls.clusters is None:
+        solver.solve()
+      else:
+        for c in sorted(cls.clusters):
+          if cls.cancelled:
+            break
+          solver.cluster = c
+          solver.solve()
+          cls.clustersdone += 1
+    finally:
+      cls.solver = None
+    if cls.cancelled or solver.cancelled:
+      raise Exception("Supply planning cancelled")
     frepple.printsize()
+    if solver.slowdemands:
+      cls.exportSlowDemands(solver, database)
+
+  @classmethod
+  def getProgress(cls):
+    solver = cls.solver
+    if not solver:
+      return None
+    p = solver.progress()
+    if p['demands_total']:
+      fraction = p['demands'] / p['demands_total']
+    elif p['clusters_total']:
+      fraction = p['clusters'] / p['clusters_total']
+    else:
+      fraction = 0
+    if cls.clusters is None:
+      return (
+        fraction,
+        "%d of %d clusters, %d of %d demands, cluster size %d" % (
+          p['clusters'], p['clusters_total'], p['demands'],
+          p['demands_total'], p['cluster_size']
+          )
+        )
+    else:
+      # The solver plans the clusters one at a time
+      return (
+        (cls.clustersdone + fraction) / max(len(cls.clusters), 1),
+        "%d of %d clusters, %d of %d demands in cluster %s" % (
+          cls.clustersdone, len(cls.clusters), p['demands'],
+          p['demands_total'], solver.cluster
+          )
+        )
+
+  @classmethod
+  def cancel(cls):
+    # The solver checks the flag between clusters and between demands
+    cls.cancelled = True
+    solver = cls.solver
+    if solver:
+      solver.cancel()
+
+  @staticmethod
+  def exportSlowDemands(solver, database=DEFAULT_DB_ALIAS):
+    '''
+    Write the slowest demands of the solver run to a CSV file in the log folder.
+    '''
+    if database == DEFAULT_DB_ALIAS:
+      filename = os.path.join(settings.FREPPLE_LOGDIR, 'slowdemands.csv')
+    else:
+      filename = os.path.join(settings.FREPPLE_LOGDIR, 'slowdemands_%s.csv' % database)
+    with open(filename, 'w', newline='') as f:
+      writer = csv.writer(f)
+      writer.writerow([
+        'demand', 'time', 'iterations', 'operationplans created',
+        'operationplans rolled back', 'constraint'
+        ])
+      for d in solver.slowestdemands():
+        writer.writerow([
+          d['demand'].name, round(d['time'], 6), d['iterations'],
+          d['created'], d['rolledback'], d['constraint']
+          ])
+    print("Wrote slowest demands to", filename)
 
 
 @PlanTaskRegistry.register
@@ -115,6 +357,7 @@ class ExportStatic(PlanTask):
 
   description = "Export static data"
   sequence = 300
+  resources = (PlanTask.ENGINE_READ,)
 
   @classmethod
   def getWeight(cls, database=DEFAULT_DB_ALIAS, **kwargs):
@@ -132,6 +375,8 @@ class ExportPlan(PlanTask):
 
   description = "Export plan"
   sequence = 400
+  dependencies = (SupplyPlanning, ExportStatic)
+  resources = (PlanTask.ENGINE_READ,)
 
   @classmethod
   def getWeight(cls, database=DEFAULT_DB_ALIAS, **kwargs):
@@ -143,7 +388,105 @@ class ExportPlan(PlanTask):
   @staticmethod
   def run(database=DEFAULT_DB_ALIAS, **kwargs):
     from freppledb.execute.export_database_plan import export
-    export(database=database).run()
+    if SupplyPlanning.clusters is None:
+      exporter = export(database=database)
+    else:
+      exporter = export(cluster=SupplyPlanning.clusters, database=database)
+    # A failed export is run again from the truncate step, since the failed
+    # step may have left partial rows. The plan doesn't need to be generated
+    # again.
+    retries = getattr(settings, 'PLANTASK_EXPORT_RETRIES', 1)
+    while True:
+      try:
+        exporter.run()
+        return
+      except Exception as e:
+        if retries <= 0:
+          raise
+        retries -= 1
+        print("Export failed: %s" % e)
+        print("Restarting export")
+
+
+@PlanTaskRegistry.register
+class ExportBucketSummaries(PlanTask):
+
+  description = "Aggregate plan in time buckets"
+  sequence = 410
+  dependencies = (ExportPlan,)
+  resources = ('out_bufferbucket', 'out_resourcebucket', 'out_demandbucket')
+
+  @classmethod
+  def getWeight(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+    if 'supply' in os.environ:
+      return 1
+    else:
+      return -1
+
+  @staticmethod
+  def run(database=DEFAULT_DB_ALIAS, **kwargs):
+    from freppledb.output.models import refreshBucketSummaries
+    refreshBucketSummaries(database)
+
+
+@PlanTaskRegistry.register
+class SaveKPIs(PlanTask):
+  '''
+  Computes the performance indicators of the plan in memory, and saves
+  them for the performance indicator report.
+
+  An incremental run only has the changed clusters in memory. The step
+  does nothing then, and the report computes the indicators from the
+  database since the saved ones are no longer those of the latest task.
+  '''
+
+  description = "Save performance indicators"
+  sequence = 415
+  dependencies = (SupplyPlanning,)
+  resources = (PlanTask.ENGINE_READ, 'out_kpi')
+
+  @classmethod
+  def getWeight(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+    if 'supply' in os.environ:
+      return 1
+    else:
+      return -1
+
+  @staticmethod
+  def run(database=DEFAULT_DB_ALIAS, **kwargs):
+    from freppledb.execute.whatif import computeKPIs
+    from freppledb.output.models import saveKPIs
+    if SupplyPlanning.clusters is not None:
+      print("Performance indicators aren't saved in an incremental run")
+      return
+    task = getattr(PlanTaskRegistry, 'task', None)
+    saveKPIs(database, computeKPIs(), task=task.id if task else None)
+
+
+@PlanTaskRegistry.register
+class RenderWidgets(PlanTask):
+  '''
+  Renders the dashboard widgets showing the plan, so the dashboard can
+  display them without querying the plan.
+  '''
+
+  description = "Render dashboard widgets"
+  sequence = 420
+  dependencies = (ExportPlan, ExportBucketSummaries)
+  resources = ('common_precomputedresult',)
+
+  @classmethod
+  def getWeight(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+    if 'supply' in os.environ and getattr(settings, 'PRERENDER_WIDGETS', True):
+      return 1
+    else:
+      return -1
+
+  @staticmethod
+  def run(database=DEFAULT_DB_ALIAS, **kwargs):
+    from freppledb.common.dashboard import Dashboard
+    task = getattr(PlanTaskRegistry, 'task', None)
+    Dashboard.precompute(database=database, task=task.id if task else None)
 
 
 @PlanTaskRegistry.register
@@ -151,6 +494,8 @@ class ExportPlanToFile(PlanTask):
 
   description = "Export plan to file"
   sequence = 500
+  dependencies = (SupplyPlanning,)
+  resources = (PlanTask.ENGINE_READ,)
 
   @staticmethod
   def getWeight(database=DEFAULT_DB_ALIAS, **kwargs):
@@ -168,6 +513,8 @@ class ExportPlanToXML(PlanTask):
 
   description = "Export plan to XML files"
   sequence = 600
+  dependencies = (SupplyPlanning,)
+  resources = (PlanTask.ENGINE_READ,)
 
   @staticmethod
   def getWeight(database=DEFAULT_DB_ALIAS, **kwargs):
@@ -187,6 +534,7 @@ class EraseModel(PlanTask):
 
   description = "Erase model"
   sequence = 600
+  resources = (PlanTask.ENGINE_WRITE,)
 
   @staticmethod
   def getWeight(database=DEFAULT_DB_ALIAS, **kwargs):
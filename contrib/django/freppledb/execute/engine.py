@@ -0,0 +1,398 @@
+#
+# Copyright (C) 2016 by frePPLe bvba
+#
+# This library is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+r'''
+A resident planning engine.
+
+Starting the frePPLe executable, initializing Django and loading the model
+from the database takes a considerable part of the time to generate a plan.
+A resident engine does this only once per scenario database, keeps the model
+in memory and then processes plan requests it receives on a local socket:
+  - replan the complete model
+  - replan a single cluster
+  - replan the cluster of a single demand
+  - replan the clusters with changes since the previous plan
+
+Before processing a request the engine verifies whether the input data in
+the database changed since it loaded the model. When that's the case the
+model is reloaded.
+
+The engine exits after it has been idle for PLANNING_ENGINE_TIMEOUT seconds.
+
+The engine is started with:
+   frepple engine.py
+and the environment variable FREPPLE_DATABASE selecting the scenario.
+
+The EngineClient class in this module is used by the frepple_run command
+to start the engine and to send it requests.
+'''
+
+from datetime import datetime
+import hashlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+def getAddressFile(database=DEFAULT_DB_ALIAS):
+  '''
+  Returns the name of the file in which a running engine publishes its port.
+  '''
+  return os.path.join(settings.FREPPLE_LOGDIR, 'engine_%s.port' % database)
+
+
+def getLogFile(database=DEFAULT_DB_ALIAS):
+  '''
+  Returns the name of the log file of the engine.
+  '''
+  return os.path.join(settings.FREPPLE_LOGDIR, 'engine_%s.log' % database)
+
+
+def runsInEngine(arguments):
+  '''
+  Returns True when the frepple_run command delegates a plan generation
+  with these arguments to the resident engine.
+  '''
+  return bool(
+    getattr(settings, 'PLANNING_ENGINE_TIMEOUT', 0)
+    and '--env=' not in (arguments or '') and '--background' not in (arguments or '')
+    )
+
+
+def getToken(database=DEFAULT_DB_ALIAS):
+  '''
+  Returns the secret that clients need to pass with each request.
+  '''
+  return hashlib.sha256(('%s%s' % (settings.SECRET_KEY, database)).encode('utf-8')).hexdigest()
+
+
+def sendMessage(conn, msg):
+  conn.sendall((json.dumps(msg) + '\n').encode('utf-8'))
+
+
+def receiveMessage(conn):
+  data = b''
+  while not data.endswith(b'\n'):
+    chunk = conn.recv(65536)
+    if not chunk:
+      break
+    data += chunk
+  if not data:
+    return None
+  return json.loads(data.decode('utf-8'))
+
+
+class EngineClient:
+  '''
+  Client to communicate with the resident planning engine of a database.
+  '''
+
+  def __init__(self, database=DEFAULT_DB_ALIAS):
+    self.database = database
+
+  def getPort(self):
+    try:
+      with open(getAddressFile(self.database), 'r') as f:
+        return int(f.read().strip())
+    except:
+      return None
+
+  def isRunning(self):
+    try:
+      return self.send('ping')['status'] == 'ok'
+    except:
+      return False
+
+  def start(self, timeout=600):
+    '''
+    Start the resident engine of the database, unless it is already running.
+    We wait till the engine has loaded the model and is listening for
+    requests.
+    '''
+    if self.isRunning():
+      return
+    try:
+      os.remove(getAddressFile(self.database))
+    except:
+      pass
+
+    # Prepare the environment of the engine
+    env = os.environ.copy()
+    env['FREPPLE_DATABASE'] = self.database
+    env['PATH'] = settings.FREPPLE_HOME + os.pathsep + env['PATH'] + os.pathsep + settings.FREPPLE_APP
+    if os.path.isfile(os.path.join(settings.FREPPLE_HOME, 'libfrepple.so')):
+      env['LD_LIBRARY_PATH'] = settings.FREPPLE_HOME
+    if 'DJANGO_SETTINGS_MODULE' not in env:
+      env['DJANGO_SETTINGS_MODULE'] = 'freppledb.settings'
+    env['PYTHONPATH'] = os.path.normpath(settings.FREPPLE_APP)
+    for i in ('FREPPLE_TASKID', 'FREPPLE_PLANTYPE', 'FREPPLE_CONSTRAINT', 'FREPPLE_INCREMENTAL'):
+      if i in env:
+        del env[i]
+
+    # Launch the engine as a background process
+    if os.name == 'nt':
+      proc = subprocess.Popen(['frepple', __file__], env=env, creationflags=0x08000000)
+    else:
+      proc = subprocess.Popen(['frepple', __file__], env=env)
+
+    # Wait for the engine to be ready
+    start = time.time()
+    while time.time() - start < timeout:
+      if proc.poll() is not None:
+        raise Exception("Planning engine exited with code %s during startup" % proc.returncode)
+      if self.getPort() and self.isRunning():
+        return
+      time.sleep(0.2)
+    raise Exception("Planning engine didn't start within %s seconds" % timeout)
+
+  def send(self, action, **kwargs):
+    '''
+    Send a request to the engine and wait for its reply.
+    '''
+    port = self.getPort()
+    if not port:
+      raise Exception("Planning engine isn't running")
+    kwargs['action'] = action
+    kwargs['token'] = getToken(self.database)
+    with socket.create_connection(('127.0.0.1', port)) as conn:
+      sendMessage(conn, kwargs)
+      reply = receiveMessage(conn)
+    if not reply:
+      raise Exception("No reply from the planning engine")
+    return reply
+
+
+class EngineServer:
+  '''
+  The resident planning engine. This class only runs inside the frePPLe
+  executable.
+  '''
+
+  def __init__(self, database=DEFAULT_DB_ALIAS, timeout=3600):
+    self.database = database
+    self.timeout = timeout
+    self.lastactivity = time.time()
+    self.snapshot = None
+    self.listener = None
+
+  def getSnapshot(self):
+    '''
+    Returns a fingerprint of the input data: the number of records and the
+    sum of a hash of all records of each input table. Inserted, updated
+    and deleted records all change the fingerprint.
+    '''
+    from django.apps import apps
+    from django.db import connections
+    cursor = connections[self.database].cursor()
+    result = {}
+    for m in apps.get_app_config('input').get_models():
+      cursor.execute(
+        "select count(*), coalesce(sum(hashtext(t::text)::bigint), 0) from %s as t"
+        % connections[self.database].ops.quote_name(m._meta.db_table)
+        )
+      res = cursor.fetchone()
+      result[m._meta.db_table] = (res[0], str(res[1]))
+    return result
+
+  def load(self):
+    import frepple
+    from freppledb.execute.commands import LoadData, LoadDynamicData
+    print("Loading model at %s" % datetime.now().strftime("%H:%M:%S"))
+    frepple.erase(True)
+    LoadData.run(database=self.database)
+    LoadDynamicData.run(database=self.database)
+    self.snapshot = self.getSnapshot()
+    print("Loaded model at %s" % datetime.now().strftime("%H:%M:%S"))
+
+  def replan(self, task=None, cluster=None, demand=None, plantype=None, constraint=None, incremental=False, **kwargs):
+    import frepple
+    from freppledb.common.commands import PlanTaskRegistry
+    from freppledb.execute.commands import LoadData, LoadDynamicData, SupplyPlanning
+    from freppledb.execute.models import Task
+
+    # Pick up the task
+    if task:
+      task = Task.objects.all().using(self.database).get(pk=task)
+      if task.status == 'Canceling':
+        task.status = 'Cancelled'
+        task.save(using=self.database)
+        return
+      task.status = '0%'
+      task.message = "Verifying model"
+      task.save(using=self.database)
+    PlanTaskRegistry.autodiscover()
+
+    # The plan steps are configured with environment variables. They are
+    # only set for this request, and restored afterwards.
+    env = {
+      'FREPPLE_PLANTYPE': str(plantype or 1),
+      'FREPPLE_CONSTRAINT': str(15 if constraint is None else constraint),
+      'FREPPLE_TASKID': str(task.id) if task else None,
+      'FREPPLE_INCREMENTAL': '1' if incremental and not demand and (cluster is None or int(cluster) == -1) else None,
+      }
+    for i in PlanTaskRegistry.reg:
+      if i.label:
+        # Only the steps generating the plan run in the engine
+        env[i.label[0]] = '1' if i.label[0] == 'supply' else None
+    saved = { k: os.environ.get(k, None) for k in env }
+    try:
+      for k, v in env.items():
+        if v is None:
+          os.environ.pop(k, None)
+        else:
+          os.environ[k] = v
+
+      # Reload the model if the input data changed
+      if self.getSnapshot() != self.snapshot:
+        if task:
+          task.message = LoadData.description
+          task.save(using=self.database)
+        self.load()
+
+      # Find the clusters to plan. The incremental mode finds them in a step
+      # of the plan generation.
+      if demand:
+        SupplyPlanning.clusters = set([frepple.demand(name=demand, action='C').cluster])
+      elif cluster is not None and int(cluster) != -1:
+        SupplyPlanning.clusters = set([int(cluster)])
+      else:
+        SupplyPlanning.clusters = None
+
+      # Run all steps of the plan generation, except the loading of the model
+      # which is already in memory
+      print("Start planning %s at %s" % (
+        "all clusters" if SupplyPlanning.clusters is None else "clusters %s" % sorted(SupplyPlanning.clusters),
+        datetime.now().strftime("%H:%M:%S")
+        ))
+      try:
+        PlanTaskRegistry.run(database=self.database, exclude=(LoadData, LoadDynamicData))
+      except SystemExit:
+        # The task was cancelled. Its status is already updated.
+        pass
+      print("Finished planning at %s" % datetime.now().strftime("%H:%M:%S"))
+    finally:
+      SupplyPlanning.clusters = None
+      for k, v in saved.items():
+        if v is None:
+          os.environ.pop(k, None)
+        else:
+          os.environ[k] = v
+
+    # The exported plan isn't a change of the input data
+    self.snapshot = self.getSnapshot()
+
+  def handle(self, conn):
+    msg = receiveMessage(conn)
+    if not msg or msg.get('token') != getToken(self.database):
+      sendMessage(conn, {'status': 'error', 'message': 'Invalid request'})
+      return True
+    action = msg.get('action')
+    if action == 'ping':
+      sendMessage(conn, {'status': 'ok'})
+    elif action == 'stop':
+      sendMessage(conn, {'status': 'ok'})
+      return False
+    elif action in ('replan', 'reload'):
+      try:
+        if action == 'reload':
+          self.load()
+        else:
+          self.replan(**msg)
+        sendMessage(conn, {'status': 'ok'})
+      except Exception as e:
+        print("Error during planning: ", e)
+        sendMessage(conn, {'status': 'error', 'message': str(e)})
+      finally:
+        self.lastactivity = time.time()
+    else:
+      sendMessage(conn, {'status': 'error', 'message': 'Unknown action %s' % action})
+    return True
+
+  def serve(self):
+    self.load()
+
+    # Start listening on a local port
+    self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.listener.bind(('127.0.0.1', 0))
+    self.listener.listen(5)
+    with open(getAddressFile(self.database), 'w') as f:
+      f.write(str(self.listener.getsockname()[1]))
+    print("Planning engine with processid %s listening on port %s" % (os.getpid(), self.listener.getsockname()[1]))
+    # Waiting for a request is interrupted regularly to check whether the
+    # engine is idle for too long
+    if self.timeout:
+      self.listener.settimeout(min(self.timeout, 10))
+
+    # Process requests
+    try:
+      while True:
+        try:
+          conn = self.listener.accept()[0]
+        except socket.timeout:
+          if time.time() - self.lastactivity > self.timeout:
+            print("Planning engine idle for %s seconds" % self.timeout)
+            break
+          continue
+        conn.settimeout(None)
+        with conn:
+          self.lastactivity = time.time()
+          if not self.handle(conn):
+            break
+    finally:
+      try:
+        os.remove(getAddressFile(self.database))
+      except:
+        pass
+      self.listener.close()
+    print("Planning engine stops at %s" % datetime.now().strftime("%H:%M:%S"))
+
+
+if __name__ == "__main__":
+  # Select database
+  try:
+    database = os.environ['FREPPLE_DATABASE'] or DEFAULT_DB_ALIAS
+  except:
+    database = DEFAULT_DB_ALIAS
+
+  # Initialize django
+  import django
+  django.setup()
+
+  # Use the test database if we are running the test suite
+  if 'FREPPLE_TEST' in os.environ:
+    settings.DATABASES[database]['NAME'] = settings.DATABASES[database]['TEST']['NAME']
+
+  # Make sure the debug flag is not set!
+  settings.DEBUG = False
+
+  # Send the output to a logfile
+  frepple.settings.logfile = getLogFile(database)
+
+  # Welcome message
+  print("FrePPLe planning engine with processid %s on %s using database '%s'" % (
+    os.getpid(),
+    sys.platform,
+    database
+    ))
+
+  EngineServer(database, getattr(settings, 'PLANNING_ENGINE_TIMEOUT', 3600)).serve()
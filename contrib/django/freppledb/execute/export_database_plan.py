@@ -33,6 +33,9 @@ class DatabasePipe(Thread):
   '''
   An auxiliary class that allows us to run a function with its own
   PostgreSQL process pipe.
+
+  After a failure the remaining functions of the pipe aren't run, and the
+  error is stored in the owner.
   '''
   def __init__(self, owner, *f):
     self.owner = owner
@@ -61,6 +64,8 @@ class DatabasePipe(Thread):
     try:
       for f in self.functions:
         f(self.owner, process)
+    except Exception as e:
+      self.owner.errors.append("%s: %s" % (f.__name__, e))
     finally:
       msg = process.communicate()[1]
       if msg:
@@ -70,12 +75,23 @@ class DatabasePipe(Thread):
         # PSQL session is still running.
         process.stdin.write('\\q\n'.encode(self.owner.database))
       process.stdin.close()
+    if msg and b'ERROR' in msg:
+      self.owner.errors.append(msg.decode(self.owner.encoding, 'replace'))
 
 
 class export:
 
   def __init__(self, cluster=-1, verbosity=1, database=None):
-    self.cluster = cluster
+    '''
+    The cluster argument is a single cluster number or a collection of
+    cluster numbers to export. The default -1 exports all clusters.
+    '''
+    if cluster is None or cluster == -1:
+      self.clusters = None
+    elif isinstance(cluster, int):
+      self.clusters = set([cluster])
+    else:
+      self.clusters = set(cluster)
     self.verbosity = verbosity
     if database:
       self.database = database
@@ -86,6 +102,7 @@ class export:
         self.database = DEFAULT_DB_ALIAS
     self.encoding = 'UTF8'
     self.timestamp = str(datetime.now())
+    self.errors = []
 
 
   def getPegging(self, opplan):
@@ -99,9 +116,9 @@ class export:
     if self.verbosity:
       print("Emptying database plan tables...")
     starttime = time()
-    if self.cluster == -1:
+    if self.clusters is None:
       # Complete export for the complete model
-      process.stdin.write("truncate table out_problem, out_resourceplan, out_constraint;\n".encode(self.encoding))
+      process.stdin.write("truncate table out_problem, out_resourceplan, out_constraint, out_pegging;\n".encode(self.encoding))
       process.stdin.write("truncate table operationplanmaterial, operationplanresource;\n".encode(self.encoding)) 
 # Above line is a temporary solution until we have a correct version of this block of code 
 #       process.stdin.write('''
@@ -121,12 +138,13 @@ class export:
         where (status='proposed' or status is null) or type = 'STCK';\n
         '''.encode(self.encoding))
     else:
-      # Partial export for a single cluster
+      # Partial export for a set of clusters
       process.stdin.write('create temporary table cluster_keys (name character varying(300), constraint cluster_key_pkey primary key (name));\n'.encode(self.encoding))
       for i in frepple.items():
-        if i.cluster == self.cluster:
+        if i.cluster in self.clusters:
           process.stdin.write(("insert into cluster_keys (name) values (%s);\n" % adapt(i.name).getquoted().decode(self.encoding)).encode(self.encoding))
       process.stdin.write("delete from out_constraint where demand in (select demand.name from demand inner join cluster_keys on cluster_keys.name = demand.item_id);\n".encode(self.encoding))
+      process.stdin.write("delete from out_pegging where demand in (select demand.name from demand inner join cluster_keys on cluster_keys.name = demand.item_id);\n".encode(self.encoding))
       process.stdin.write('''
         delete from operationplanmaterial
         where buffer in (select buffer.name from buffer inner join cluster_keys on cluster_keys.name = buffer.item_id);\n
@@ -150,7 +168,7 @@ class export:
         '''.encode(self.encoding))
       process.stdin.write("truncate table cluster_keys;\n".encode(self.encoding))
       for i in frepple.resources():
-        if i.cluster == self.cluster:
+        if i.cluster in self.clusters:
           process.stdin.write(("insert into cluster_keys (name) values (%s);\n" % adapt(i.name).getquoted().decode(self.encoding)).encode(self.encoding))
       process.stdin.write("delete from out_problem where entity = 'demand' and owner in (select demand.name from demand inner join cluster_keys on cluster_keys.name = demand.item_id);\n".encode(self.encoding))
       process.stdin.write('delete from operationplanresource using cluster_keys where resource = cluster_keys.name;\n'.encode(self.encoding))
@@ -158,7 +176,7 @@ class export:
       process.stdin.write("delete from out_problem using cluster_keys where entity = 'capacity' and owner = cluster_keys.name;\n".encode(self.encoding))
       process.stdin.write('truncate table cluster_keys;\n'.encode(self.encoding))
       for i in frepple.operations():
-        if i.cluster == self.cluster:
+        if i.cluster in self.clusters:
           process.stdin.write(("insert into cluster_keys (name) values (%s);\n" % adapt(i.name).getquoted().decode(self.encoding)).encode(self.encoding))
       process.stdin.write("delete from out_problem using cluster_keys where entity = 'operation' and owner = cluster_keys.name;\n".encode(self.encoding))
       process.stdin.write("delete from operationplan using cluster_keys where (status='proposed' or status is null) and operationplan.operation_id = cluster_keys.name;\n".encode(self.encoding)) # TODO not correct in new data model
@@ -177,7 +195,7 @@ class export:
         owner = i.owner.operation
       else:
         owner = i.owner
-      if self.cluster != -1 and owner.cluster != self.cluster:
+      if self.clusters is not None and owner.cluster not in self.clusters:
         continue
       process.stdin.write(("%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (
          i.entity, i.name, owner.name,
@@ -195,7 +213,7 @@ class export:
     starttime = time()
     process.stdin.write('COPY out_constraint (demand,entity,name,owner,description,startdate,enddate,weight) FROM STDIN;\n'.encode(self.encoding))
     for d in frepple.demands():
-      if self.cluster != -1 and self.cluster != d.cluster:
+      if self.clusters is not None and d.cluster not in self.clusters:
         continue
       for i in d.constraints:
         process.stdin.write(("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (
@@ -213,7 +231,7 @@ class export:
 
     def getOperationPlans():
       for i in frepple.operations():        
-        if self.cluster != -1 and self.cluster != i.cluster:
+        if self.clusters is not None and i.cluster not in self.clusters:
           continue
         for j in i.operationplans:     
           if isinstance(i, frepple.operation_inventory):
@@ -372,7 +390,7 @@ class export:
       'FROM STDIN;\n').encode(self.encoding)
       )
     for i in frepple.buffers():
-      if self.cluster != -1 and self.cluster != i.cluster:
+      if self.clusters is not None and i.cluster not in self.clusters:
         continue
       for j in i.flowplans:
         process.stdin.write(("%s\t%s\t%s\t%s\t%s\n" % (
@@ -395,7 +413,7 @@ class export:
       'FROM STDIN;\n').encode(self.encoding)
       )
     for i in frepple.resources():
-      if self.cluster != -1 and self.cluster != i.cluster:
+      if self.clusters is not None and i.cluster not in self.clusters:
         continue
       for j in i.loadplans:
         if j.quantity < 0:
@@ -424,7 +442,7 @@ class export:
     startdate = datetime.max
     enddate = datetime.min
     for i in frepple.resources():
-      if self.cluster != -1 and self.cluster != i.cluster:
+      if self.clusters is not None and i.cluster not in self.clusters:
         continue
       for j in i.loadplans:
         if j.startdate < startdate:
@@ -449,6 +467,8 @@ class export:
     # Loop over all reporting buckets of all resources
     process.stdin.write('COPY out_resourceplan (resource,startdate,available,unavailable,setup,load,free) FROM STDIN;\n'.encode(self.encoding))
     for i in frepple.resources():
+      if self.clusters is not None and i.cluster not in self.clusters:
+        continue
       for j in i.plan(buckets):
         process.stdin.write(("%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (
          i.name, str(j['start']),
@@ -467,60 +487,89 @@ class export:
 
     def getDemandPlan():
       for i in frepple.demands():
-        if self.cluster != -1 and self.cluster != i.cluster:
+        if self.clusters is not None and i.cluster not in self.clusters:
           continue
         if i.hidden or not isinstance(i, frepple.demand_default):
           continue
         peg = []
+        seq = 0
         for j in i.pegging:
+          seq += 1
           peg.append({
             'level': j.level,
             'opplan': j.operationplan.id,
             'quantity': j.quantity
             })
+          # The pegging is also stored as rows, which can be queried efficiently
+          process.stdin.write(("%s\t%s\t%s\t%s\t%s\n" % (
+             i.name, seq, j.level, j.operationplan.id, round(j.quantity, 6)
+             )).encode(self.encoding))
         yield (json.dumps({'pegging': peg}), i.name)
 
     print("Exporting demand pegging...")
     starttime = time()
+    process.stdin.write(
+      ('COPY out_pegging '
+      '(demand, seq, level, operationplan, quantity) '
+      'FROM STDIN;\n').encode(self.encoding)
+      )
+    plans = [ i for i in getDemandPlan() ]
+    process.stdin.write('\\.\n'.encode(self.encoding))
     with transaction.atomic(using=self.database, savepoint=False):
       cursor = connections[self.database].cursor()
       cursor.executemany(
         "update demand set plan=%s where name=%s",
-        [ i for i in getDemandPlan() ]
+        plans
         )
     print('Exported demand pegging in %.2f seconds' % (time() - starttime))
 
 
 
 
+  # Steps of the parallel export. The first step runs alone, the next
+  # groups each run sequentially on their own connection.
+  steps = (
+    ('truncate',),
+    ('exportResourceplans', 'exportProblems', 'exportConstraints'),
+    (
+      'exportOperationplans', 'exportOperationPlanMaterials',
+      'exportOperationPlanResources', 'exportPegging'
+      )
+    )
+
+
   def run(self):
     '''
     This function exports the data from the frePPLe memory into the database.
     The export runs in parallel over 2 connections to PostgreSQL.
+
+    When a step fails, an exception is raised after the other steps are
+    finished. psql commits the rows sent before the failure, and we can't
+    tell which statement failed. Calling this method again thus restarts
+    the export from the truncate step.
     '''
+    self.errors = []
+
     # Truncate
     task = DatabasePipe(self, export.truncate)
     task.start()
     task.join()
+    if self.errors:
+      raise Exception("Export failed: %s" % '; '.join(self.errors))
 
     # Export process
-    tasks = (
-      DatabasePipe(
-        self,
-        export.exportResourceplans, export.exportProblems, export.exportConstraints
-        ),
-      DatabasePipe(
-        self,
-        export.exportOperationplans, export.exportOperationPlanMaterials,
-        export.exportOperationPlanResources, export.exportPegging
-        )
-      )
+    tasks = [
+      DatabasePipe(self, *[ getattr(export, j) for j in i ])
+      for i in self.steps[1:]
+      ]
     # Start all threads
     for i in tasks:
       i.start()
     # Wait for all threads to finish
     for i in tasks:
       i.join()
+    if self.errors:
+      raise Exception("Export failed: %s" % '; '.join(self.errors))
 
     # Report on the output
     if self.verbosity:
@@ -528,6 +577,7 @@ class export:
       cursor.execute('''
         select 'out_problem', count(*) from out_problem
         union select 'out_constraint', count(*) from out_constraint
+        union select 'out_pegging', count(*) from out_pegging
         union select 'operationplanmaterial', count(*) from operationplanmaterial
         union select 'operationplanresource', count(*) from operationplanresource
         union select 'out_resourceplan', count(*) from out_resourceplan
@@ -587,6 +637,7 @@ class export:
       cursor.execute('''
         select 'out_problem', count(*) from out_problem
         union select 'out_constraint', count(*) from out_constraint
+        union select 'out_pegging', count(*) from out_pegging
         union select 'operationplan', count(*) from operationplan
         union select 'operationplanmaterial', count(*) from operationplanmaterial
         union select 'operationplanresource', count(*) from operationplanresource
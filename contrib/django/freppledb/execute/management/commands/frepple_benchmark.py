@@ -0,0 +1,215 @@
+#
+# Copyright (C) 2016 by frePPLe bvba
+#
+# This library is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from datetime import datetime, timedelta
+from optparse import make_option
+from time import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+
+from freppledb.common.models import Bucket, Parameter
+from freppledb.input.models import Buffer
+from freppledb.output.models import refreshBucketSummaries
+from freppledb.output.views.buffer import OverviewReport
+from freppledb import VERSION
+
+
+class BenchmarkRequest:
+  '''
+  Minimal request object with the attributes used by the report queries.
+  '''
+  def __init__(self, database, bucket, start, end):
+    self.database = database
+    self.report_bucket = bucket
+    self.report_startdate = start
+    self.report_enddate = end
+
+
+class Command(BaseCommand):
+  help = '''
+  Measures the response time of the first page of the inventory report.
+
+  The start inventory is computed with the query of previous releases,
+  which scans all flowplans before the report horizon, and with the
+  current query on the bucket summaries. The time to compute the bucket
+  summaries at the end of the plan generation is reported as well.
+
+  By default a synthetic set of flowplans is generated for the benchmark.
+  All changes are rolled back at the end, such that the database is left
+  untouched. With the option --flowplans=0 the benchmark runs on the
+  current plan in the database.
+  '''
+
+  option_list = BaseCommand.option_list + (
+    make_option(
+      '--database', action='store', dest='database',
+      default=DEFAULT_DB_ALIAS, help='Nominates a specific database to run the benchmark on'
+      ),
+    make_option(
+      '--flowplans', dest='flowplans', type='int', default=10000000,
+      help='Number of synthetic flowplans to generate, 0 to use the current plan'
+      ),
+    make_option(
+      '--buffers', dest='buffers', type='int', default=10000,
+      help='Number of synthetic buffers to generate'
+      ),
+    make_option(
+      '--bucket', dest='bucket', type='string', default='week',
+      help='Time bucket of the report'
+      ),
+    make_option(
+      '--pagesize', dest='pagesize', type='int', default=100,
+      help='Number of buffers on the page'
+      ),
+    make_option(
+      '--repeat', dest='repeat', type='int', default=3,
+      help='Number of times each query is run'
+      ),
+    )
+
+  requires_system_checks = False
+
+  def get_version(self):
+    return VERSION
+
+  def handle(self, **options):
+    # Make sure the debug flag is not set!
+    settings.DEBUG = False
+
+    # Pick up the options
+    database = options['database'] or DEFAULT_DB_ALIAS
+    if database not in settings.DATABASES:
+      raise CommandError("No database settings known for '%s'" % database )
+    if not Bucket.objects.using(database).filter(name=options['bucket']).exists():
+      raise CommandError("Bucket '%s' not found" % options['bucket'])
+    try:
+      current = datetime.strptime(
+        Parameter.objects.using(database).get(name="currentdate").value,
+        "%Y-%m-%d %H:%M:%S"
+        )
+    except:
+      current = datetime.now()
+    current = current.replace(hour=0, minute=0, second=0, microsecond=0)
+    request = BenchmarkRequest(database, options['bucket'], current, current + timedelta(days=90))
+
+    with transaction.atomic(using=database):
+      cursor = connections[database].cursor()
+      if options['flowplans'] > 0:
+        self.generate(cursor, options['flowplans'], options['buffers'], current)
+        starttime = time()
+        refreshBucketSummaries(database)
+        print("Computed bucket summaries in %.3f seconds" % (time() - starttime))
+        cursor.execute("analyze operationplanmaterial")
+        cursor.execute("analyze out_bufferbucket")
+        cursor.execute("analyze buffer")
+      cursor.execute("select count(*) from operationplanmaterial")
+      print("Benchmarking the inventory report on %d flowplans" % cursor.fetchone()[0])
+
+      basequery = Buffer.objects.using(database).order_by('name')[:options['pagesize']]
+      self.measure(
+        'start inventory with the flowplans', options['repeat'],
+        self.legacyStartOnhand, cursor, basequery, request
+        )
+      self.measure(
+        'first page with the bucket summaries', options['repeat'],
+        lambda: list(OverviewReport.query(request, basequery))
+        )
+
+      # Leave the database untouched
+      transaction.set_rollback(True, using=database)
+
+  def measure(self, title, repeat, function, *args):
+    runtimes = []
+    for i in range(max(repeat, 1)):
+      starttime = time()
+      function(*args)
+      runtimes.append(time() - starttime)
+    print("%s: best %.3f seconds, worst %.3f seconds" % (title, min(runtimes), max(runtimes)))
+
+  def generate(self, cursor, flowplans, buffers, current):
+    '''
+    Generates a synthetic plan with the flowplans spread evenly over the
+    buffers and over a year around the current date.
+    '''
+    starttime = time()
+    buffers = max(min(buffers, flowplans), 1)
+    cursor.execute('''
+      insert into location (name, lastmodified)
+      values ('benchmark location', now())
+      ''')
+    cursor.execute('''
+      insert into item (name, lastmodified)
+      select 'benchmark item ' || i, now()
+      from generate_series(1, %s) i
+      ''', (buffers,))
+    cursor.execute('''
+      insert into buffer (name, item_id, location_id, type, onhand, minimum, lastmodified)
+      select 'benchmark item ' || i || ' @ benchmark location',
+        'benchmark item ' || i, 'benchmark location', 'default', 0, 0, now()
+      from generate_series(1, %s) i
+      ''', (buffers,))
+    cursor.execute("select coalesce(max(id), 0) + 1 from operationplan")
+    opplan = cursor.fetchone()[0]
+    cursor.execute('''
+      insert into operationplan (id, type, quantity, status)
+      values (%s, 'MO', 1, 'proposed')
+      ''', (opplan,))
+    # Per buffer the flowplans alternate between a receipt and a consumption.
+    perbuffer = (flowplans + buffers - 1) // buffers
+    cursor.execute('''
+      insert into operationplanmaterial (buffer, operationplan_id, quantity, flowdate, onhand)
+      select 'benchmark item ' || (i %% %s + 1) || ' @ benchmark location', %s,
+        case when (i / %s) %% 2 = 0 then 10 else -10 end,
+        %s + (i / %s) * (interval '365 days' / %s),
+        case when (i / %s) %% 2 = 0 then 10 else 0 end
+      from generate_series(0, %s) i
+      ''', (
+        buffers, opplan, buffers,
+        current - timedelta(days=182), buffers, perbuffer,
+        buffers, flowplans - 1
+      ))
+    print("Generated %d flowplans on %d buffers in %.3f seconds" % (flowplans, buffers, time() - starttime))
+
+  def legacyStartOnhand(self, cursor, basequery, request):
+    '''
+    Query of previous releases to compute the inventory at the start of
+    the report horizon.
+    '''
+    basesql, baseparams = basequery.query.get_compiler(basequery.db).as_sql(with_col_aliases=False)
+    Buffer.rebuildHierarchy(database=basequery.db)
+    cursor.execute('''
+      select buffers.name, sum(oh.onhand)
+      from (%s) buffers
+      inner join buffer
+      on buffer.lft between buffers.lft and buffers.rght
+      inner join (
+      select operationplanmaterial.buffer as buffer, operationplanmaterial.onhand as onhand
+      from operationplanmaterial,
+        (select buffer, max(id) as id
+         from operationplanmaterial
+         where flowdate < %%s
+         group by buffer
+        ) maxid
+      where maxid.buffer = operationplanmaterial.buffer
+      and maxid.id = operationplanmaterial.id
+      ) oh
+      on oh.buffer = buffer.name
+      group by buffers.name
+      ''' % basesql, baseparams + (request.report_startdate,))
+    return cursor.fetchall()
@@ -25,6 +25,7 @@ from django.conf import settings
 from freppledb.common.models import Bucket, BucketDetail
 from freppledb.execute.models import Task
 from freppledb.common.models import User
+from freppledb.output.models import refreshBucketSummaries
 from freppledb import VERSION
 
 
@@ -212,6 +213,9 @@ class Command(BaseCommand):
           # Next date
           curdate = curdate + timedelta(1)
 
+      # Aggregate the plan in the new buckets
+      refreshBucketSummaries(database)
+
       # Log success
       task.status = 'Done'
       task.finished = datetime.now()
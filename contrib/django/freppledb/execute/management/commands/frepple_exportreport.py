@@ -0,0 +1,167 @@
+#
+# Copyright (C) 2016 by frePPLe bvba
+#
+# This library is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+from datetime import datetime
+from importlib import import_module
+from optparse import make_option
+
+from django.conf import settings
+from django.contrib.admin.utils import quote
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpRequest, QueryDict
+from django.utils import translation
+from django.utils.http import urlunquote
+
+from freppledb.common.models import User
+from freppledb.execute.models import Task
+from freppledb import VERSION
+
+
+def getExportFile(database, task):
+  '''
+  Returns the name of the spreadsheet generated by a task.
+  '''
+  if database == DEFAULT_DB_ALIAS:
+    return os.path.join(settings.FREPPLE_LOGDIR, 'export_%s.xlsx' % task)
+  else:
+    return os.path.join(settings.FREPPLE_LOGDIR, 'export_%s_%s.xlsx' % (database, task))
+
+
+class Command(BaseCommand):
+  help = '''
+  Exports a report to a spreadsheet file in the log folder.
+  The user interface launches this command for exports which are too
+  large to download directly.
+  '''
+
+  option_list = BaseCommand.option_list + (
+    make_option(
+      '--user', dest='user', type='string',
+      help='User running the command'
+      ),
+    make_option(
+      '--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+      help='Nominates a specific database to export from'
+      ),
+    make_option(
+      '--task', dest='task', type='int',
+      help='Task identifier (generated automatically if not provided)'
+      ),
+    make_option(
+      '--report', dest='report', type='string',
+      help='Report to export, as module.classname'
+      ),
+    make_option(
+      '--arguments', dest='arguments', type='string', default='',
+      help='URL-encoded query string of the report'
+      ),
+    make_option(
+      '--entity', dest='entity', type='string', default=None,
+      help='URL-encoded object to export the report for'
+      ),
+    )
+
+  requires_system_checks = False
+
+  def get_version(self):
+    return VERSION
+
+  def handle(self, **options):
+    # Pick up the options
+    database = options['database'] or DEFAULT_DB_ALIAS
+    if database not in settings.DATABASES:
+      raise CommandError("No database settings known for '%s'" % database )
+
+    now = datetime.now()
+    task = None
+    try:
+      # Initialize the task
+      if options['task']:
+        try:
+          task = Task.objects.all().using(database).get(pk=options['task'])
+        except:
+          raise CommandError("Task identifier not found")
+        if task.started or task.finished or task.status != "Waiting" or task.name != 'export report':
+          raise CommandError("Invalid task identifier")
+        task.status = '0%'
+        task.started = now
+        user = task.user
+      else:
+        if options['user']:
+          try:
+            user = User.objects.all().using(database).get(username=options['user'])
+          except:
+            raise CommandError("User '%s' not found" % options['user'] )
+        else:
+          user = None
+        task = Task(name='export report', submitted=now, started=now, status='0%', user=user)
+        task.arguments = "--report=%s --arguments=%s" % (options['report'], options['arguments'])
+        if options['entity']:
+          task.arguments += " --entity=%s" % options['entity']
+      task.save(using=database)
+      if not user:
+        raise CommandError("Exporting a report requires a user")
+
+      # Find the report
+      try:
+        module, name = options['report'].rsplit('.', 1)
+        reportclass = getattr(import_module(module), name)
+      except:
+        raise CommandError("Report '%s' not found" % options['report'])
+
+      # Build a request for the report, as it would be received from the
+      # browser of the user
+      request = HttpRequest()
+      request.method = 'GET'
+      request.GET = QueryDict(urlunquote(options['arguments']))
+      request.user = user
+      request.database = database
+      request.prefix = database != DEFAULT_DB_ALIAS and '/%s' % database or ''
+      request.LANGUAGE_CODE = user.language if user.language != 'auto' else settings.LANGUAGE_CODE
+      request.export_task = task
+      if options['entity']:
+        args = [ quote(urlunquote(options['entity'])) ]
+      else:
+        args = []
+
+      # Write the spreadsheet
+      translation.activate(request.LANGUAGE_CODE)
+      response = reportclass().dispatch(request, *args)
+      if response.status_code != 200 or not response.streaming:
+        raise CommandError("Report export failed with status %s" % response.status_code)
+      filename = getExportFile(database, task.id)
+      with open(filename, 'wb') as f:
+        for chunk in response.streaming_content:
+          f.write(chunk)
+
+      # Task update
+      task.status = 'Done'
+      task.message = "Exported %s" % os.path.basename(filename)
+      task.finished = datetime.now()
+
+    except Exception as e:
+      if task:
+        task.status = 'Failed'
+        task.message = '%s' % e
+        task.finished = datetime.now()
+      raise e
+
+    finally:
+      if task:
+        task.save(using=database)
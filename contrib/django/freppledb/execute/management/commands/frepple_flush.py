@@ -142,6 +142,7 @@ class Command(BaseCommand):
       tables.discard('django_admin_log')
       tables.discard('django_content_type')
       tables.discard('execute_log')
+      tables.discard('execute_step')
       tables.discard('common_scenario')
 
       # Delete all records from the tables.
@@ -63,6 +63,10 @@ class Command(BaseCommand):
       '--background', dest='background', action='store_true', default=False,
       help='Run the planning engine in the background (default = False)'
       ),
+    make_option(
+      '--incremental', dest='incremental', action='store_true', default=False,
+      help='Only replan the clusters with changes since the previous plan (default = False)'
+      ),
   )
   help = "Runs frePPLe to generate a plan"
 
@@ -139,6 +143,11 @@ class Command(BaseCommand):
         task.arguments = "--constraint=%d --plantype=%d" % (constraint, plantype)
       if options['background']:
         task.arguments += " --background"
+      if options['incremental']:
+        task.arguments += " --incremental"
+        os.environ['FREPPLE_INCREMENTAL'] = '1'
+      elif 'FREPPLE_INCREMENTAL' in os.environ:
+        del os.environ['FREPPLE_INCREMENTAL']
 
       # Log task
       task.save(using=database)
@@ -159,7 +168,23 @@ class Command(BaseCommand):
         os.environ['DJANGO_SETTINGS_MODULE'] = 'freppledb.settings'
       os.environ['PYTHONPATH'] = os.path.normpath(settings.FREPPLE_APP)
 
-      if options['background']:
+      from freppledb.execute.engine import runsInEngine
+      if runsInEngine(task.arguments):
+        # Delegate to the resident planning engine of the database
+        from freppledb.execute.engine import EngineClient
+        client = EngineClient(database)
+        client.start()
+        reply = client.send(
+          'replan', task=task.id, plantype=plantype, constraint=constraint,
+          incremental=options['incremental']
+          )
+        if reply['status'] != 'ok':
+          raise Exception(reply.get('message', 'Planning engine failed'))
+        task = Task.objects.all().using(database).get(pk=task.id)
+        if task.status != 'Cancelled':
+          task.status = 'Done'
+          task.finished = datetime.now()
+      elif options['background']:
         # Execute as background process on Windows
         if os.name == 'nt':
           subprocess.Popen(['frepple', cmd], creationflags=0x08000000)
@@ -175,8 +200,12 @@ class Command(BaseCommand):
           raise Exception('Failed with exit code %d' % ret)
 
         # Task update
-        task.status = 'Done'
-        task.finished = datetime.now()
+        if ret == 2:
+          # Keep the status saved by the cancelled run
+          task = Task.objects.all().using(database).get(pk=task.id)
+        else:
+          task.status = 'Done'
+          task.finished = datetime.now()
 
     except Exception as e:
       if task:
@@ -16,46 +16,358 @@
 #
 
 import logging
+import os
+import select
+import subprocess
+import sys
 import time
-from datetime import datetime, timedelta
-from threading import Thread
+from datetime import datetime
 from optparse import make_option
 
-from django.db import DEFAULT_DB_ALIAS
+from django.db import DEFAULT_DB_ALIAS, connections
 from django.core import management
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 
 from freppledb import VERSION
-from freppledb.common.models import Parameter
 from freppledb.execute.models import Task
+from freppledb.output.models import refreshBucketSummaries
 
 
 logger = logging.getLogger(__name__)
 
 
-class WorkerAlive(Thread):
+# Key of the advisory lock held by a worker on a scenario database
+WORKER_LOCK = 20160501
+
+# Tasks that load or erase data, after which the plan summaries are refreshed
+DATALOAD_TASKS = (
+  'generate model', 'empty database', 'load dataset', 'import from folder',
+  'Openbravo import', 'Odoo import'
+  )
+
+
+class WorkerAlive:
+  '''
+  A dedicated database connection of a worker.
+
+  The worker holds a PostgreSQL advisory lock on this connection for as long
+  as it lives. Other processes use checkActive() to verify whether a worker
+  is active. The lock is released automatically when the worker exits or
+  dies, so no heartbeat needs to be written in the database.
+
+  The connection listens for the notifications which a trigger on the
+  execute_log table sends when a task is queued. This allows the worker to
+  start a new task immediately, without polling the task table.
+  '''
   def __init__(self, database=DEFAULT_DB_ALIAS):
     self.database = database
-    Thread.__init__(self)
-    self.daemon = True
+    conn = connections[database]
+    self.connection = conn.get_new_connection(conn.get_connection_params())
+    self.connection.autocommit = True
+    cursor = self.connection.cursor()
+    cursor.execute("select pg_try_advisory_lock(%s)", (WORKER_LOCK,))
+    self.active = cursor.fetchone()[0]
+    if self.active:
+      cursor.execute("listen frepple_task")
 
-  def run(self):
-    while True:
-      p = Parameter.objects.all().using(self.database).get_or_create(pk='Worker alive')[0]
-      p.value = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-      p.save(update_fields=['value'])
-      time.sleep(5)
+  def fileno(self):
+    return self.connection.fileno()
+
+  def consume(self):
+    '''
+    Read and discard the pending notifications.
+    '''
+    self.connection.poll()
+    del self.connection.notifies[:]
+
+  def wait(self, timeout=60):
+    '''
+    Wait until a task is queued or the timeout expires.
+    '''
+    if select.select([self], [], [], timeout)[0]:
+      self.consume()
+
+  def close(self):
+    self.connection.close()
 
 
 def checkActive(database=DEFAULT_DB_ALIAS):
     try:
-      p = Parameter.objects.all().using(database).get(pk='Worker alive')
-      return datetime.now() - datetime.strptime(p.value, "%Y-%m-%d %H:%M:%S") <= timedelta(0, 5)
+      cursor = connections[database].cursor()
+      cursor.execute('''
+        select count(*) from pg_locks
+        where locktype = 'advisory' and objid = %s and granted
+          and database = (select oid from pg_database where datname = current_database())
+        ''', (WORKER_LOCK,))
+      return cursor.fetchone()[0] > 0
     except:
       return False
 
 
+def runTask(task, database=DEFAULT_DB_ALIAS):
+  '''
+  Executes a single task from the queue.
+  '''
+  try:
+    logger.info("starting task %d at %s" % (task.id, datetime.now()))
+    background = False
+    task.started = datetime.now()
+    # A
+    if task.name == 'generate plan':
+      kwargs = {}
+      for i in task.arguments.split():
+        j = i.split('=')
+        if len(j) > 1:
+          kwargs[j[0][2:]] = j[1]
+        else:
+          kwargs[j[0][2:]] = True
+      if 'background' in kwargs:
+        background = True
+      management.call_command('frepple_run', database=database, task=task.id, **kwargs)
+    # B
+    elif task.name == 'generate model':
+      args = {}
+      for i in task.arguments.split():
+        key, val = i.split('=')
+        args[key[2:]] = val
+      management.call_command('frepple_flush', database=database)
+      management.call_command('frepple_createmodel', database=database, task=task.id, verbosity=0, **args)
+    # C
+    elif task.name == 'empty database':
+      # Erase the database contents
+      args = {}
+      if task.arguments:
+        for i in task.arguments.split():
+          key, val = i.split('=')
+          args[key[2:]] = val
+      management.call_command('frepple_flush', database=database, task=task.id, **args)
+    # D
+    elif task.name == 'load dataset':
+      args = task.arguments.split()
+      management.call_command('loaddata', *args, verbosity=0, database=database, task=task.id)
+    # E
+    elif task.name == 'copy scenario':
+      args = task.arguments.split()
+      management.call_command('frepple_copy', args[0], args[1], force=True, task=task.id)
+    # F
+    elif task.name == 'backup database':
+      management.call_command('frepple_backup', database=database, task=task.id)
+    # G
+    elif task.name == 'generate buckets':
+      args = {}
+      for i in task.arguments.split():
+        key, val = i.split('=')
+        args[key[2:]] = val
+      management.call_command('frepple_createbuckets', database=database, task=task.id, **args)
+    # J
+    elif task.name == 'Openbravo import' and 'freppledb.openbravo' in settings.INSTALLED_APPS:
+      args = {}
+      for i in task.arguments.split():
+        key, val = i.split('=')
+        args[key[2:]] = val
+      management.call_command('openbravo_import', database=database, task=task.id, verbosity=0, **args)
+    # K
+    elif task.name == 'Openbravo export' and 'freppledb.openbravo' in settings.INSTALLED_APPS:
+      if '--filter' in task.arguments:
+        management.call_command('openbravo_export', database=database, task=task.id, verbosity=0, filter=True)
+      else:
+        management.call_command('openbravo_export', database=database, task=task.id, verbosity=0)
+    # L
+    elif task.name == 'Odoo import' and 'freppledb.odoo' in settings.INSTALLED_APPS:
+      management.call_command('odoo_import', database=database, task=task.id, verbosity=0)
+    # M
+    elif task.name == 'import from folder':
+      management.call_command('frepple_importfromfolder', database=database, task=task.id)
+    # N
+    elif task.name == 'export to folder':
+      management.call_command('frepple_exporttofolder', database=database, task=task.id)
+    # O
+    elif task.name == 'export report':
+      args = {}
+      for i in task.arguments.split():
+        key, val = i.split('=', 1)
+        args[key[2:]] = val
+      management.call_command('frepple_exportreport', database=database, task=task.id, **args)
+    else:
+      logger.error('Task %s not recognized' % task.name)
+    # The aggregation of the plan in time buckets is refreshed after loading
+    # data. The task is marked finished again afterwards, which invalidates
+    # the reports cached in the meantime.
+    refreshed = task.name in DATALOAD_TASKS
+    if refreshed:
+      refreshBucketSummaries(database)
+    # Read the task again from the database and update.
+    task = Task.objects.all().using(database).get(pk=task.id)
+    if refreshed or task.status not in ('Done', 'Failed') or not task.finished or not task.started:
+      now = datetime.now()
+      if not task.started:
+        task.started = now
+      if not background:
+        if refreshed or not task.finished:
+          task.finished = now
+        if task.status not in ('Done', 'Failed'):
+          task.status = 'Done'
+      task.save(using=database)
+    logger.info("finished task %d at %s: success" % (task.id, datetime.now()))
+  except Exception as e:
+    task.status = 'Failed'
+    now = datetime.now()
+    if not task.started:
+      task.started = now
+    task.finished = now
+    task.message = str(e)
+    task.save(using=database)
+    logger.info("finished task %d at %s: failed" % (task.id, datetime.now()))
+
+
+def estimateMemory(task, database=DEFAULT_DB_ALIAS):
+  '''
+  Returns a rough estimate of the memory in MB needed to run a task.
+  The estimate for plan generation is based on the size of the model, using
+  the row estimates maintained by PostgreSQL to avoid counting records.
+  '''
+  if task.name not in ('generate plan', 'generate model'):
+    return 100
+  cursor = connections[database].cursor()
+  cursor.execute('''
+    select coalesce(sum(reltuples), 0) from pg_class
+    where relname in (
+      'item', 'location', 'customer', 'supplier', 'calendarbucket',
+      'operation', 'suboperation', 'buffer', 'resource', 'operationmaterial',
+      'operationresource', 'itemsupplier', 'itemdistribution', 'demand',
+      'operationplan', 'operationplanmaterial', 'operationplanresource'
+      )
+    ''')
+  records = cursor.fetchone()[0]
+  # Base footprint of the planning process plus about 2KB per record
+  return 300 + int(records * 2 / 1024)
+
+
+def getMemoryLimit():
+  '''
+  Returns the memory budget in MB for the tasks running in a worker pool.
+  '''
+  limit = getattr(settings, 'WORKER_MEMORY_LIMIT', 0)
+  if limit:
+    return limit
+  try:
+    # Default is 80% of the physical memory
+    return int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') * 0.8 / 1024 / 1024)
+  except:
+    # Unknown on this platform
+    return 4096
+
+
+class WorkerPool:
+  '''
+  Processes the task queues of all scenario databases with a number of
+  tasks running concurrently.
+
+  The pool respects the following rules:
+    - At most "concurrency" tasks run at the same time.
+    - At most one task runs at the same time on a scenario database.
+    - The estimated memory of all running tasks remains within the memory
+      limit. A task is always admitted when no other task is running.
+  Each task runs in a separate worker process.
+  '''
+
+  def __init__(self, databases, concurrency, memorylimit):
+    self.databases = databases
+    self.concurrency = concurrency
+    self.memorylimit = memorylimit
+    # Maps a database to a tuple (process, task id, estimated memory, scenarios used)
+    self.running = {}
+
+  def getScenarios(self, task, database):
+    '''
+    Returns the scenario databases a task works on.
+    '''
+    if task.name == 'copy scenario' and task.arguments:
+      return set([database, task.arguments.split()[1]])
+    return set([database])
+
+  def getCommand(self, database, task):
+    if sys.argv[0].endswith('.py'):
+      cmd = [sys.executable, sys.argv[0]]
+    else:
+      cmd = [sys.argv[0]]
+    return cmd + ['frepple_runworker', '--database=%s' % database, '--task=%s' % task]
+
+  def collect(self):
+    '''
+    Forget about the worker processes that finished.
+    '''
+    for db, (proc, taskid, mem, scenarios) in list(self.running.items()):
+      if proc.poll() is not None:
+        logger.info("finished task %d on database %s with exit code %s" % (taskid, db, proc.returncode))
+        del self.running[db]
+
+  def schedule(self):
+    '''
+    Launch waiting tasks for as long as the admission rules allow it.
+    Returns the number of tasks still waiting.
+    '''
+    waiting = 0
+    for db in self.databases:
+      try:
+        if db in self.running:
+          waiting += Task.objects.all().using(db).filter(status='Waiting').count()
+          continue
+        task = Task.objects.all().using(db).filter(status='Waiting').order_by('id').first()
+        if not task:
+          continue
+        scenarios = self.getScenarios(task, db)
+        busy = set()
+        for i in self.running.values():
+          busy |= i[3]
+        if scenarios & busy:
+          # Only one task per scenario
+          waiting += 1
+          continue
+        if len(self.running) >= self.concurrency:
+          waiting += 1
+          continue
+        mem = estimateMemory(task, db)
+        used = sum([i[2] for i in self.running.values()])
+        if self.running and used + mem > self.memorylimit:
+          logger.info("delaying task %d on database %s: needs %sMB and %sMB of %sMB is in use" % (
+            task.id, db, mem, used, self.memorylimit
+            ))
+          waiting += 1
+          continue
+        logger.info("launching task %d on database %s with an estimated %sMB" % (task.id, db, mem))
+        self.running[db] = (subprocess.Popen(self.getCommand(db, task.id)), task.id, mem, scenarios)
+      except Exception as e:
+        # A database that became unreachable is retried at the next schedule
+        logger.error("Can't schedule tasks on database %s: %s" % (db, e))
+        connections[db].close()
+    return waiting
+
+  def run(self, listeners, continuous=False):
+    '''
+    Process the queues. We reschedule when a task is queued, when a task
+    finishes and, as a safety net, every minute.
+    '''
+    lastschedule = 0
+    waiting = 0
+    while True:
+      finished = len(self.running)
+      self.collect()
+      finished -= len(self.running)
+      if finished or time.time() - lastschedule > 60:
+        waiting = self.schedule()
+        lastschedule = time.time()
+      if not waiting and not self.running and not continuous:
+        break
+      ready = select.select(listeners, [], [], 1)[0]
+      for l in ready:
+        l.consume()
+      if ready:
+        waiting = self.schedule()
+        lastschedule = time.time()
+
+
 class Command(BaseCommand):
   help = '''Processes the job queue of a database.
     The command is intended only to be used internally by frePPLe, not by an API or user.
@@ -69,6 +381,18 @@ class Command(BaseCommand):
       '--continuous', action="store_true", dest='continuous',
       default=False, help='Keep the worker alive after the queue is empty'
       ),
+    make_option(
+      '--pool', action="store_true", dest='pool', default=False,
+      help='Process the queues of all scenario databases with multiple tasks running concurrently'
+      ),
+    make_option(
+      '--concurrency', dest='concurrency', type='int',
+      help='Maximum number of tasks running concurrently in a worker pool'
+      ),
+    make_option(
+      '--task', dest='task', type='int',
+      help='Run only a single task, used internally by the worker pool'
+      ),
   )
   requires_system_checks = False
 
@@ -89,127 +413,71 @@ class Command(BaseCommand):
     else:
       continuous = False
 
+    # Run a single task, launched by a worker pool
+    if options.get('task'):
+      try:
+        task = Task.objects.all().using(database).get(pk=options['task'])
+      except:
+        raise CommandError("Task identifier not found")
+      if task.status != 'Waiting':
+        raise CommandError("Task %s isn't waiting to be processed" % task.id)
+      runTask(task, database)
+      return
+
+    # Run a worker pool over all scenarios
+    if options.get('pool'):
+      listeners = []
+      for db in settings.DATABASES:
+        try:
+          alive = WorkerAlive(db)
+        except Exception as e:
+          # An unreachable scenario doesn't stop the pool
+          logger.error("Skipping database %s: %s" % (db, e))
+          continue
+        if alive.active:
+          listeners.append(alive)
+        else:
+          alive.close()
+      if not listeners:
+        logger.info("Worker process already active")
+        return
+      logger.info("Worker pool starting to process jobs in the queue")
+      try:
+        WorkerPool(
+          [ i.database for i in listeners ],
+          options.get('concurrency') or getattr(settings, 'WORKER_CONCURRENCY', 4),
+          getMemoryLimit()
+          ).run(listeners, continuous)
+      finally:
+        for i in listeners:
+          i.close()
+      logger.info("Worker pool finished all jobs in the queue and exits")
+      return
+
     # Check if a worker already exists
-    if checkActive(database):
+    alive = WorkerAlive(database)
+    if not alive.active:
+      alive.close()
       logger.info("Worker process already active")
       return
 
-    # Spawn a worker-alive thread
-    WorkerAlive(database).start()
-
     # Process the queue
     logger.info("Worker starting to process jobs in the queue")
-    while True:
-      try:
-        task = Task.objects.all().using(database).filter(status='Waiting').order_by('id')[0]
-      except:
-        # No more tasks found
-        if continuous:
-          time.sleep(5)
-          continue
-        else:
-          break
-      try:
-        logger.info("starting task %d at %s" % (task.id, datetime.now()))
-        background = False
-        task.started = datetime.now()
-        # A
-        if task.name == 'generate plan':
-          kwargs = {}
-          for i in task.arguments.split():
-            j = i.split('=')
-            if len(j) > 1:
-              kwargs[j[0][2:]] = j[1]
-            else:
-              kwargs[j[0][2:]] = True
-          if 'background' in kwargs:
-            background = True
-          management.call_command('frepple_run', database=database, task=task.id, **kwargs)
-        # B
-        elif task.name == 'generate model':
-          args = {}
-          for i in task.arguments.split():
-            key, val = i.split('=')
-            args[key[2:]] = val
-          management.call_command('frepple_flush', database=database)
-          management.call_command('frepple_createmodel', database=database, task=task.id, verbosity=0, **args)
-        # C
-        elif task.name == 'empty database':
-          # Erase the database contents
-          args = {}
-          if task.arguments:
-            for i in task.arguments.split():
-              key, val = i.split('=')
-              args[key[2:]] = val
-          management.call_command('frepple_flush', database=database, task=task.id, **args)
-        # D
-        elif task.name == 'load dataset':
-          args = task.arguments.split()
-          management.call_command('loaddata', *args, verbosity=0, database=database, task=task.id)
-        # E
-        elif task.name == 'copy scenario':
-          args = task.arguments.split()
-          management.call_command('frepple_copy', args[0], args[1], force=True, task=task.id)
-        # F
-        elif task.name == 'backup database':
-          management.call_command('frepple_backup', database=database, task=task.id)
-        # G
-        elif task.name == 'generate buckets':
-          args = {}
-          for i in task.arguments.split():
-            key, val = i.split('=')
-            args[key[2:]] = val
-          management.call_command('frepple_createbuckets', database=database, task=task.id, **args)
-        # J
-        elif task.name == 'Openbravo import' and 'freppledb.openbravo' in settings.INSTALLED_APPS:
-          args = {}
-          for i in task.arguments.split():
-            key, val = i.split('=')
-            args[key[2:]] = val
-          management.call_command('openbravo_import', database=database, task=task.id, verbosity=0, **args)
-        # K
-        elif task.name == 'Openbravo export' and 'freppledb.openbravo' in settings.INSTALLED_APPS:
-          if '--filter' in task.arguments:
-            management.call_command('openbravo_export', database=database, task=task.id, verbosity=0, filter=True)
-          else:
-            management.call_command('openbravo_export', database=database, task=task.id, verbosity=0)
-        # L
-        elif task.name == 'Odoo import' and 'freppledb.odoo' in settings.INSTALLED_APPS:
-          management.call_command('odoo_import', database=database, task=task.id, verbosity=0)
-        # M
-        elif task.name == 'import from folder':
-          management.call_command('frepple_importfromfolder', database=database, task=task.id)
-        # N
-        elif task.name == 'export to folder':
-          management.call_command('frepple_exporttofolder', database=database, task=task.id)
-        else:
-          logger.error('Task %s not recognized' % task.name)
-        # Read the task again from the database and update.
-        task = Task.objects.all().using(database).get(pk=task.id)
-        if task.status not in ('Done', 'Failed') or not task.finished or not task.started:
-          now = datetime.now()
-          if not task.started:
-            task.started = now
-          if not background:
-            if not task.finished:
-              task.finished = now
-            if task.status not in ('Done', 'Failed'):
-              task.status = 'Done'
-          task.save(using=database)
-        logger.info("finished task %d at %s: success" % (task.id, datetime.now()))
-      except Exception as e:
-        task.status = 'Failed'
-        now = datetime.now()
-        if not task.started:
-          task.started = now
-        task.finished = now
-        task.message = str(e)
-        task.save(using=database)
-        logger.info("finished task %d at %s: failed" % (task.id, datetime.now()))
-    # Remove the parameter again
     try:
-      Parameter.objects.all().using(self.database).get(pk='Worker alive').delete()
-    except:
-      pass
+      while True:
+        try:
+          task = Task.objects.all().using(database).filter(status='Waiting').order_by('id')[0]
+        except:
+          # No more tasks found
+          if continuous:
+            # Wait for a notification that a new task is queued
+            alive.wait()
+            continue
+          else:
+            break
+        runTask(task, database)
+    finally:
+      # Releases the lock
+      alive.close()
     # Exit
     logger.info("Worker finished all jobs in the queue and exits")
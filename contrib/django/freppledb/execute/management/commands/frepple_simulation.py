@@ -17,7 +17,10 @@
 
 from datetime import datetime, timedelta
 import importlib
+import json
 from optparse import make_option
+import os
+import subprocess
 
 from django.conf import settings
 from django.core import management
@@ -82,6 +85,10 @@ class Command(BaseCommand):
       '--pause', dest='pause', action="store_true", default=False,
       help='Allows to stop the simulation at the end of each step'
       ),
+    make_option(
+      '--engine', dest='engine', action="store_true", default=False,
+      help='Keep the model in memory during the simulation, and only save the final state in the database'
+      ),
   )
   help = '''
   Runs a simulation to measure the plan performance.
@@ -109,6 +116,12 @@ class Command(BaseCommand):
   coded in a dedicated simulation class. A default implementation is
   provided, which can easily be extended in a subclass.
 
+  With the option "engine" the simulation runs in a single frePPLe process
+  which keeps the model in memory. The simulation class then needs to be a
+  subclass of freppledb.execute.simulation.EngineSimulator. The database is
+  only updated with a snapshot of the performance indicators of each bucket
+  and with the final state of the simulation.
+
   Warning: The simulation run will update the data in the database.
   Make a backup if you can't afford loosing the current contents.
   '''
@@ -188,6 +201,20 @@ class Command(BaseCommand):
         curdate = datetime.now()
       curdate = curdate.date()
 
+      if options['engine']:
+        # Simulate in a frePPLe process keeping the model in memory
+        if options['pause']:
+          raise CommandError("The options pause and engine can't be combined")
+        self.simulateInEngine(database, task, curdate, horizon, step, options.get('simulator', None), verbosity)
+        task = Task.objects.all().using(database).get(pk=task.id)
+        task.status = 'Done'
+        task.message = "Simulated from %s till %s" % (curdate, curdate + timedelta(days=horizon))
+        task.finished = datetime.now()
+        task.save(using=database)
+        param.value = (curdate + timedelta(days=horizon)).strftime("%Y-%m-%d %H:%M:%S")
+        param.save(using=database)
+        return
+
       # Compute how many simulation steps we need
       bckt_list = []
       tmp = 0
@@ -324,6 +351,29 @@ class Command(BaseCommand):
         task.save(using=database)
 
 
+  def simulateInEngine(self, database, task, curdate, horizon, step, simulator, verbosity):
+    import freppledb.execute.simulation
+    env = os.environ.copy()
+    env['FREPPLE_TASKID'] = str(task.id)
+    env['FREPPLE_DATABASE'] = database
+    env['FREPPLE_SIMULATION'] = json.dumps({
+      'start': curdate.strftime("%Y-%m-%d"),
+      'horizon': horizon,
+      'step': step,
+      'simulator': simulator,
+      'verbosity': verbosity
+      })
+    env['PATH'] = settings.FREPPLE_HOME + os.pathsep + env['PATH'] + os.pathsep + settings.FREPPLE_APP
+    if os.path.isfile(os.path.join(settings.FREPPLE_HOME, 'libfrepple.so')):
+      env['LD_LIBRARY_PATH'] = settings.FREPPLE_HOME
+    if 'DJANGO_SETTINGS_MODULE' not in env:
+      env['DJANGO_SETTINGS_MODULE'] = 'freppledb.settings'
+    env['PYTHONPATH'] = os.path.normpath(settings.FREPPLE_APP)
+    ret = subprocess.call(['frepple', freppledb.execute.simulation.__file__], env=env)
+    if ret:
+      raise Exception('Simulation failed with exit code %d' % ret)
+
+
 class Simulator(object):
 
   def __init__(self, database=DEFAULT_DB_ALIAS, verbosity=0):
@@ -0,0 +1,169 @@
+#
+# Copyright (C) 2016 by frePPLe bvba
+#
+# This library is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from datetime import datetime
+import json
+from optparse import make_option
+import os
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from freppledb.common.models import User
+from freppledb.execute.models import Task
+
+
+class Command(BaseCommand):
+  option_list = BaseCommand.option_list + (
+    make_option(
+      '--user', dest='user', type='string',
+      help='User running the command'
+      ),
+    make_option(
+      '--database', action='store', dest='database',
+      default=DEFAULT_DB_ALIAS,
+      help='Nominates a specific database to load data from'
+      ),
+    make_option(
+      '--task', dest='task', type='int',
+      help='Task identifier (generated automatically if not provided)'
+      ),
+    make_option(
+      '--variants', dest='variants', type='string',
+      help='JSON list of variants, or the name of a file containing it'
+      ),
+    make_option(
+      '--processes', dest='processes', type='int',
+      help='Number of variants solved in parallel'
+      ),
+  )
+  help = '''
+  Compares the plan of different variants of the solver parameters.
+
+  The model is loaded only once, and the variants are solved in parallel
+  processes sharing the base model in memory. The metrics of the performance
+  indicator report are written for all variants to the file whatif.csv in
+  the log folder. The plan in the database isn't changed.
+
+  A variant overrides one or more solver parameters, eg:
+    [
+    {"name": "base"},
+    {"name": "unconstrained", "constraints": 0},
+    {"name": "unconstrained plan", "plantype": 2},
+    {"name": "no lazy delay", "lazydelay": 0},
+    {"name": "safety stock first", "plansafetystockfirst": true},
+    {"name": "more iterations", "iterationmax": 1000}
+    ]
+  '''
+
+  requires_system_checks = False
+
+  def handle(self, **options):
+    from freppledb.execute.whatif import VARIANT_ATTRIBUTES
+
+    # Pick up the options
+    if 'database' in options:
+      database = options['database'] or DEFAULT_DB_ALIAS
+    else:
+      database = DEFAULT_DB_ALIAS
+    if database not in settings.DATABASES:
+      raise CommandError("No database settings known for '%s'" % database )
+    if 'user' in options and options['user']:
+      try:
+        user = User.objects.all().using(database).get(username=options['user'])
+      except:
+        raise CommandError("User '%s' not found" % options['user'] )
+    else:
+      user = None
+
+    # Parse the variants
+    if not options.get('variants', None):
+      raise CommandError("Missing variants")
+    try:
+      if os.path.isfile(options['variants']):
+        with open(options['variants'], 'r') as f:
+          variants = json.load(f)
+      else:
+        variants = json.loads(options['variants'])
+    except ValueError as e:
+      raise CommandError("Invalid variants: %s" % e)
+    if not isinstance(variants, list) or not variants:
+      raise CommandError("Variants must be a non-empty list")
+    names = set()
+    for v in variants:
+      if not isinstance(v, dict) or not v.get('name', None):
+        raise CommandError("Each variant needs a name")
+      if v['name'] in names:
+        raise CommandError("Duplicate variant '%s'" % v['name'])
+      names.add(v['name'])
+      for key in v:
+        if key != 'name' and key not in VARIANT_ATTRIBUTES:
+          raise CommandError("Invalid attribute '%s' in variant '%s'" % (key, v['name']))
+
+    now = datetime.now()
+    task = None
+    try:
+      # Initialize the task
+      if 'task' in options and options['task']:
+        try:
+          task = Task.objects.all().using(database).get(pk=options['task'])
+        except:
+          raise CommandError("Task identifier not found")
+        if task.started or task.finished or task.status != "Waiting" or task.name != 'what-if analysis':
+          raise CommandError("Invalid task identifier")
+        task.status = '0%'
+        task.started = now
+      else:
+        task = Task(name='what-if analysis', submitted=now, started=now, status='0%', user=user)
+      task.arguments = "%d variants" % len(variants)
+      task.save(using=database)
+
+      # Solve the variants in a frePPLe process
+      env = os.environ.copy()
+      env['FREPPLE_TASKID'] = str(task.id)
+      env['FREPPLE_DATABASE'] = database
+      env['FREPPLE_WHATIF'] = json.dumps(variants)
+      env['PATH'] = settings.FREPPLE_HOME + os.pathsep + env['PATH'] + os.pathsep + settings.FREPPLE_APP
+      if os.path.isfile(os.path.join(settings.FREPPLE_HOME, 'libfrepple.so')):
+        env['LD_LIBRARY_PATH'] = settings.FREPPLE_HOME
+      if 'DJANGO_SETTINGS_MODULE' not in env:
+        env['DJANGO_SETTINGS_MODULE'] = 'freppledb.settings'
+      env['PYTHONPATH'] = os.path.normpath(settings.FREPPLE_APP)
+      if options.get('processes', None):
+        env['FREPPLE_WHATIF_PROCESSES'] = str(options['processes'])
+      import freppledb.execute.whatif
+      ret = subprocess.call(['frepple', freppledb.execute.whatif.__file__], env=env)
+      if ret:
+        raise Exception('What-if analysis failed with exit code %d' % ret)
+
+      # Task update
+      task = Task.objects.all().using(database).get(pk=task.id)
+      task.status = 'Done'
+      task.finished = datetime.now()
+
+    except Exception as e:
+      if task:
+        task.status = 'Failed'
+        task.message = '%s' % e
+        task.finished = datetime.now()
+      raise e
+
+    finally:
+      if task:
+        task.save(using=database)
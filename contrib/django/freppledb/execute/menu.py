@@ -20,3 +20,4 @@ from freppledb.menu import menu
 
 # Add an item to the Admin menu
 menu.addItem("admin", "execute", url="/execute/", label=_('Execute'), index=100)
+menu.addItem("admin", "performance", url="/execute/performance/", label=_('Task performance'), index=110)
@@ -0,0 +1,45 @@
+#
+# Copyright (C) 2016 by frePPLe bvba
+#
+# This library is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('execute', '0001_initial'),
+  ]
+
+  operations = [
+    migrations.RunSQL(
+      '''
+      create or replace function execute_log_notify() returns trigger as $$
+      begin
+        perform pg_notify('frepple_task', new.id::text);
+        return new;
+      end;
+      $$ language plpgsql;
+      create trigger execute_log_notify
+        after insert or update of status on execute_log
+        for each row when (new.status = 'Waiting')
+        execute procedure execute_log_notify();
+      ''',
+      '''
+      drop trigger if exists execute_log_notify on execute_log;
+      drop function if exists execute_log_notify();
+      '''
+      ),
+  ]
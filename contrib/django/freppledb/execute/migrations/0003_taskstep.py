@@ -0,0 +1,46 @@
+#
+# Copyright (C) 2016 by frePPLe bvba
+#
+# This library is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('execute', '0002_task_notify'),
+  ]
+
+  operations = [
+    migrations.CreateModel(
+      name='TaskStep',
+      fields=[
+        ('id', models.AutoField(editable=False, primary_key=True, verbose_name='identifier', serialize=False)),
+        ('sequence', models.IntegerField(editable=False, verbose_name='sequence')),
+        ('description', models.CharField(editable=False, verbose_name='description', max_length=300)),
+        ('started', models.DateTimeField(editable=False, verbose_name='started')),
+        ('walltime', models.FloatField(editable=False, verbose_name='elapsed time')),
+        ('cputime', models.FloatField(null=True, editable=False, verbose_name='cpu time')),
+        ('peakmemory', models.BigIntegerField(null=True, editable=False, verbose_name='process peak memory')),
+        ('modelsize', models.TextField(null=True, editable=False, verbose_name='model size')),
+        ('task', models.ForeignKey(editable=False, verbose_name='task', related_name='steps', to='execute.Task')),
+      ],
+      options={
+        'db_table': 'execute_step',
+        'verbose_name': 'task step',
+        'verbose_name_plural': 'task steps',
+      },
+    ),
+  ]
@@ -59,3 +59,28 @@ class Task(models.Model):
     # Add record to the database
     # Check if a worker is present. If not launch one.
     return 1
+
+
+class TaskStep(models.Model):
+  '''
+  Performance statistics of a step in a task.
+  These are recorded by the PlanTaskRegistry.
+  '''
+  # Database fields
+  id = models.AutoField(_('identifier'), primary_key=True, editable=False)
+  task = models.ForeignKey(Task, verbose_name=_('task'), related_name='steps', editable=False)
+  sequence = models.IntegerField(_('sequence'), editable=False)
+  description = models.CharField(_('description'), max_length=300, editable=False)
+  started = models.DateTimeField(_('started'), editable=False)
+  walltime = models.FloatField(_('elapsed time'), editable=False)
+  cputime = models.FloatField(_('cpu time'), null=True, editable=False)
+  peakmemory = models.BigIntegerField(_('process peak memory'), null=True, editable=False)
+  modelsize = models.TextField(_('model size'), null=True, editable=False)
+
+  def __str__(self):
+    return "%s - %s - %s" % (self.task_id, self.sequence, self.description)
+
+  class Meta:
+    db_table = "execute_step"
+    verbose_name_plural = _('task steps')
+    verbose_name = _('task step')
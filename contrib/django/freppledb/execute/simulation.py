@@ -0,0 +1,601 @@
+#
+# Copyright (C) 2016 by frePPLe bvba
+#
+# This library is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+r'''
+Simulation of the plan execution with the model kept in memory.
+
+The default simulation of the frepple_simulation command updates the
+database in every bucket, and generates a complete plan with a new
+frePPLe process in each bucket. This module runs the same simulation
+steps directly on the objects in memory:
+  - the current date is advanced in frepple.settings.current
+  - proposed orders are confirmed, confirmed orders are completed and
+    their material is moved into the on hand of the buffers
+  - demands are shipped from the on hand inventory
+  - the plan is regenerated in the same process
+The database is only updated to save a snapshot of the performance
+indicators at the end of every bucket, and to save the final state of the
+model at the end of the simulation. The orders completed during the
+simulation are saved with status closed.
+
+This simulation is started with the --engine option of the
+frepple_simulation command, which runs:
+   frepple simulation.py
+with the environment variable FREPPLE_SIMULATION containing the arguments
+of the simulation.
+'''
+
+from datetime import datetime, timedelta, time
+import importlib
+import json
+import os
+import sys
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+class EngineSimulator(object):
+  '''
+  Simulation steps operating on the model in memory.
+  The methods are the same as the Simulator class in the frepple_simulation
+  command. A customized simulation can subclass this class.
+  '''
+
+  def __init__(self, database=DEFAULT_DB_ALIAS, verbosity=0):
+    self.database = database
+    self.verbosity = verbosity
+    self.buckets = 1
+
+    # Fields of the operationplans that were completed
+    self.closed = []
+
+    # Metrics for on-time delivery
+    self.demand_shipped = 0
+    self.demand_late = 0
+    self.demand_lateness = timedelta(0)
+
+    # Metrics for inventory value
+    self.inventory_value = 0
+    self.inventory_quantity = 0
+
+    # Metrics for work in progress
+    self.wip_quantity = 0
+
+    # Metrics for demand
+    self.demand_quantity = 0
+    self.demand_value = 0
+    self.demand_count = 0
+
+
+  @staticmethod
+  def getOrders(ordertype, status, field, limit):
+    '''
+    Returns a list of the top level operationplans of a certain type and
+    status with a start or end date before a date.
+    '''
+    import frepple
+    return [
+      j for j in frepple.operationplans()
+      if j.ordertype == ordertype and j.status == status and not j.owner
+      and not j.demand and getattr(j, field) <= limit
+      ]
+
+
+  def closeOrder(self, opplan):
+    '''
+    Removes a completed operationplan from the model.
+    Its fields are kept to save the order with status closed at the end of
+    the simulation, also when the order was created during the simulation.
+    '''
+    import frepple
+    oper = opplan.operation
+    if opplan.ordertype == 'PO':
+      fields = (
+        None, oper.buffer.item.name, oper.buffer.location.name,
+        None, None, oper.itemsupplier.supplier.name
+        )
+    elif opplan.ordertype == 'DO':
+      fields = (
+        None, oper.destination.item.name, None,
+        oper.origin.location.name, oper.destination.location.name, None
+        )
+    else:
+      fields = (oper.name, None, None, None, None, None)
+    self.closed.append((
+      oper.name, opplan.ordertype, opplan.reference or None, round(opplan.quantity, 6),
+      opplan.start, opplan.end
+      ) + fields + (opplan.id,))
+    frepple.operationplan(id=opplan.id, ordertype=opplan.ordertype, action='R')
+
+
+  def start_bucket(self, strt, nd):
+    '''
+    A method called at the start of each simulation bucket.
+
+    It can be used to gather performance metrics, or initialize some variables.
+    '''
+    return
+
+
+  def end_bucket(self, strt, nd):
+    '''
+    A method called at the end of each simulation bucket.
+
+    It can be used to gather performance metrics, or initialize some variables.
+    '''
+    import frepple
+
+    # Measure the current inventory
+    for b in frepple.buffers():
+      if b.onhand > 0:
+        self.inventory_quantity += b.onhand
+        self.inventory_value += b.onhand * (b.item.price if b.item else 0)
+
+    # Measure the current work-in-progress
+    for j in frepple.operationplans():
+      if j.ordertype == 'MO' and j.status == 'confirmed' and not j.owner:
+        self.wip_quantity += j.quantity
+
+    # Measure the current order book
+    for d in frepple.demands():
+      if d.status == 'open' and not d.hidden:
+        self.demand_count += 1
+        self.demand_quantity += d.quantity
+        self.demand_value += d.quantity * (d.item.price if d.item else 0)
+
+
+  def finish_manufacturing_orders(self, strt, nd):
+    '''
+    Find all confirmed manufacturing orders scheduled to finish in this bucket.
+
+    For each of these manufacturing orders:
+      - execute all operation materials at the end of the operation
+      - remove the manufacturing order
+    '''
+    import frepple
+    for op in self.getOrders('MO', 'confirmed', 'end', datetime.combine(nd, time())):
+      if self.verbosity > 2:
+        print("      Closing MO %s - %d of %s" % (op.id, op.quantity, op.operation.name))
+      for fl in op.operation.flows:
+        if isinstance(fl, frepple.flow_end):
+          fl.buffer.onhand += fl.quantity * op.quantity
+        elif isinstance(fl, frepple.flow_fixed_end):
+          fl.buffer.onhand += fl.quantity
+      self.closeOrder(op)
+
+
+  def create_manufacturing_orders(self, strt, nd):
+    '''
+    Find proposed manufacturing orders within the time bucket.
+    For each of these:
+      - change the status to "confirmed"
+      - execute all operation materials at the start of the operation
+    '''
+    import frepple
+    for op in self.getOrders('MO', 'proposed', 'start', datetime.combine(nd, time())):
+      if self.verbosity > 2:
+        print("      Opening MO %s - %d of %s" % (op.id, op.quantity, op.operation.name))
+      for fl in op.operation.flows:
+        if isinstance(fl, frepple.flow_fixed_start):
+          fl.buffer.onhand += fl.quantity
+        elif isinstance(fl, frepple.flow_start):
+          fl.buffer.onhand += fl.quantity * op.quantity
+      op.status = 'confirmed'
+      # The material is already consumed from the on hand
+      op.consume_material = False
+
+
+  def receive_purchase_orders(self, strt, nd):
+    '''
+    Find all confirmed purchase orders with an expected delivery date within the simulation bucket.
+    For each of these purchase orders:
+      - add the received quantity into the onhand of the buffer
+      - remove the purchase order
+    '''
+    for po in self.getOrders('PO', 'confirmed', 'end', datetime.combine(nd, time())):
+      if self.verbosity > 2:
+        print("      Closing PO %s - %d of %s" % (po.id, po.quantity, po.operation.buffer.name))
+      po.operation.buffer.onhand += po.quantity
+      self.closeOrder(po)
+
+
+  def create_purchase_orders(self, strt, nd):
+    '''
+    Find proposed purchase orders within the time bucket.
+    For each of these purchase orders:
+      - change the status to "confirmed"
+    '''
+    for po in self.getOrders('PO', 'proposed', 'start', datetime.combine(nd, time())):
+      if self.verbosity > 2:
+        print("      Opening PO %s - %d of %s" % (po.id, po.quantity, po.operation.buffer.name))
+      po.status = 'confirmed'
+
+
+  def create_distribution_orders(self, strt, nd):
+    '''
+    Find proposed distribution orders due to be shipped within the time bucket.
+    For each of these distribution orders:
+      - change the status to "confirmed"
+      - consume the material from the source location
+    '''
+    for do in self.getOrders('DO', 'proposed', 'start', datetime.combine(nd, time())):
+      if self.verbosity > 2:
+        print("      Opening DO %s - %d from %s to %s" % (
+          do.id, do.quantity, do.operation.origin.name, do.operation.destination.name
+          ))
+      do.operation.origin.onhand -= do.quantity
+      do.status = 'confirmed'
+      # The material is already consumed from the on hand
+      do.consume_material = False
+
+
+  def receive_distribution_orders(self, strt, nd):
+    '''
+    Find all confirmed distribution orders with an expected delivery date within the simulation buckets.
+    For each of these purchase orders:
+      - add the received quantity into the onhand of the buffer
+      - remove the distribution order
+    '''
+    for do in self.getOrders('DO', 'confirmed', 'end', datetime.combine(nd, time())):
+      if self.verbosity > 2:
+        print("      Closing DO %s - %d of %s" % (do.id, do.quantity, do.operation.destination.name))
+      do.operation.destination.onhand += do.quantity
+      self.closeOrder(do)
+
+
+  def generate_customer_demand(self, strt, nd):
+    '''
+    Simulate new customers orders being received.
+    The default implementation doesn't create any new demands.
+    '''
+    return
+
+
+  def checkAvailable(self, qty, min_qty, oper, consume):
+    '''
+    Verify whether an operationplan of a given quantity is material-feasible.
+    '''
+    import frepple
+    for fl in oper.flows:
+      if fl.quantity > 0 and not consume:
+        continue
+      buf = fl.buffer
+      if isinstance(fl, (frepple.flow_fixed_start, frepple.flow_fixed_end)):
+        flow_qty = 1
+        fixed = True
+      else:
+        flow_qty = fl.quantity
+        fixed = False
+      if consume:
+        buf.onhand += fl.quantity if fixed else qty * fl.quantity
+      elif buf.onhand < - flow_qty * min_qty:
+        # Even the minimum isn't available
+        return 0
+      else:
+        if qty > min_qty:
+          ship_qty = min(- buf.onhand / flow_qty, qty - min_qty)
+        else:
+          ship_qty = - buf.onhand / flow_qty
+        if ship_qty < min_qty:
+          # Remaining open quantity after an ok would be less than the minimum
+          return 0
+        elif ship_qty < qty:
+          # Partial satisfying is possible
+          qty = ship_qty
+    if isinstance(oper, frepple.operation_routing):
+      # All routing suboperations must return an ok
+      for suboper in sorted(oper.suboperations, key=lambda x: x.priority):
+        if not self.checkAvailable(qty, min_qty, suboper.operation, consume):
+          return 0
+    elif isinstance(oper, frepple.operation_alternate):
+      # An ok from a single suboperation suffices.
+      for suboper in sorted(oper.suboperations, key=lambda x: x.priority):
+        if consume:
+          if self.checkAvailable(qty, min_qty, suboper.operation, False):
+            ship_qty = self.checkAvailable(qty, min_qty, suboper.operation, True)
+            if ship_qty:
+              return ship_qty
+        else:
+          ship_qty = self.checkAvailable(qty, min_qty, suboper.operation, consume)
+          if ship_qty:
+            return ship_qty
+      return 0
+    return qty
+
+
+  def checkDemandExpired(self, dmd, nd):
+    if dmd.maxlateness is not None and (dmd.due + timedelta(0, int(dmd.maxlateness))).date() <= nd:
+      # We're beyond the last possible delivery of the demand.
+      # The order will unfortunately expire.
+      dmd.status = 'closed'
+      dmd.category = 'demand unsatisfied and expired'
+      if self.verbosity > 2:
+        print("      Closing demand %s - %d of %s due on %s - unsatisfied quantity" % (
+          dmd.name, dmd.quantity, dmd.item.name, dmd.due
+          ))
+
+
+  def ship_customer_demand(self, strt, nd):
+    '''
+    Deliver customer orders to customers.
+
+    The logic is identical to the Simulator class, but uses the on hand
+    inventory of the buffers in memory.
+    '''
+    import frepple
+    limit = datetime.combine(nd, time())
+    for dmd in sorted(
+      [ d for d in frepple.demands() if d.status == 'open' and not d.hidden and d.due < limit ],
+      key=lambda d: (d.priority, d.due)
+      ):
+      oper = dmd.operation
+      minshipment = max(dmd.minshipment, 0)
+      if isinstance(oper, frepple.operation_delivery):
+        # Case 1: Automatically generated delivery operation
+        buf = oper.buffer
+        if buf.onhand < minshipment:
+          # Not sufficient to ship something
+          self.checkDemandExpired(dmd, nd)
+          continue
+        elif buf.onhand >= dmd.quantity:
+          # Shipping the complete remaining quantity
+          buf.onhand -= dmd.quantity
+        else:
+          if dmd.quantity > minshipment:
+            ship_qty = min(buf.onhand, dmd.quantity - minshipment)
+          else:
+            ship_qty = buf.onhand
+          if ship_qty <= minshipment:
+            # Remaining open quantity after a partial shipment would be less than the minimum shipment
+            self.checkDemandExpired(dmd, nd)
+            continue
+          # Partial shipment is possible
+          dmd.quantity -= ship_qty
+          buf.onhand -= ship_qty
+          if self.verbosity > 2:
+            print("      Partially shipping demand %s - %d of %s due on %s" % (
+              dmd.name, dmd.quantity, dmd.item.name, dmd.due
+              ))
+          self.checkDemandExpired(dmd, nd)
+          continue
+      elif oper:
+        # Case 2: Delivery operation specified
+        ship_qty = self.checkAvailable(dmd.quantity, minshipment, oper, False)
+        if ship_qty <= 0:
+          # We can't ship the order
+          self.checkDemandExpired(dmd, nd)
+          continue
+        # Execute all operation materials on the delivery operation
+        self.checkAvailable(ship_qty, 0, oper, True)
+        if dmd.quantity > ship_qty:
+          # Partial shipment
+          dmd.quantity -= ship_qty
+          self.checkDemandExpired(dmd, nd)
+          continue
+      else:
+        self.checkDemandExpired(dmd, nd)
+        continue
+
+      # We can satisfy this order
+      dmd.status = 'closed'
+      self.demand_shipped += 1
+      if strt > dmd.due.date():
+        self.demand_late += 1
+        self.demand_lateness += strt - dmd.due.date()
+        dmd.category = 'delivered late on %s' % strt
+      else:
+        dmd.category = 'delivered on time on %s' % dmd.due
+      if self.verbosity > 2:
+        print("      Closing demand %s - %d of %s due on %s - delay %s" % (
+          dmd.name, dmd.quantity, dmd.item.name, dmd.due,
+          max(strt - dmd.due.date(), timedelta(0))
+          ))
+
+
+  def getMetrics(self):
+    '''
+    Returns a string with the metrics collected so far.
+    '''
+    return "shipped %d demands, %d late, average inventory value %.2f" % (
+      self.demand_shipped, self.demand_late, self.inventory_value / max(1, self.buckets)
+      )
+
+
+  def getKPIs(self):
+    '''
+    Returns the metrics collected so far, in the format of the performance
+    indicator report.
+    '''
+    return [
+      (501, 'Simulation', 'Shipped demands', self.demand_shipped),
+      (502, 'Simulation', 'Shipped late', self.demand_late),
+      (503, 'Simulation', 'Average lateness', round(
+        self.demand_lateness.total_seconds() / 86400.0 / max(1, self.demand_late), 6
+        )),
+      (504, 'Simulation', 'Average inventory value', round(self.inventory_value / max(1, self.buckets), 6)),
+      (505, 'Simulation', 'Average work in progress', round(self.wip_quantity / max(1, self.buckets), 6)),
+      ]
+
+
+  def show_metrics(self):
+    if not self.verbosity:
+      return
+    print("   Average open demands: %.2f for %.2f units with value %.2f" % (
+      self.demand_count/self.buckets, self.demand_quantity/self.buckets, self.demand_value/self.buckets
+      ))
+    print("   Shipped %s demands" % self.demand_shipped)
+    print("   Shipped %d demands late, average lateness %.2f days" % (
+      self.demand_late, self.demand_lateness.total_seconds()/ 3600.0 / 24.0 / max(1, self.demand_late)
+      ))
+    print("   Average inventory: %.2f units with value %.2f" % (
+      self.inventory_quantity/self.buckets, self.inventory_value/self.buckets
+      ))
+    print("   Average work in progress: %.2f units" % (self.wip_quantity/self.buckets))
+
+
+  def save(self):
+    '''
+    Save the final state of the model in the database.
+    The completed orders are no longer in the model. Orders loaded from
+    the database are updated with their final state, and orders created
+    during the simulation are inserted.
+    '''
+    from freppledb.execute.export_database_static import exportStaticModel
+    from freppledb.execute.export_database_plan import export
+    from freppledb.output.models import refreshBucketSummaries
+    exportStaticModel(database=self.database).run()
+    export(database=self.database, verbosity=self.verbosity).run()
+    now = datetime.now()
+    with transaction.atomic(using=self.database):
+      cursor = connections[self.database].cursor()
+      cursor.executemany(
+        '''
+        update operationplan
+          set status='closed', quantity=%s, startdate=%s, enddate=%s, lastmodified=%s
+          where id = %s
+        ''',
+        [ (i[3], i[4], i[5], now, i[-1]) for i in self.closed ]
+        )
+      cursor.executemany(
+        '''
+        insert into operationplan
+          (name, type, status, reference, quantity, startdate, enddate,
+          operation_id, item_id, location_id, origin_id, destination_id,
+          supplier_id, id, lastmodified)
+        select %s, %s, 'closed', %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+        where not exists (select 1 from operationplan where id = %s)
+        ''',
+        [ i + (now, i[-1]) for i in self.closed ]
+        )
+    refreshBucketSummaries(self.database)
+
+
+def simulate(database=DEFAULT_DB_ALIAS, task=None, start=None, horizon=60, step=1, simulator=None, verbosity=0):
+  '''
+  Runs the simulation on the model in memory.
+  '''
+  import frepple
+  from freppledb.execute.commands import LoadData, LoadDynamicData, SupplyPlanning
+  from freppledb.execute.models import Task
+  from freppledb.execute.whatif import computeKPIs
+  from freppledb.output.models import saveKPIs
+
+  if task:
+    task = Task.objects.all().using(database).get(pk=task)
+
+  # Load the model
+  LoadData.run(database=database)
+  LoadDynamicData.run(database=database)
+
+  # Create the simulator
+  if simulator:
+    class_data = simulator.split(".")
+    cls = getattr(importlib.import_module(".".join(class_data[:-1])), class_data[-1])
+  else:
+    cls = EngineSimulator
+  sim = cls(database=database, verbosity=verbosity)
+
+  # Compute the simulation buckets
+  if not start:
+    start = frepple.settings.current.date()
+  bckt_list = []
+  tmp = 0
+  while tmp <= horizon:
+    bckt_list.append(start + timedelta(days=tmp))
+    tmp += step
+  bckt_list_len = len(bckt_list)
+
+  # Loop over all dates in the simulation horizon
+  solver = SupplyPlanning.createSolver(database)
+  for idx in range(1, bckt_list_len):
+    strt = bckt_list[idx - 1]
+    nd = bckt_list[idx]
+    sim.buckets += 1
+    if verbosity > 0:
+      print("\nStart simulating bucket from %s to %s (%s out of %s)" % (strt, nd, idx, bckt_list_len))
+
+    # Advance the current date
+    frepple.settings.current = datetime.combine(strt, time())
+
+    sim.start_bucket(strt, nd)
+    sim.generate_customer_demand(strt, nd)
+    if verbosity > 1:
+      print("  Generating plan...")
+    solver.solve()
+    sim.create_purchase_orders(strt, nd)
+    sim.create_manufacturing_orders(strt, nd)
+    sim.create_distribution_orders(strt, nd)
+    sim.receive_purchase_orders(strt, nd)
+    sim.receive_distribution_orders(strt, nd)
+    sim.finish_manufacturing_orders(strt, nd)
+    sim.ship_customer_demand(strt, nd)
+    sim.end_bucket(strt, nd)
+
+    # Save a snapshot of the performance indicators of the bucket
+    saveKPIs(database, computeKPIs() + sim.getKPIs(), task=task.id if task else None)
+    if task:
+      task.status = "%.0f%%" % (100.0 * idx / bckt_list_len)
+      task.message = 'Simulated bucket from %s to %s: %s' % (strt, nd, sim.getMetrics())
+      task.save(using=database, update_fields=['status', 'message'])
+
+  # Save the final state
+  if verbosity > 1:
+    print("Saving the final state of the simulation")
+  frepple.settings.current = datetime.combine(bckt_list[-1], time())
+  solver.solve()
+  sim.save()
+  saveKPIs(database, computeKPIs() + sim.getKPIs(), task=task.id if task else None)
+  sim.show_metrics()
+  return bckt_list
+
+
+if __name__ == "__main__":
+  # Select database
+  try:
+    database = os.environ['FREPPLE_DATABASE'] or DEFAULT_DB_ALIAS
+  except:
+    database = DEFAULT_DB_ALIAS
+
+  # Initialize django
+  import django
+  django.setup()
+
+  # Use the test database if we are running the test suite
+  if 'FREPPLE_TEST' in os.environ:
+    settings.DATABASES[database]['NAME'] = settings.DATABASES[database]['TEST']['NAME']
+
+  # Make sure the debug flag is not set!
+  settings.DEBUG = False
+
+  # Send the output to a logfile
+  if database == DEFAULT_DB_ALIAS:
+    frepple.settings.logfile = os.path.join(settings.FREPPLE_LOGDIR, 'frepple.log')
+  else:
+    frepple.settings.logfile = os.path.join(settings.FREPPLE_LOGDIR, 'frepple_%s.log' % database)
+
+  # Welcome message
+  print("FrePPLe simulation with processid %s on %s using database '%s'" % (
+    os.getpid(),
+    sys.platform,
+    database
+    ))
+
+  args = json.loads(os.environ.get('FREPPLE_SIMULATION', '{}'))
+  if args.get('start'):
+    args['start'] = datetime.strptime(args['start'], "%Y-%m-%d").date()
+  simulate(database=database, task=os.environ.get('FREPPLE_TASKID', None), **args)
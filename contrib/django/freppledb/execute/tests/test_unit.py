@@ -15,18 +15,23 @@
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import csv
 import os
 
 from django.conf import settings
 from django.core import management, serializers
 from django.db import DEFAULT_DB_ALIAS, transaction
 from django.db.models import Sum, Count, Q
-from django.test import TransactionTestCase, TestCase
+from django.test import SimpleTestCase, TransactionTestCase, TestCase
 from django.test.utils import override_settings
 
 import freppledb.output as output
 import freppledb.input as input
 import freppledb.common as common
+from freppledb.execute.engine import runsInEngine
+from freppledb.execute.models import Task
+from freppledb.execute.whatif import getFileName
+from freppledb.output.models import getKPIs, computeKPIsFromDatabase
 
 
 @override_settings(INSTALLED_APPS=settings.INSTALLED_APPS + ('django.contrib.sessions',))
@@ -67,6 +72,8 @@ class execute_with_commands(TransactionTestCase):
     self.assertTrue(input.models.OperationPlanMaterial.objects.count() > 400)
     self.assertTrue(input.models.OperationPlanResource.objects.count() > 20)
     self.assertTrue(input.models.OperationPlan.objects.count() > 300)
+    # The performance indicators are saved with the plan
+    self.assertTrue(output.models.KPI.objects.filter(category='Demand', name='Requested').exists())
 
 
 class execute_multidb(TransactionTestCase):
@@ -195,3 +202,121 @@ class execute_simulation(TransactionTestCase):
       "Some demands weren't shipped"
       )
     # TODO add comparison with initial_planned_late
+
+  def test_run_engine(self):
+    # Run the simulation with the model in memory
+    management.call_command('frepple_simulation', step=7, horizon=120, engine=True, verbosity=0)
+    task = Task.objects.all().filter(name='plan simulation').order_by('-id')[0]
+    self.assertEqual(task.status, 'Done')
+    self.assertEqual(
+      input.models.Demand.objects.all().filter(~Q(status='closed')).count(), 0,
+      "Some demands weren't shipped"
+      )
+    # The orders completed during the simulation are saved with their history
+    self.assertTrue(input.models.OperationPlan.objects.all().filter(status='closed', type='PO').exists())
+    self.assertTrue(input.models.OperationPlan.objects.all().filter(status='closed', type='MO').exists())
+    # A snapshot of the performance indicators is saved for every bucket
+    snapshots = output.models.KPI.objects.all().filter(category='Simulation') \
+      .values_list('computed', flat=True).distinct()
+    self.assertEqual(len(snapshots), 120 // 7 + 1)
+
+
+@override_settings(INSTALLED_APPS=settings.INSTALLED_APPS + ('django.contrib.sessions',))
+class execute_incremental(TransactionTestCase):
+
+  fixtures = ["demo"]
+
+  def setUp(self):
+    # Make sure the test database is used
+    os.environ['FREPPLE_TEST'] = "YES"
+
+  def tearDown(self):
+    del os.environ['FREPPLE_TEST']
+    if 'FREPPLE_INCREMENTAL' in os.environ:
+      del os.environ['FREPPLE_INCREMENTAL']
+
+  def test_run_cmd(self):
+    # Generate a complete plan
+    management.call_command('frepple_run', plantype=1, constraint=15, env='supply')
+    exported = {
+      i.id: i.lastmodified
+      for i in input.models.OperationPlan.objects.all().filter(status='proposed')
+      }
+    self.assertTrue(exported)
+
+    # Without changes no cluster is replanned. The operationplans written by
+    # the previous export aren't seen as changes.
+    management.call_command('frepple_run', plantype=1, constraint=15, env='supply', incremental=True)
+    self.assertEqual(
+      {
+        i.id: i.lastmodified
+        for i in input.models.OperationPlan.objects.all().filter(status='proposed')
+        },
+      exported
+      )
+
+    # After changing a demand only its cluster is replanned
+    demand = input.models.Demand.objects.all().exclude(status='closed').order_by('name')[0]
+    demand.quantity += 1
+    demand.save()
+    management.call_command('frepple_run', plantype=1, constraint=15, env='supply', incremental=True)
+    replanned = input.models.OperationPlan.objects.all().filter(status='proposed') \
+      .exclude(lastmodified__in=set(exported.values()))
+    self.assertTrue(replanned.filter(demand=demand).exists())
+    self.assertTrue(
+      input.models.OperationPlan.objects.all().filter(
+        status='proposed', lastmodified__in=set(exported.values())
+        ).exists(),
+      "All clusters were replanned"
+      )
+
+
+@override_settings(INSTALLED_APPS=settings.INSTALLED_APPS + ('django.contrib.sessions',))
+class execute_whatif(TransactionTestCase):
+
+  fixtures = ["demo"]
+
+  def setUp(self):
+    # Make sure the test database is used
+    os.environ['FREPPLE_TEST'] = "YES"
+
+  def tearDown(self):
+    del os.environ['FREPPLE_TEST']
+
+  def test_kpis(self):
+    # The indicators saved from the plan in memory are the same as those
+    # computed from the exported plan
+    management.call_command('frepple_run', plantype=1, constraint=15, env='supply')
+    saved = { (k.code, k.category, k.name): round(k.value) for k in getKPIs(DEFAULT_DB_ALIAS)[0][1] }
+    for code, category, name, value in computeKPIsFromDatabase(DEFAULT_DB_ALIAS):
+      if code in (201, 202, 203, 204, 206, 301):
+        self.assertEqual(saved[(code, category, name)], value, "Different %s %s" % (category, name))
+
+  def test_run_cmd(self):
+    management.call_command('frepple_run', plantype=1, constraint=15, env='supply')
+    management.call_command(
+      'frepple_whatif', processes=2,
+      variants='[{"name": "base"}, {"name": "unconstrained", "constraints": 0}]'
+      )
+    self.assertEqual(Task.objects.all().filter(name='what-if analysis').order_by('-id')[0].status, 'Done')
+    with open(getFileName(DEFAULT_DB_ALIAS), 'r', newline='') as f:
+      rows = list(csv.reader(f))
+    self.assertEqual(rows[0], ['category', 'name', 'current plan', 'base', 'unconstrained'])
+    opcount = [ r for r in rows if r[:2] == ['Operation', 'Count'] ][0]
+    for value in opcount[2:]:
+      self.assertTrue(int(value) > 0)
+
+
+class EngineTest(SimpleTestCase):
+
+  @override_settings(PLANNING_ENGINE_TIMEOUT=600)
+  def test_runs_in_engine(self):
+    # Only plan generations started without options use the resident engine
+    self.assertTrue(runsInEngine('--constraint=15 --plantype=1'))
+    self.assertTrue(runsInEngine('--constraint=15 --plantype=1 --incremental'))
+    self.assertFalse(runsInEngine('--constraint=15 --plantype=1 --env=supply'))
+    self.assertFalse(runsInEngine('--constraint=15 --plantype=1 --background'))
+
+  @override_settings(PLANNING_ENGINE_TIMEOUT=0)
+  def test_engine_disabled(self):
+    self.assertFalse(runsInEngine('--constraint=15 --plantype=1'))
@@ -20,6 +20,7 @@ import os.path
 import sys
 import re
 from datetime import datetime
+from itertools import islice
 from subprocess import Popen
 from time import localtime, strftime
 
@@ -37,11 +38,13 @@ from django.contrib import messages
 from django.utils.encoding import force_text
 
 from freppledb.common.commands import PlanTaskRegistry
-from freppledb.execute.models import Task
+from freppledb.execute.engine import getLogFile, runsInEngine
+from freppledb.execute.models import Task, TaskStep
 from freppledb.common.models import Scenario
 from freppledb.common.report import exportWorkbook, importWorkbook
-from freppledb.common.report import GridReport, GridFieldDateTime, GridFieldText, GridFieldInteger
+from freppledb.common.report import GridReport, GridFieldDateTime, GridFieldText, GridFieldInteger, GridFieldNumber
 from freppledb.execute.management.commands.frepple_runworker import checkActive
+from freppledb.execute.management.commands.frepple_exportreport import getExportFile
 
 import logging
 logger = logging.getLogger(__name__)
@@ -144,6 +147,50 @@ class TaskReport(GridReport):
       }
 
 
+class TaskStepReport(GridReport):
+  '''
+  A list report to follow the performance of the plan generation steps
+  across runs.
+  The change column compares the elapsed time of a step with the previous
+  run of the same step.
+  '''
+  title = _('Task performance')
+  basequeryset = TaskStep.objects.all().extra(select={
+    'change': '''
+      round(cast(execute_step.walltime / nullif((
+        select prev.walltime from execute_step prev
+        where prev.sequence = execute_step.sequence
+          and prev.description = execute_step.description
+          and prev.task_id < execute_step.task_id
+        order by prev.task_id desc
+        limit 1
+        ), 0) as numeric), 2)
+      ''',
+    'operationplans': "cast(cast(execute_step.modelsize as json)->'OperationPlan'->>'count' as bigint)"
+    })
+  model = TaskStep
+  frozenColumns = 0
+  multiselect = False
+  editable = False
+  default_sort = (0, 'desc')
+  help_url = 'user-guide/user-interface/execute.html'
+
+  rows = (
+    GridFieldInteger('id', title=_('identifier'), key=True, hidden=True),
+    GridFieldInteger('task', title=_('task'), field_name='task__id', editable=False),
+    #. Translators: Translation included with Django
+    GridFieldText('name', title=_('name'), field_name='task__name', editable=False, align='center'),
+    GridFieldInteger('sequence', title=_('sequence'), editable=False),
+    GridFieldText('description', title=_('description'), editable=False, width=200),
+    GridFieldDateTime('started', title=_('started'), editable=False, align='center'),
+    GridFieldNumber('walltime', title=_('elapsed time'), editable=False),
+    GridFieldNumber('change', title=_('change'), editable=False, search=False),
+    GridFieldNumber('cputime', title=_('cpu time'), editable=False),
+    GridFieldInteger('peakmemory', title=_('process peak memory (KB)'), editable=False),
+    GridFieldInteger('operationplans', title=_('operationplans'), editable=False, search=False),
+    )
+
+
 @staff_member_required
 @never_cache
 @csrf_protect
@@ -198,7 +245,10 @@ def wrapTask(request, action):
       env.append(value)
     if env:
       task.arguments = "%s --env=%s" % (task.arguments, ','.join(env))
+    if request.POST.get('incremental'):
+      task.arguments += " --incremental"
     request.session['env'] = env
+    request.session['incremental'] = bool(request.POST.get('incremental'))
     task.save(using=request.database)
     # Update the session object
     request.session['plantype'] = request.POST.get('plantype')
@@ -295,10 +345,19 @@ def wrapTask(request, action):
     # Task not recognized
     raise Exception('Invalid launching task')
 
-  # Launch a worker process, making sure it inherits the right
-  # environment variables from this parent
+  if task:
+    launchWorker(worker_database)
+  return task
+
+
+def launchWorker(database):
+  '''
+  Launches a worker process to execute the waiting tasks of a scenario,
+  unless a worker is already active on it.
+  The worker inherits the environment variables from this parent process.
+  '''
   os.environ['FREPPLE_CONFIGDIR'] = settings.FREPPLE_CONFIGDIR
-  if task and not checkActive(worker_database):
+  if not checkActive(database):
     if os.path.isfile(os.path.join(settings.FREPPLE_APP, "frepplectl.py")):
       if "python" in sys.executable:
         # Development layout
@@ -306,7 +365,7 @@ def wrapTask(request, action):
           sys.executable,  # Python executable
           os.path.join(settings.FREPPLE_APP, "frepplectl.py"),
           "frepple_runworker",
-          "--database=%s" % worker_database
+          "--database=%s" % database
           ])
       else:
         # Deployment on Apache web server
@@ -314,23 +373,22 @@ def wrapTask(request, action):
           "python",
           os.path.join(settings.FREPPLE_APP, "frepplectl.py"),
           "frepple_runworker",
-          "--database=%s" % worker_database
+          "--database=%s" % database
           ], creationflags=0x08000000)
     elif sys.executable.find('freppleserver.exe') >= 0:
       # Py2exe executable
       Popen([
         sys.executable.replace('freppleserver.exe', 'frepplectl.exe'),  # frepplectl executable
         "frepple_runworker",
-        "--database=%s" % worker_database
+        "--database=%s" % database
         ], creationflags=0x08000000)  # Do not create a console window
     else:
       # Linux standard installation
       Popen([
         "frepplectl",
         "frepple_runworker",
-        "--database=%s" % worker_database
+        "--database=%s" % database
         ])
-  return task
 
 
 @staff_member_required
@@ -343,24 +401,32 @@ def CancelTask(request, taskid):
   try:
     task = Task.objects.all().using(request.database).get(pk=taskid)
     if task.name == 'generate plan' and task.status.endswith("%"):
-      if request.database == DEFAULT_DB_ALIAS:
+      # Ask the planning process to stop at the next step, cluster or demand
+      if Task.objects.all().using(request.database) \
+        .filter(pk=taskid, status__endswith='%') \
+        .update(status='Canceling'):
+          return HttpResponse(content="OK")
+      task = Task.objects.all().using(request.database).get(pk=taskid)
+    if task.name == 'generate plan' and (task.status.endswith("%") or task.status == 'Canceling'):
+      # A second cancel request kills the planning process. A plan delegated
+      # to the resident engine is generated by the engine process.
+      if runsInEngine(task.arguments):
+        fname = getLogFile(request.database)
+      elif request.database == DEFAULT_DB_ALIAS:
         fname = os.path.join(settings.FREPPLE_LOGDIR, 'frepple.log')
       else:
         fname = os.path.join(settings.FREPPLE_LOGDIR, 'frepple_%s.log' % request.database)
       try:
-        # The second line in the log file has the id of the frePPLe process
+        # The welcome message at the start of the log file has the id of
+        # the frePPLe process
         with open(fname, 'r') as f:
-          t = 0
-          for line in f:
-            if t >= 1:
-              t = line.split()
+          for line in islice(f, 5):
+            t = line.split()
+            if t and t[0] == 'FrePPLe' and 'processid' in t[:5]:
+              # Kill the process with signal 9
+              os.kill(int(t[t.index('processid') + 1]), 9)
+              task.message = 'Killed process'
               break
-            else:
-              t += 1
-          if t[0] == 'FrePPLe' and t[1] == 'with' and t[2] == 'processid':
-            # Kill the process with signal 9
-            os.kill(int(t[3]), 9)
-            task.message = 'Killed process'
       except Exception as e:
         return HttpResponseServerError('Error canceling task')
     elif task.status != 'Waiting':
@@ -403,6 +469,29 @@ def DownloadLogFile(request):
   return response
 
 
+@staff_member_required
+@never_cache
+def DownloadExport(request, taskid):
+  '''
+  Downloads the spreadsheet generated by a report export task.
+  Only the user that launched the export can download it.
+  '''
+  try:
+    task = Task.objects.all().using(request.database).get(pk=taskid, name='export report', status='Done')
+  except Task.DoesNotExist:
+    raise Http404('File not found')
+  if task.user != request.user and not request.user.is_superuser:
+    raise Http404('File not found')
+  filename = getExportFile(request.database, task.id)
+  response = static.serve(
+    request, os.path.basename(filename),
+    document_root=os.path.dirname(filename)
+    )
+  response['Content-Disposition'] = 'attachment; filename="export_%s.xlsx"' % task.id
+  response['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+  return response
+
+
 @staff_member_required
 @never_cache
 def logfile(request):
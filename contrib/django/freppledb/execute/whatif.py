@@ -0,0 +1,307 @@
+#
+# Copyright (C) 2016 by frePPLe bvba
+#
+# This library is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+r'''
+What-if analysis comparing variants of the solver parameters.
+
+The model is loaded from the database only once. Every variant is then
+solved in a separate process forked from the process holding the base
+model, so the variants share the memory of the model until they start
+changing it. Up to PLANNING_WHATIF_PROCESSES variants are solved in
+parallel.
+On platforms without fork the variants are solved one after the other in
+the same process, each solver run starting from the same locked
+operationplans.
+
+Each variant is a dictionary with a name and the solver attributes to
+override, eg:
+   {"name": "unconstrained", "constraints": 0}
+   {"name": "lazy", "lazydelay": 3600, "iterationmax": 100}
+   {"name": "safety stock", "plansafetystockfirst": true}
+The supported attributes are listed in the VARIANT_ATTRIBUTES variable.
+
+The metrics of the performance indicator report are computed for every
+variant, and written to the file whatif.csv in the log folder next to the
+metrics of the current plan. Nothing is saved in the database, apart from
+the status of the task.
+
+This analysis is started with the frepple_whatif command, which runs:
+   frepple whatif.py
+with the environment variable FREPPLE_WHATIF containing the variants.
+'''
+
+import csv
+from datetime import datetime
+import json
+import multiprocessing
+import os
+import sys
+from time import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# Solver attributes a variant can override
+VARIANT_ATTRIBUTES = (
+  'constraints', 'plantype', 'lazydelay', 'plansafetystockfirst', 'iterationmax'
+  )
+
+# Solver shared by the variants. It is created in the parent process before
+# forking the worker processes.
+solver = None
+
+
+def computeKPIs():
+  '''
+  Returns the metrics of the performance indicator report for the plan in
+  memory, as a list of tuples (id, category, name, value).
+  The plan generation saves these metrics for the report
+  freppledb.output.views.kpi.Report. The function computeKPIsFromDatabase
+  in freppledb.output.models computes the same metrics from the plan in
+  the database.
+  '''
+  import frepple
+  kpis = []
+
+  # Problems
+  count = {}
+  weight = {}
+  for p in frepple.problems():
+    count[p.name] = count.get(p.name, 0) + 1
+    weight[p.name] = weight.get(p.name, 0) + p.weight
+  for n in sorted(count):
+    kpis.append( (101, 'Problem count', n, count[n]) )
+  for n in sorted(weight):
+    kpis.append( (102, 'Problem weight', n, round(weight[n])) )
+
+  # Demand
+  requested = 0
+  planned = 0
+  late = 0
+  lateness = 0
+  for d in frepple.demands():
+    if d.status in ('open', 'quote'):
+      requested += d.quantity
+    for j in d.operationplans:
+      if j.owner:
+        continue
+      planned += j.quantity
+      if j.end > d.due:
+        late += j.quantity
+        lateness += j.quantity * (j.end - d.due).total_seconds()
+  kpis.extend([
+    (201, 'Demand', 'Requested', round(requested)),
+    (202, 'Demand', 'Planned', round(planned)),
+    (203, 'Demand', 'Planned late', round(late)),
+    (204, 'Demand', 'Planned on time', round(planned - late)),
+    (205, 'Demand', 'Unplanned', round(weight.get('unplanned', 0))),
+    (206, 'Demand', 'Total lateness', round(lateness / 86400)),
+    ])
+
+  # Operations, counting the same operationplans as the export of the plan
+  opcount = 0
+  opquantity = 0
+  for o in frepple.operations():
+    exported = not o.hidden or isinstance(o, (
+      frepple.operation_inventory, frepple.operation_itemdistribution, frepple.operation_itemsupplier
+      ))
+    for j in o.operationplans:
+      if exported or j.demand or (j.owner and j.owner.demand):
+        opcount += 1
+        opquantity += j.quantity
+  kpis.extend([
+    (301, 'Operation', 'Count', opcount),
+    (301, 'Operation', 'Quantity', round(opquantity)),
+    ])
+
+  # Resources
+  usage = 0
+  for r in frepple.resources():
+    for j in r.loadplans:
+      if j.quantity < 0:
+        usage -= j.quantity * (j.enddate - j.startdate).total_seconds()
+  kpis.append( (302, 'Resource', 'Usage', round(usage / 86400)) )
+
+  # Material
+  produced = 0
+  consumed = 0
+  for b in frepple.buffers():
+    for j in b.flowplans:
+      if j.quantity > 0:
+        produced += j.quantity
+      elif j.quantity < 0:
+        consumed -= j.quantity
+  kpis.extend([
+    (401, 'Material', 'Produced', round(produced)),
+    (402, 'Material', 'Consumed', round(consumed)),
+    ])
+  return kpis
+
+
+def solveVariant(variant):
+  '''
+  Solve a single variant, and return its name, runtime and metrics.
+  '''
+  for key, value in variant.items():
+    if key in VARIANT_ATTRIBUTES:
+      setattr(solver, key, value)
+  print("Start solving variant '%s' in process %s at %s" % (
+    variant['name'], os.getpid(), datetime.now().strftime("%H:%M:%S")
+    ))
+  starttime = time()
+  solver.solve()
+  runtime = time() - starttime
+  print("Finished solving variant '%s' in %.2f seconds" % (variant['name'], runtime))
+  return (variant['name'], runtime, computeKPIs())
+
+
+def getFileName(database=DEFAULT_DB_ALIAS):
+  if database == DEFAULT_DB_ALIAS:
+    return os.path.join(settings.FREPPLE_LOGDIR, 'whatif.csv')
+  else:
+    return os.path.join(settings.FREPPLE_LOGDIR, 'whatif_%s.csv' % database)
+
+
+def analyze(database=DEFAULT_DB_ALIAS, task=None, variants=None, processes=None):
+  '''
+  Solves all variants of the model and writes a comparison of their metrics.
+  '''
+  global solver
+  from freppledb.execute.commands import LoadData, LoadDynamicData, SupplyPlanning
+  from freppledb.execute.models import Task
+  from freppledb.common.cache import isLatestTask
+  from freppledb.output.models import getKPIs, computeKPIsFromDatabase
+
+  if not variants:
+    return
+  if task:
+    task = Task.objects.all().using(database).get(pk=task)
+    task.message = LoadData.description
+    task.save(using=database, update_fields=['message'])
+
+  # Load the base model
+  LoadData.run(database=database)
+  LoadDynamicData.run(database=database)
+  solver = SupplyPlanning.createSolver(database)
+  defaults = { i: getattr(solver, i) for i in VARIANT_ATTRIBUTES }
+
+  # Solve the variants
+  results = {}
+  if task:
+    task.status = '10%'
+    task.message = 'Solving %d variants' % len(variants)
+    task.save(using=database, update_fields=['status', 'message'])
+  try:
+    ctx = multiprocessing.get_context('fork')
+  except ValueError:
+    ctx = None
+  if ctx and len(variants) > 1:
+    # The worker processes mustn't share the database connections of this process
+    connections.close_all()
+    # Every worker solves a single variant, such that each variant starts
+    # from a fresh copy of the base model.
+    with ctx.Pool(processes=processes, maxtasksperchild=1) as pool:
+      for name, runtime, kpis in pool.imap_unordered(solveVariant, variants):
+        results[name] = (runtime, kpis)
+        if task:
+          task.status = '%.0f%%' % (10 + 90.0 * len(results) / len(variants))
+          task.save(using=database, update_fields=['status'])
+          connections.close_all()
+  else:
+    for v in variants:
+      tmp = defaults.copy()
+      tmp.update(v)
+      name, runtime, kpis = solveVariant(tmp)
+      results[name] = (runtime, kpis)
+      if task:
+        task.status = '%.0f%%' % (10 + 90.0 * len(results) / len(variants))
+        task.save(using=database, update_fields=['status'])
+
+  # Write the comparison, including the metrics of the current plan as a
+  # baseline. The metrics saved by the last plan generation are only used
+  # when no other task changed the plan since.
+  names = [ v['name'] for v in variants ]
+  rows = {}
+  for name in names:
+    for kpi in results[name][1]:
+      rows.setdefault(kpi[:3], {})[name] = kpi[3]
+  columns = list(names)
+  runtimes = [ round(results[n][0], 2) for n in names ]
+  baseline = getKPIs(database)
+  if baseline and baseline[0][1] and isLatestTask(database, baseline[0][1][0].task):
+    baseline = [ (k.code, k.category, k.name, k.value) for k in baseline[0][1] ]
+  else:
+    baseline = computeKPIsFromDatabase(database)
+  columns.insert(0, None)
+  runtimes.insert(0, None)
+  for kpi in baseline:
+    rows.setdefault(tuple(kpi[:3]), {})[None] = round(kpi[3])
+  filename = getFileName(database)
+  with open(filename, 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(['category', 'name'] + [ 'current plan' if n is None else n for n in columns ])
+    writer.writerow(['Run', 'Solver time'] + runtimes)
+    for key in sorted(rows):
+      writer.writerow([key[1], key[2]] + [ rows[key].get(n, 0) for n in columns ])
+  print("Wrote comparison of %d variants to %s" % (len(names), filename))
+  if task:
+    task.message = 'Compared %d variants in %s' % (len(names), os.path.basename(filename))
+    task.save(using=database, update_fields=['message'])
+
+
+if __name__ == "__main__":
+  # Select database
+  try:
+    database = os.environ['FREPPLE_DATABASE'] or DEFAULT_DB_ALIAS
+  except:
+    database = DEFAULT_DB_ALIAS
+
+  # Initialize django
+  import django
+  django.setup()
+
+  # Use the test database if we are running the test suite
+  if 'FREPPLE_TEST' in os.environ:
+    settings.DATABASES[database]['NAME'] = settings.DATABASES[database]['TEST']['NAME']
+
+  # Make sure the debug flag is not set!
+  settings.DEBUG = False
+
+  # Send the output to a logfile
+  if database == DEFAULT_DB_ALIAS:
+    frepple.settings.logfile = os.path.join(settings.FREPPLE_LOGDIR, 'frepple.log')
+  else:
+    frepple.settings.logfile = os.path.join(settings.FREPPLE_LOGDIR, 'frepple_%s.log' % database)
+
+  # Welcome message
+  print("FrePPLe what-if analysis with processid %s on %s using database '%s'" % (
+    os.getpid(),
+    sys.platform,
+    database
+    ))
+
+  if 'FREPPLE_WHATIF_PROCESSES' in os.environ:
+    processes = int(os.environ['FREPPLE_WHATIF_PROCESSES'])
+  else:
+    processes = getattr(settings, 'PLANNING_WHATIF_PROCESSES', None)
+  analyze(
+    database=database,
+    task=os.environ.get('FREPPLE_TASKID', None),
+    variants=json.loads(os.environ.get('FREPPLE_WHATIF', '[]')),
+    processes=processes
+    )
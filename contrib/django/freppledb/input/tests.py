@@ -14,13 +14,16 @@
 # You should have received a copy of the GNU Affero General Public
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+import csv
+import json
 import tempfile
 
 from django.conf import settings
 from django.test import TestCase
 from django.test.utils import override_settings
 
-from freppledb.input.models import Location
+from freppledb.common.models import User
+from freppledb.input.models import Demand, Location
 
 
 @override_settings(INSTALLED_APPS=settings.INSTALLED_APPS + ('django.contrib.sessions',))
@@ -60,6 +63,55 @@ class DataLoadTest(TestCase):
     response = self.client.get('/data/input/suboperation/?format=json')
     self.assertContains(response, '"records":4,')
 
+  def test_keyset_pagination(self):
+    User.objects.filter(username='admin').update(pagesize=5)
+
+    def getPage(url):
+      response = self.client.get(url)
+      return json.loads(b''.join(response.streaming_content).decode('utf-8'))
+
+    # Pages retrieved with a cursor are equal to pages retrieved with an offset
+    url = '/data/input/demand/?format=json&sidx=due&sord=desc'
+    page1 = getPage(url)
+    self.assertEqual(page1['records'], 14)
+    self.assertEqual(len(page1['rows']), 5)
+    page2 = getPage(url + '&page=2&cursor=' + page1['cursor'])
+    self.assertEqual(page2['rows'], getPage(url + '&page=2')['rows'])
+    page3 = getPage(url + '&page=3&cursor=' + page2['cursor'])
+    self.assertEqual(page3['rows'], getPage(url + '&page=3')['rows'])
+    self.assertEqual(len(page3['rows']), 4)
+    self.assertNotIn('cursor', page3)
+
+    # A cursor of another page is ignored
+    self.assertEqual(
+      getPage(url + '&page=3&cursor=' + page1['cursor'])['rows'],
+      page3['rows']
+      )
+
+    # Skipping the count
+    page = getPage(url + '&count=none&page=2')
+    self.assertTrue(page['estimated'])
+    self.assertEqual(page['total'], 3)
+    self.assertEqual(page['rows'], page2['rows'])
+
+  def test_supply_path(self):
+    for url in ('/supplypath/item/product/', '/whereused/item/product/', '/supplypath/demand/Demand%2001/'):
+      response = self.client.get(url + '?format=json')
+      self.assertEqual(response.status_code, 200)
+      data = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+      self.assertGreater(len(data['rows']), 0, "Empty path for %s" % url)
+
+  def test_csv_export(self):
+    response = self.client.get('/data/input/demand/?format=csvlist&sidx=due&sord=asc')
+    self.assertEqual(response.status_code, 200)
+    data = b''.join(response.streaming_content).decode(settings.CSV_CHARSET).lstrip('\ufeff')
+    rows = list(csv.reader(data.splitlines()))
+    self.assertEqual(len(rows), 15)
+    self.assertEqual(
+      [ r[0] for r in rows[1:] ],
+      [ i.name for i in Demand.objects.order_by('due', 'pk') ]
+      )
+
   def test_csv_upload(self):
     self.assertEqual(
       [(i.name, i.category or u'') for i in Location.objects.all()],
@@ -15,11 +15,11 @@
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+from copy import copy
 import json
 
 from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
-from django.db.models import Q
 from django.http import HttpResponse, Http404
 from django.db.models.fields import CharField
 from django.utils.translation import ugettext_lazy as _
@@ -71,6 +71,94 @@ def search(request):
      )
 
 
+class SupplyNetwork:
+  '''
+  The supply network of a database, loaded in memory with a single query per
+  table and indexed on the relations the supply path reports navigate.
+  The supply path and where-used reports walk this structure instead of
+  querying the database at every step of the path.
+  '''
+  def __init__(self, database):
+    self.items = { i.name: i for i in Item.objects.using(database).only('name', 'owner') }
+    self.locations = { i.name: i for i in Location.objects.using(database).only('name', 'owner') }
+
+    # Buffers by name and by item
+    self.buffers = {}
+    self.buffers_by_item = {}
+    for b in Buffer.objects.using(database).select_related('item', 'location'):
+      self.buffers[b.name] = b
+      self.buffers_by_item.setdefault(b.item_id, []).append(b)
+
+    # Operations by name and by item
+    self.operations = {}
+    self.operations_by_item = {}
+    for o in Operation.objects.using(database).select_related('item', 'location'):
+      self.operations[o.name] = o
+      if o.item_id:
+        self.operations_by_item.setdefault(o.item_id, []).append(o)
+
+    # Operation hierarchy, sorted by descending priority
+    self.suboperations = {}
+    self.superoperations = {}
+    for s in SubOperation.objects.using(database).only('operation', 'suboperation', 'priority').order_by('-priority', 'id'):
+      self.suboperations.setdefault(s.operation_id, []).append(self.operations[s.suboperation_id])
+      self.superoperations.setdefault(s.suboperation_id, []).append(self.operations[s.operation_id])
+
+    # Materials by operation, and consuming materials by item
+    self.materials = {}
+    self.consumers = {}
+    for m in OperationMaterial.objects.using(database).select_related('item').order_by('id'):
+      m.operation = self.operations[m.operation_id]
+      self.materials.setdefault(m.operation_id, []).append(m)
+      if m.quantity is not None and m.quantity < 0:
+        self.consumers.setdefault(m.item_id, []).append(m)
+
+    # Resources by operation, and operations by resource
+    self.loads = {}
+    self.loads_by_resource = {}
+    for r in OperationResource.objects.using(database).select_related('resource').order_by('id'):
+      r.operation = self.operations[r.operation_id]
+      self.loads.setdefault(r.operation_id, []).append(r)
+      self.loads_by_resource.setdefault(r.resource_id, []).append(r)
+
+    # Sourcing rules by item
+    self.suppliers = {}
+    for i in ItemSupplier.objects.using(database).select_related('item', 'location', 'supplier', 'resource').order_by('id'):
+      self.suppliers.setdefault(i.item_id, []).append(i)
+    self.distributions = {}
+    for i in ItemDistribution.objects.using(database).select_related('item', 'location', 'origin', 'resource').order_by('id'):
+      self.distributions.setdefault(i.item_id, []).append(i)
+
+  def getAncestors(self, item):
+    '''
+    Returns the names of an item and all its parent items.
+    '''
+    result = []
+    name = item.name
+    while name and name not in result:
+      result.append(name)
+      parent = self.items.get(name, None)
+      name = parent.owner_id if parent else None
+    return result
+
+  def _getByItem(self, index, item, key):
+    # Objects defined for the item or any of its parent items
+    result = []
+    for i in self.getAncestors(item):
+      result.extend(index.get(i, []))
+    result.sort(key=key)
+    return result
+
+  def getSuppliers(self, item):
+    return self._getByItem(self.suppliers, item, lambda x: x.id)
+
+  def getDistributions(self, item):
+    return self._getByItem(self.distributions, item, lambda x: x.id)
+
+  def getOperations(self, item):
+    return self._getByItem(self.operations_by_item, item, lambda x: x.name)
+
+
 class PathReport(GridReport):
   '''
   A report showing the upstream supply path or following downstream a
@@ -137,45 +225,47 @@ class PathReport(GridReport):
 
 
   @classmethod
-  def getRoot(reportclass, request, entity):
+  def getRoot(reportclass, request, entity, network):
     raise Http404("invalid entity type")
 
 
   @classmethod
-  def findDeliveries(reportclass, item, location, db):
+  def findDeliveries(reportclass, item, location, network):
     # Automatically detect delivery operations. This is done by looking for
     # a buffer for this item and location combination.
     buf = None
     # Find a buffer record
-    for b in Buffer.objects.using(db).filter(item=item, location=location):
-      buf = b
+    for b in network.buffers_by_item.get(item.name, []):
+      if b.location_id == location.name:
+        buf = b
     if not buf:
       # Create a buffer record
       buf = Buffer(
         name='%s @ %s' % (item, location),
-        item=Item.objects.using(db).get(name=item),
-        location=Location.objects.using(db).get(name=location)
+        item=network.items[item.name],
+        location=network.locations[location.name]
         )
-    return reportclass.findReplenishment(buf, db, 0, 1, 0, False)
+    return reportclass.findReplenishment(buf, network, 0, 1, 0, False)
 
 
   @classmethod
-  def findUsage(reportclass, buffer, db, level, curqty, realdepth, pushsuper):
+  def findUsage(reportclass, buffer, network, level, curqty, realdepth, pushsuper):
     result = [
       (level - 1, None, i.operation, curqty, 0, None, realdepth, pushsuper, buffer.location.name if buffer.location else None)
-      for i in buffer.item.operationmaterials.filter(quantity__lt=0).filter(operation__location__name=buffer.location.name).only('operation').using(db)
+      for i in network.consumers.get(buffer.item.name, [])
+      if i.operation.location_id == buffer.location.name
       ]
-    for i in ItemDistribution.objects.using(db).filter(
-        item__lft__lte=buffer.item.lft, item__rght__gt=buffer.item.lft,
-        origin__name=buffer.location.name
-        ):
+    for i in network.getDistributions(buffer.item):
+      if i.origin_id != buffer.location.name:
+        continue
+      i = copy(i)
       i.item = buffer.item
       result.append( (level - 1, None, i, curqty, 0, None, realdepth - 1, pushsuper, i.location.name if i.location else None) )
     return result
 
 
   @classmethod
-  def findReplenishment(reportclass, buffer, db, level, curqty, realdepth, pushsuper):
+  def findReplenishment(reportclass, buffer, network, level, curqty, realdepth, pushsuper):
     # If a producing operation is set on the buffer, we use that and skip the
     # automated search described below.
     # If no producing operation is set, we look for item distribution and
@@ -183,30 +273,27 @@ class PathReport(GridReport):
     # case in case only a single location exists in the model, a match on the
     # item is sufficient).
     result = []
-    if Location.objects.using(db).count() > 1:
+    if len(network.locations) > 1:
       # Multiple locations
-      for i in ItemSupplier.objects.using(db).filter(
-        Q(location__isnull=True) | Q(location__name=buffer.location.name),
-        item__lft__lte=buffer.item.lft, item__rght__gt=buffer.item.lft
-        ):
+      for i in network.getSuppliers(buffer.item):
+        if i.location_id is None or i.location_id == buffer.location.name:
+          i = copy(i)
           i.item = buffer.item
           i.location = buffer.location
           result.append(
             (level, None, i, curqty, 0, None, realdepth, pushsuper, buffer.location.name if buffer.location else None)
             )
-      for i in ItemDistribution.objects.using(db).filter(
-        Q(location__isnull=True) | Q(location__name=buffer.location.name),
-        item__lft__lte=buffer.item.lft, item__rght__gt=buffer.item.lft
-        ):
+      for i in network.getDistributions(buffer.item):
+        if i.location_id is None or i.location_id == buffer.location.name:
+          i = copy(i)
           i.item = buffer.item
           i.location = buffer.location
           result.append(
             (level, None, i, curqty, 0, None, realdepth, pushsuper, i.location.name if i.location else None)
             )
-      for i in Operation.objects.using(db).filter(
-        Q(location__isnull=True) | Q(location__name=buffer.location.name),
-        item__lft__lte=buffer.item.lft, item__rght__gt=buffer.item.lft
-        ):
+      for i in network.getOperations(buffer.item):
+        if i.location_id is None or i.location_id == buffer.location.name:
+          i = copy(i)
           i.item = buffer.item
           i.location = buffer.location
           result.append(
@@ -214,17 +301,15 @@ class PathReport(GridReport):
             )
     else:
       # Single location
-      for i in ItemSupplier.objects.using(db).filter(
-        item__lft__lte=buffer.item.lft, item__rght__gt=buffer.item.lft
-        ):
+      for i in network.getSuppliers(buffer.item):
+        i = copy(i)
         i.item = buffer.item
         i.location = buffer.location
         result.append(
           (level, None, i, curqty, 0, None, realdepth, pushsuper, buffer.location.name if buffer.location else None)
           )
-      for i in Operation.objects.using(db).filter(
-        item__lft__lte=buffer.item.lft, item__rght__gt=buffer.item.lft
-        ):
+      for i in network.getOperations(buffer.item):
+          i = copy(i)
           i.item = buffer.item
           i.location = buffer.location
           result.append(
@@ -238,13 +323,12 @@ class PathReport(GridReport):
     '''
     A function that recurses upstream or downstream in the supply chain.
     '''
-    # Update item and location hierarchies
-    Item.rebuildHierarchy(database=request.database)
-    Location.rebuildHierarchy(database=request.database)
+    # Load the supply network in memory
+    network = SupplyNetwork(request.database)
 
     entity = basequery.query.get_compiler(basequery.db).as_sql(with_col_aliases=False)[1]
     entity = entity[0]
-    root = reportclass.getRoot(request, entity)
+    root = reportclass.getRoot(request, entity, network)
 
     # Recurse over all operations
     # TODO the current logic isn't generic enough. A lot of buffers may not be explicitly
@@ -259,14 +343,14 @@ class PathReport(GridReport):
       curnode = counter
       counter += 1
       if isinstance(location, str):
-        curlocation = Location.objects.all().using(request.database).get(name=location)
+        curlocation = network.locations[location]
 
       # If an operation has parent operations we forget about the current operation
       # and use only the parent
       if pushsuper and not isinstance(curoperation, (ItemSupplier, ItemDistribution)):
         hasParents = False
-        for x in curoperation.superoperations.using(request.database).only('operation').order_by("-priority"):
-          root.append( (level, parent, x.operation, curqty, issuboperation, parentoper, realdepth, False, location) )
+        for x in network.superoperations.get(curoperation.name, []):
+          root.append( (level, parent, x, curqty, issuboperation, parentoper, realdepth, False, location) )
           hasParents = True
         if hasParents:
           continue
@@ -297,12 +381,10 @@ class PathReport(GridReport):
             resources = [ (curoperation.resource.name, float(curoperation.resource_qty)) ]
           else:
             resources = None
-          try:
-            downstr = Buffer.objects.using(request.database).get(name="%s @ %s" % (curoperation.item.name, curoperation.location.name))
-            root.extend( reportclass.findUsage(downstr, request.database, level, curqty, realdepth + 1, True) )
-          except Buffer.DoesNotExist:
+          downstr = network.buffers.get("%s @ %s" % (curoperation.item.name, curoperation.location.name), None)
+          if not downstr:
             downstr = Buffer(name="%s @ %s" % (curoperation.item.name, curoperation.location.name), item=curoperation.item, location=curlocation)
-            root.extend( reportclass.findUsage(downstr, request.database, level, curqty, realdepth + 1, True) )
+          root.extend( reportclass.findUsage(downstr, network, level, curqty, realdepth + 1, True) )
         elif isinstance(curoperation, ItemDistribution):
           name = 'Ship %s from %s to %s' % (curoperation.item.name, curoperation.origin.name, curoperation.location.name)
           optype = "distribution"
@@ -316,33 +398,34 @@ class PathReport(GridReport):
             resources = [ (curoperation.resource.name, float(curoperation.resource_qty)) ]
           else:
             resources = None
-          try:
-            downstr = Buffer.objects.using(request.database).get(name="%s @ %s" % (curoperation.item.name, location))
-            root.extend( reportclass.findUsage(downstr, request.database, level, curqty, realdepth + 1, True) )
-          except Buffer.DoesNotExist:
+          downstr = network.buffers.get("%s @ %s" % (curoperation.item.name, location), None)
+          if not downstr:
             downstr = Buffer(name="%s @ %s" % (curoperation.item.name, location), item=curoperation.item, location=curlocation)
-            root.extend( reportclass.findUsage(downstr, request.database, level, curqty, realdepth + 1, True) )
+          root.extend( reportclass.findUsage(downstr, network, level, curqty, realdepth + 1, True) )
         else:
           name = curoperation.name
           optype = curoperation.type
           duration = curoperation.duration
           duration_per = curoperation.duration_per
-          buffers = [ ('%s @ %s' % (x.item.name, curoperation.location.name), float(x.quantity)) for x in curoperation.operationmaterials.only('item', 'quantity').using(request.database) ]
-          resources = [ (x.resource.name, float(x.quantity)) for x in curoperation.operationresources.only('resource', 'quantity').using(request.database) ]
-          for x in curoperation.operationmaterials.filter(quantity__gt=0).only('item').using(request.database):
-            curflows = x.item.operationmaterials.filter(quantity__lt=0, operation__location=curoperation.location.name).only('operation', 'quantity').using(request.database)
+          buffers = [ ('%s @ %s' % (x.item.name, curoperation.location.name), float(x.quantity)) for x in network.materials.get(curoperation.name, []) ]
+          resources = [ (x.resource.name, float(x.quantity)) for x in network.loads.get(curoperation.name, []) ]
+          for x in network.materials.get(curoperation.name, []):
+            if x.quantity is None or x.quantity <= 0:
+              continue
+            curflows = [
+              y for y in network.consumers.get(x.item.name, [])
+              if y.operation.location_id == curoperation.location.name
+              ]
             for y in curflows:
               hasChildren = True
               root.append( (level - 1, curnode, y.operation, - curqty * y.quantity, subcount, None, realdepth - 1, pushsuper, x.operation.location.name if x.operation.location else None) )
-            try:
-              downstr = Buffer.objects.using(request.database).get(name="%s @ %s" % (x.item.name, location))
-              root.extend( reportclass.findUsage(downstr, request.database, level-1, curqty, realdepth - 1, True) )
-            except Buffer.DoesNotExist:
+            downstr = network.buffers.get("%s @ %s" % (x.item.name, location), None)
+            if not downstr:
               downstr = Buffer(name="%s @ %s" % (curoperation.item.name, location), item=x.item, location=curlocation)
-              root.extend( reportclass.findUsage(downstr, request.database, level-1, curqty, realdepth - 1, True) )
-          for x in curoperation.suboperations.using(request.database).only('suboperation').order_by("-priority"):
+            root.extend( reportclass.findUsage(downstr, network, level-1, curqty, realdepth - 1, True) )
+          for x in network.suboperations.get(curoperation.name, []):
             subcount += curoperation.type == "routing" and 1 or -1
-            root.append( (level - 1, curnode, x.suboperation, curqty, subcount, curoperation, realdepth, False, location) )
+            root.append( (level - 1, curnode, x, curqty, subcount, curoperation, realdepth, False, location) )
             hasChildren = True
       else:
         # Upstream recursion
@@ -369,33 +452,35 @@ class PathReport(GridReport):
             resources = [ (curoperation.resource.name, float(curoperation.resource_qty)) ]
           else:
             resources = None
-          try:
-            upstr = Buffer.objects.using(request.database).get(name="%s @ %s" % (curoperation.item.name, curoperation.origin.name))
-            root.extend( reportclass.findReplenishment(upstr, request.database, level + 2, curqty, realdepth + 1, True) )
-          except Buffer.DoesNotExist:
+          upstr = network.buffers.get("%s @ %s" % (curoperation.item.name, curoperation.origin.name), None)
+          if not upstr:
             upstr = Buffer(name="%s @ %s" % (curoperation.item.name, curoperation.origin.name), item=curoperation.item, location=curoperation.origin)
-            root.extend( reportclass.findReplenishment(upstr, request.database, level + 2, curqty, realdepth + 1, True) )
+          root.extend( reportclass.findReplenishment(upstr, network, level + 2, curqty, realdepth + 1, True) )
         else:
           curprodflow = None
           name = curoperation.name
           optype = curoperation.type
           duration = curoperation.duration
           duration_per = curoperation.duration_per
-          buffers = [ ('%s @ %s' % (x.item.name, curoperation.location.name), float(x.quantity)) for x in curoperation.operationmaterials.only('item', 'quantity').using(request.database) ]
-          resources = [ (x.resource.name, float(x.quantity)) for x in curoperation.operationresources.only('resource', 'quantity').using(request.database) ]
-          for x in curoperation.operationmaterials.filter(quantity__gt=0).only('quantity').using(request.database):
-            curprodflow = x
-          curflows = curoperation.operationmaterials.filter(quantity__lt=0).only('item', 'quantity').using(request.database)
+          buffers = [ ('%s @ %s' % (x.item.name, curoperation.location.name), float(x.quantity)) for x in network.materials.get(curoperation.name, []) ]
+          resources = [ (x.resource.name, float(x.quantity)) for x in network.loads.get(curoperation.name, []) ]
+          for x in network.materials.get(curoperation.name, []):
+            if x.quantity is not None and x.quantity > 0:
+              curprodflow = x
+          curflows = [
+            y for y in network.materials.get(curoperation.name, [])
+            if y.quantity is not None and y.quantity < 0
+            ]
           for y in curflows:
             b = Buffer(
               name='%s @ %s' % (y.item.name, curoperation.location.name),
               item=y.item,
               location=curoperation.location
               )
-            root.extend( reportclass.findReplenishment(b, request.database, level + 2, curqty, realdepth + 1, True) )
-          for x in curoperation.suboperations.using(request.database).only('suboperation').order_by("-priority"):
+            root.extend( reportclass.findReplenishment(b, network, level + 2, curqty, realdepth + 1, True) )
+          for x in network.suboperations.get(curoperation.name, []):
             subcount += curoperation.type == "routing" and 1 or -1
-            root.append( (level + 1, curnode, x.suboperation, curqty, subcount, curoperation, realdepth, False, location) )
+            root.append( (level + 1, curnode, x, curqty, subcount, curoperation, realdepth, False, location) )
             hasChildren = True
 
       # Process the current node
@@ -425,7 +510,7 @@ class UpstreamDemandPath(PathReport):
   objecttype = Demand
 
   @classmethod
-  def getRoot(reportclass, request, entity):
+  def getRoot(reportclass, request, entity, network):
     from django.core.exceptions import ObjectDoesNotExist
 
     try:
@@ -433,13 +518,13 @@ class UpstreamDemandPath(PathReport):
     except ObjectDoesNotExist:
       raise Http404("demand %s doesn't exist" % entity)
 
-    if dmd.operation:
+    if dmd.operation_id:
       # Delivery operation on the demand
-      return [ (0, None, dmd.operation, 1, 0, None, 0, False, None) ]
+      return [ (0, None, network.operations[dmd.operation_id], 1, 0, None, 0, False, None) ]
     else:
       # Autogenerated delivery operation
       try:
-        return reportclass.findDeliveries(dmd.item, dmd.location, request.database)
+        return reportclass.findDeliveries(network.items[dmd.item_id], network.locations[dmd.location_id], network)
       except:
         raise Http404("No supply path defined for demand %s" % entity)
 
@@ -449,69 +534,42 @@ class UpstreamItemPath(PathReport):
   objecttype = Item
 
   @classmethod
-  def getRoot(reportclass, request, entity):
-    from django.core.exceptions import ObjectDoesNotExist
-    try:
-      locs = set()
-      result = []
-      it = Item.objects.using(request.database).get(name=entity)
-      if reportclass.downstream:
-        # Find all buffers where the item is being stored and walk downstream
-        for b in Buffer.objects.filter(item=it).using(request.database):
-          locs.add(b.location.name)
-          result.extend( reportclass.findUsage(b, request.database, 0, 1, 0, True) )
-        # Add item locations that can be replenished
-        for itmdist in ItemDistribution.objects.using(request.database).filter(
-          item__lft__lte=it.lft, item__rght__gt=it.lft
-          ):
-            if itmdist.location.name in locs:
-              continue
-            locs.add(itmdist.location.name)
-            itmdist.item = it
-            result.append(
-              (0, None, itmdist, 1, 0, None, 0, False, itmdist.location.name)
-              )
-        # Add item locations that can be replenished
-        for itmsup in Operation.objects.using(request.database).filter(          
-          item__lft__lte=it.lft, item__rght__gt=it.lft
-          ):
-            if itmsup.location.name in locs:
-              continue
-            locs.add(itmsup.location.name)
-            itmsup.item = it            
-            result.append(
-              (0, None, itmsup, 1, 0, None, 0, False, itmsup.location.name)
-              )        
-        return result
-      else:
-        # Find the supply path of all buffers of this item
-        for b in Buffer.objects.filter(item=entity).using(request.database):
-          result.extend( reportclass.findReplenishment(b, request.database, 0, 1, 0, True) )
-        # Add item locations that can be replenished
-        for itmdist in ItemDistribution.objects.using(request.database).filter(
-          item__lft__lte=it.lft, item__rght__gt=it.lft
-          ):
-            if itmdist.location.name in locs:
-              continue
-            locs.add(itmdist.location.name)
-            itmdist.item = it
-            result.append(
-              (0, None, itmdist, 1, 0, None, 0, False, itmdist.location.name)
-              )
-        # Add item locations that can be replenished
-        for itmsup in Operation.objects.using(request.database).filter(          
-          item__lft__lte=it.lft, item__rght__gt=it.lft
-          ):
-            if itmsup.location.name in locs:
-              continue
-            locs.add(itmsup.location.name)
-            itmsup.item = it            
-            result.append(
-              (0, None, itmsup, 1, 0, None, 0, False, itmsup.location.name)
-              )        
-        return result
-    except ObjectDoesNotExist:
+  def getRoot(reportclass, request, entity, network):
+    it = network.items.get(entity, None)
+    if not it:
       raise Http404("item %s doesn't exist" % entity)
+    locs = set()
+    result = []
+    if reportclass.downstream:
+      # Find all buffers where the item is being stored and walk downstream
+      for b in network.buffers_by_item.get(it.name, []):
+        locs.add(b.location.name)
+        result.extend( reportclass.findUsage(b, network, 0, 1, 0, True) )
+    else:
+      # Find the supply path of all buffers of this item
+      for b in network.buffers_by_item.get(it.name, []):
+        result.extend( reportclass.findReplenishment(b, network, 0, 1, 0, True) )
+    # Add item locations that can be replenished
+    for itmdist in network.getDistributions(it):
+      if itmdist.location.name in locs:
+        continue
+      locs.add(itmdist.location.name)
+      itmdist = copy(itmdist)
+      itmdist.item = it
+      result.append(
+        (0, None, itmdist, 1, 0, None, 0, False, itmdist.location.name)
+        )
+    # Add item locations that can be replenished
+    for itmsup in network.getOperations(it):
+      if itmsup.location.name in locs:
+        continue
+      locs.add(itmsup.location.name)
+      itmsup = copy(itmsup)
+      itmsup.item = it
+      result.append(
+        (0, None, itmsup, 1, 0, None, 0, False, itmsup.location.name)
+        )
+    return result
 
 
 class UpstreamBufferPath(PathReport):
@@ -519,16 +577,14 @@ class UpstreamBufferPath(PathReport):
   objecttype = Buffer
 
   @classmethod
-  def getRoot(reportclass, request, entity):
-    from django.core.exceptions import ObjectDoesNotExist
-    try:
-      buf = Buffer.objects.using(request.database).get(name=entity)
-      if reportclass.downstream:
-        return reportclass.findUsage(buf, request.database, 0, 1, 0, True)
-      else:
-        return reportclass.findReplenishment(buf, request.database, 0, 1, 0, True)
-    except ObjectDoesNotExist:
+  def getRoot(reportclass, request, entity, network):
+    buf = network.buffers.get(entity, None)
+    if not buf:
       raise Http404("buffer %s doesn't exist" % entity)
+    if reportclass.downstream:
+      return reportclass.findUsage(buf, network, 0, 1, 0, True)
+    else:
+      return reportclass.findReplenishment(buf, network, 0, 1, 0, True)
 
 
 class UpstreamResourcePath(PathReport):
@@ -536,15 +592,15 @@ class UpstreamResourcePath(PathReport):
   objecttype = Resource
 
   @classmethod
-  def getRoot(reportclass, request, entity):
+  def getRoot(reportclass, request, entity, network):
     from django.core.exceptions import ObjectDoesNotExist
     try:
-      root = Resource.objects.using(request.database).get(name=entity)
+      Resource.objects.using(request.database).only('name').get(name=entity)
     except ObjectDoesNotExist:
       raise Http404("resource %s doesn't exist" % entity)
     return [
       (0, None, i.operation, 1, 0, None, 0, True, i.operation.location.name if i.operation.location else None)
-      for i in root.operationresources.using(request.database).all()
+      for i in network.loads_by_resource.get(entity, [])
       ]
 
 
@@ -553,13 +609,11 @@ class UpstreamOperationPath(PathReport):
   objecttype = Operation
 
   @classmethod
-  def getRoot(reportclass, request, entity):
-    from django.core.exceptions import ObjectDoesNotExist
-    try:
-      oper = Operation.objects.using(request.database).get(name=entity)
-      return [ (0, None, oper, 1, 0, None, 0, True, oper.location.name if oper.location else None) ]
-    except ObjectDoesNotExist:
+  def getRoot(reportclass, request, entity, network):
+    oper = network.operations.get(entity, None)
+    if not oper:
       raise Http404("operation %s doesn't exist" % entity)
+    return [ (0, None, oper, 1, 0, None, 0, True, oper.location.name if oper.location else None) ]
 
 
 class DownstreamItemPath(UpstreamItemPath):
@@ -30,6 +30,7 @@ from django.utils.translation import ugettext_lazy as _
 
 from freppledb.common.models import Parameter
 from freppledb.common.commands import PlanTaskRegistry, PlanTask
+from freppledb.execute.commands import SupplyPlanning
 
 
 @PlanTaskRegistry.register
@@ -52,6 +53,7 @@ class OdooReadData(PlanTask):
 
   description = "Load Odoo data"
   sequence = 150
+  resources = (PlanTask.ENGINE_WRITE,)
   label = ('odoo_read_1', _("Read Odoo data"))
 
   @classmethod
@@ -134,6 +136,7 @@ class OdooReadData(PlanTask):
 class OdooSaveStatic(PlanTask):
   description = "Save static model"
   sequence = 150
+  resources = (PlanTask.ENGINE_READ,)
   label = ('odoo_read_1', _("Read Odoo data"))
 
   @classmethod
@@ -189,6 +192,8 @@ class OdooWritePlan(PlanTask):
 
   description = "Write results to Odoo"
   sequence = 450
+  dependencies = (SupplyPlanning,)
+  resources = (PlanTask.ENGINE_READ,)
   label = ('odoo_write', _("Write results to Odoo"))
 
   @classmethod
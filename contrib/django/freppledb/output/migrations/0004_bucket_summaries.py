@@ -0,0 +1,104 @@
+#
+# Copyright (C) 2016 by frePPLe bvba
+#
+# This library is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from django.db import models, migrations
+
+
+def refreshSummaries(apps, schema_editor):
+  from freppledb.output.models import refreshBucketSummaries
+  refreshBucketSummaries(schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('output', '0003_number_precision'),
+    ('input', '0008_number_precision'),
+    ('common', '0003_wizard'),
+  ]
+
+  operations = [
+    migrations.CreateModel(
+      name='BufferSummary',
+      fields=[
+        ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+        ('buffer', models.CharField(verbose_name='buffer', max_length=300)),
+        ('bucket', models.CharField(verbose_name='bucket', max_length=300)),
+        ('startdate', models.DateTimeField(verbose_name='startdate')),
+        ('enddate', models.DateTimeField(verbose_name='enddate')),
+        ('produced', models.DecimalField(verbose_name='produced', max_digits=15, decimal_places=6, default=0)),
+        ('consumed', models.DecimalField(verbose_name='consumed', max_digits=15, decimal_places=6, default=0)),
+        ('endoh', models.DecimalField(verbose_name='end inventory', max_digits=15, decimal_places=6, default=0)),
+      ],
+      options={
+        'db_table': 'out_bufferbucket',
+        'ordering': ['buffer', 'bucket', 'startdate'],
+        'verbose_name': 'buffer summary',
+        'verbose_name_plural': 'buffer summaries',
+      },
+    ),
+    migrations.AlterUniqueTogether(
+      name='buffersummary',
+      unique_together=set([('buffer', 'bucket', 'startdate')]),
+    ),
+    migrations.CreateModel(
+      name='ResourceBucketSummary',
+      fields=[
+        ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+        ('resource', models.CharField(verbose_name='resource', max_length=300)),
+        ('bucket', models.CharField(verbose_name='bucket', max_length=300)),
+        ('startdate', models.DateTimeField(verbose_name='startdate')),
+        ('enddate', models.DateTimeField(verbose_name='enddate')),
+        ('available', models.DecimalField(verbose_name='available', max_digits=15, decimal_places=6, default=0)),
+        ('unavailable', models.DecimalField(verbose_name='unavailable', max_digits=15, decimal_places=6, default=0)),
+        ('setup', models.DecimalField(verbose_name='setup', max_digits=15, decimal_places=6, default=0)),
+        ('load', models.DecimalField(verbose_name='load', max_digits=15, decimal_places=6, default=0)),
+      ],
+      options={
+        'db_table': 'out_resourcebucket',
+        'ordering': ['resource', 'bucket', 'startdate'],
+        'verbose_name': 'resource bucket summary',
+        'verbose_name_plural': 'resource bucket summaries',
+      },
+    ),
+    migrations.AlterUniqueTogether(
+      name='resourcebucketsummary',
+      unique_together=set([('resource', 'bucket', 'startdate')]),
+    ),
+    migrations.CreateModel(
+      name='DemandSummary',
+      fields=[
+        ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+        ('item', models.CharField(verbose_name='item', max_length=300)),
+        ('bucket', models.CharField(verbose_name='bucket', max_length=300)),
+        ('startdate', models.DateTimeField(verbose_name='startdate')),
+        ('enddate', models.DateTimeField(verbose_name='enddate')),
+        ('supply', models.DecimalField(verbose_name='supply', max_digits=15, decimal_places=6, default=0)),
+      ],
+      options={
+        'db_table': 'out_demandbucket',
+        'ordering': ['item', 'bucket', 'startdate'],
+        'verbose_name': 'demand summary',
+        'verbose_name_plural': 'demand summaries',
+      },
+    ),
+    migrations.AlterUniqueTogether(
+      name='demandsummary',
+      unique_together=set([('item', 'bucket', 'startdate')]),
+    ),
+    migrations.RunPython(refreshSummaries, migrations.RunPython.noop),
+  ]
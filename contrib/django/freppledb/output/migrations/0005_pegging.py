@@ -0,0 +1,65 @@
+#
+# Copyright (C) 2016 by frePPLe bvba
+#
+# This library is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('output', '0004_bucket_summaries'),
+    ('input', '0008_number_precision'),
+  ]
+
+  operations = [
+    migrations.CreateModel(
+      name='Pegging',
+      fields=[
+        ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+        ('demand', models.CharField(verbose_name='demand', max_length=300)),
+        ('seq', models.IntegerField(verbose_name='sequence')),
+        ('level', models.IntegerField(verbose_name='level')),
+        ('operationplan', models.IntegerField(verbose_name='operationplan', db_index=True)),
+        ('quantity', models.DecimalField(verbose_name='quantity', max_digits=15, decimal_places=6, default=0)),
+      ],
+      options={
+        'db_table': 'out_pegging',
+        'ordering': ['demand', 'seq'],
+        'verbose_name': 'pegging',
+        'verbose_name_plural': 'peggings',
+      },
+    ),
+    migrations.AlterUniqueTogether(
+      name='pegging',
+      unique_together=set([('demand', 'seq')]),
+    ),
+    # Convert the pegging of the current plan
+    migrations.RunSQL(
+      '''
+      insert into out_pegging (demand, seq, level, operationplan, quantity)
+      select name, row_number() over (partition by name),
+        cast(peg->>'level' as integer), cast(peg->>'opplan' as integer),
+        round(cast(peg->>'quantity' as numeric), 6)
+      from (
+        select name, json_array_elements(plan->'pegging') as peg
+        from demand
+        where plan is not null
+        ) pegging
+      ''',
+      migrations.RunSQL.noop
+    ),
+  ]
@@ -0,0 +1,46 @@
+#
+# Copyright (C) 2016 by frePPLe bvba
+#
+# This library is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+  dependencies = [
+    ('output', '0005_pegging'),
+  ]
+
+  operations = [
+    migrations.CreateModel(
+      name='KPI',
+      fields=[
+        ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+        ('computed', models.DateTimeField(verbose_name='computed', db_index=True)),
+        ('task', models.IntegerField(verbose_name='task', null=True, blank=True)),
+        ('code', models.IntegerField(verbose_name='code')),
+        ('category', models.CharField(verbose_name='category', max_length=300)),
+        ('name', models.CharField(verbose_name='name', max_length=300)),
+        ('value', models.DecimalField(verbose_name='value', max_digits=20, decimal_places=6)),
+      ],
+      options={
+        'db_table': 'out_kpi',
+        'ordering': ['computed', 'code', 'name'],
+        'verbose_name': 'kpi',
+        'verbose_name_plural': 'kpis',
+      },
+    ),
+  ]
@@ -77,3 +77,334 @@ class ResourceSummary(models.Model):
     unique_together = (('resource', 'startdate'),)
     verbose_name = 'resource summary'  # No need to translate these since only used internally
     verbose_name_plural = 'resource summaries'
+
+
+class BufferSummary(models.Model):
+  '''
+  Inventory profile of a buffer aggregated per time bucket.
+  A record is only created for buckets with material movements. The end
+  inventory of other buckets is equal to the end inventory of the last
+  previous bucket with a record. The movements before the first bucket are
+  summarized in an extra record ending at the start of the first bucket.
+  '''
+  buffer = models.CharField(_('buffer'), max_length=300)
+  bucket = models.CharField(_('bucket'), max_length=300)
+  startdate = models.DateTimeField(_('startdate'))
+  enddate = models.DateTimeField(_('enddate'))
+  produced = models.DecimalField(_('produced'), max_digits=15, decimal_places=6, default=0)
+  consumed = models.DecimalField(_('consumed'), max_digits=15, decimal_places=6, default=0)
+  endoh = models.DecimalField(_('end inventory'), max_digits=15, decimal_places=6, default=0)
+
+  @staticmethod
+  def refresh(cursor):
+    cursor.execute("truncate table out_bufferbucket")
+    cursor.execute('''
+      insert into out_bufferbucket
+        (buffer, bucket, startdate, enddate, produced, consumed, endoh)
+      select
+        operationplanmaterial.buffer, d.bucket_id, d.startdate, d.enddate,
+        sum(greatest(operationplanmaterial.quantity, 0)),
+        -sum(least(operationplanmaterial.quantity, 0)),
+        (array_agg(
+          operationplanmaterial.onhand
+          order by operationplanmaterial.flowdate desc, operationplanmaterial.id desc
+          ))[1]
+      from operationplanmaterial
+      inner join common_bucketdetail d
+        on operationplanmaterial.flowdate >= d.startdate
+        and operationplanmaterial.flowdate < d.enddate
+      group by operationplanmaterial.buffer, d.bucket_id, d.startdate, d.enddate
+      ''')
+    # The material movements before the first bucket of each level, such as
+    # the initial onhand, are aggregated in a single record ending at the
+    # start of that bucket.
+    cursor.execute('''
+      insert into out_bufferbucket
+        (buffer, bucket, startdate, enddate, produced, consumed, endoh)
+      select
+        operationplanmaterial.buffer, d.bucket_id,
+        min(operationplanmaterial.flowdate), d.startdate,
+        sum(greatest(operationplanmaterial.quantity, 0)),
+        -sum(least(operationplanmaterial.quantity, 0)),
+        (array_agg(
+          operationplanmaterial.onhand
+          order by operationplanmaterial.flowdate desc, operationplanmaterial.id desc
+          ))[1]
+      from operationplanmaterial
+      inner join (
+        select bucket_id, min(startdate) as startdate
+        from common_bucketdetail
+        group by bucket_id
+        ) d
+        on operationplanmaterial.flowdate < d.startdate
+      group by operationplanmaterial.buffer, d.bucket_id, d.startdate
+      ''')
+
+  class Meta:
+    db_table = 'out_bufferbucket'
+    ordering = ['buffer', 'bucket', 'startdate']
+    unique_together = (('buffer', 'bucket', 'startdate'),)
+    verbose_name = 'buffer summary'  # No need to translate these since only used internally
+    verbose_name_plural = 'buffer summaries'
+
+
+class ResourceBucketSummary(models.Model):
+  '''
+  Resource plan aggregated per time bucket.
+  '''
+  resource = models.CharField(_('resource'), max_length=300)
+  bucket = models.CharField(_('bucket'), max_length=300)
+  startdate = models.DateTimeField(_('startdate'))
+  enddate = models.DateTimeField(_('enddate'))
+  available = models.DecimalField(_('available'), max_digits=15, decimal_places=6, default=0)
+  unavailable = models.DecimalField(_('unavailable'), max_digits=15, decimal_places=6, default=0)
+  setup = models.DecimalField(_('setup'), max_digits=15, decimal_places=6, default=0)
+  load = models.DecimalField(_('load'), max_digits=15, decimal_places=6, default=0)
+
+  @staticmethod
+  def refresh(cursor):
+    cursor.execute("truncate table out_resourcebucket")
+    cursor.execute('''
+      insert into out_resourcebucket
+        (resource, bucket, startdate, enddate, available, unavailable, setup, load)
+      select
+        out_resourceplan.resource, d.bucket_id, d.startdate, d.enddate,
+        coalesce(sum(out_resourceplan.available), 0),
+        coalesce(sum(out_resourceplan.unavailable), 0),
+        coalesce(sum(out_resourceplan.setup), 0),
+        coalesce(sum(out_resourceplan.load), 0)
+      from out_resourceplan
+      inner join common_bucketdetail d
+        on out_resourceplan.startdate >= d.startdate
+        and out_resourceplan.startdate < d.enddate
+      group by out_resourceplan.resource, d.bucket_id, d.startdate, d.enddate
+      ''')
+
+  class Meta:
+    db_table = 'out_resourcebucket'
+    ordering = ['resource', 'bucket', 'startdate']
+    unique_together = (('resource', 'bucket', 'startdate'),)
+    verbose_name = 'resource bucket summary'  # No need to translate these since only used internally
+    verbose_name_plural = 'resource bucket summaries'
+
+
+class DemandSummary(models.Model):
+  '''
+  Planned quantity of the demands of an item aggregated per time bucket.
+  A record is only created for buckets with a delivery.
+  The requested quantity isn't aggregated, such that the demand report
+  reflects the edits of the demands immediately.
+  '''
+  item = models.CharField(_('item'), max_length=300)
+  bucket = models.CharField(_('bucket'), max_length=300)
+  startdate = models.DateTimeField(_('startdate'))
+  enddate = models.DateTimeField(_('enddate'))
+  supply = models.DecimalField(_('supply'), max_digits=15, decimal_places=6, default=0)
+
+  @staticmethod
+  def refresh(cursor):
+    cursor.execute("truncate table out_demandbucket")
+    cursor.execute('''
+      insert into out_demandbucket
+        (item, bucket, startdate, enddate, supply)
+      select demand.item_id, d.bucket_id, d.startdate, d.enddate,
+        sum(operationplan.quantity)
+      from operationplan
+      inner join demand
+        on operationplan.demand_id = demand.name
+      inner join common_bucketdetail d
+        on operationplan.enddate >= d.startdate
+        and operationplan.enddate < d.enddate
+      where operationplan.owner_id is null
+      group by demand.item_id, d.bucket_id, d.startdate, d.enddate
+      ''')
+
+  class Meta:
+    db_table = 'out_demandbucket'
+    ordering = ['item', 'bucket', 'startdate']
+    unique_together = (('item', 'bucket', 'startdate'),)
+    verbose_name = 'demand summary'  # No need to translate these since only used internally
+    verbose_name_plural = 'demand summaries'
+
+
+class Pegging(models.Model):
+  '''
+  Operationplans serving a demand, in the order of the supply path.
+  The same operationplan can appear multiple times for a demand, at
+  different levels of the supply path.
+  The table is filled by the plan export. A plan loaded from a fixture or
+  an import only has the pegging in the json plan field of the demand.
+  '''
+  demand = models.CharField(_('demand'), max_length=300)
+  seq = models.IntegerField(_('sequence'))
+  level = models.IntegerField(_('level'))
+  operationplan = models.IntegerField(_('operationplan'), db_index=True)
+  quantity = models.DecimalField(_('quantity'), max_digits=15, decimal_places=6, default=0)
+
+  # Query returning the pegging of a demand, with the columns seq, level,
+  # operationplan and quantity. The demand name is passed as the 3 parameters.
+  # When the table has no rows for the demand, the json plan is unnested.
+  sql = '''
+    select seq, level, operationplan, quantity
+    from out_pegging
+    where demand = %s
+    union all
+    select row_number() over (), cast(peg->>'level' as integer),
+      cast(peg->>'opplan' as integer), cast(peg->>'quantity' as numeric)
+    from (
+      select json_array_elements(plan->'pegging') as peg
+      from demand
+      where name = %s
+      and not exists (select 1 from out_pegging where demand = %s)
+      ) d
+    '''
+
+  class Meta:
+    db_table = 'out_pegging'
+    ordering = ['demand', 'seq']
+    unique_together = (('demand', 'seq'),)
+    verbose_name = 'pegging'  # No need to translate these since only used internally
+    verbose_name_plural = 'peggings'
+
+
+class KPI(models.Model):
+  '''
+  Performance indicators of the plan, saved at the end of each plan
+  generation.
+  All indicators saved by a run share the same computed timestamp, which
+  allows comparing the indicators between runs.
+  '''
+  computed = models.DateTimeField(_('computed'), db_index=True)
+  task = models.IntegerField(_('task'), null=True, blank=True)
+  code = models.IntegerField(_('code'))
+  category = models.CharField(_('category'), max_length=300)
+  #. Translators: Translation included with Django
+  name = models.CharField(_('name'), max_length=300)
+  value = models.DecimalField(_('value'), max_digits=20, decimal_places=6)
+
+  class Meta:
+    db_table = 'out_kpi'
+    ordering = ['computed', 'code', 'name']
+    verbose_name = 'kpi'  # No need to translate these since only used internally
+    verbose_name_plural = 'kpis'
+
+
+def saveKPIs(database, kpis, task=None):
+  '''
+  Saves the performance indicators of a plan, as a list of tuples
+  (code, category, name, value).
+  Only the last KPI_HISTORY runs are kept.
+  '''
+  from datetime import datetime
+  from django.conf import settings
+  from django.db import transaction
+  computed = datetime.now()
+  with transaction.atomic(using=database):
+    KPI.objects.using(database).bulk_create([
+      KPI(computed=computed, task=task, code=k[0], category=k[1], name=k[2], value=k[3])
+      for k in kpis
+      ])
+    history = KPI.objects.using(database).order_by('-computed').values_list('computed', flat=True).distinct()
+    history = list(history[:getattr(settings, 'KPI_HISTORY', 50)])
+    if history:
+      KPI.objects.using(database).filter(computed__lt=history[-1]).delete()
+  return computed
+
+
+def getKPIs(database, runs=1):
+  '''
+  Returns the performance indicators saved by the last runs, as a list
+  of pairs (computed, list of KPI objects), most recent run first.
+  '''
+  history = KPI.objects.using(database).order_by('-computed').values_list('computed', flat=True).distinct()
+  history = list(history[:runs])
+  result = [ (c, []) for c in history ]
+  if history:
+    idx = { c: r for c, r in result }
+    for k in KPI.objects.using(database).filter(computed__in=history).order_by('code', 'name'):
+      idx[k.computed].append(k)
+  return result
+
+
+def computeKPIsFromDatabase(database):
+  '''
+  Computes the performance indicators from the plan in the database, as a
+  list of tuples (code, category, name, value).
+  The definitions are the same as those of the function computeKPIs in
+  freppledb.execute.whatif, which computes them from the plan in memory.
+  Closed operationplans aren't part of the plan.
+  '''
+  from django.db import connections
+  cursor = connections[database].cursor()
+  cursor.execute('''
+    with plan as (
+      select * from operationplan
+      where status is null or status <> 'closed'
+      )
+    select 101 as id, 'Problem count' as category, name as name, count(*) as value
+    from out_problem
+    group by name
+    union all
+    select 102, 'Problem weight', name, round(sum(weight))
+    from out_problem
+    group by name
+    union all
+    select 201, 'Demand', 'Requested', coalesce(round(sum(quantity)),0)
+    from demand
+    where status in ('open', 'quote')
+    union all
+    select 202, 'Demand', 'Planned', coalesce(round(sum(quantity)),0)
+    from plan
+    where demand_id is not null and owner_id is null
+    union all
+    select 203, 'Demand', 'Planned late', coalesce(round(sum(quantity)),0)
+    from plan
+    where enddate > due and demand_id is not null and owner_id is null
+    union all
+    select 204, 'Demand', 'Planned on time', coalesce(round(sum(quantity)),0)
+    from plan
+    where enddate <= due and demand_id is not null and owner_id is null
+    union all
+    select 205, 'Demand', 'Unplanned', coalesce(round(sum(weight)),0)
+    from out_problem
+    where name = 'unplanned'
+    union all
+    select 206, 'Demand', 'Total lateness', coalesce(round(sum(quantity * extract(epoch from enddate - due)) / 86400),0)
+    from plan
+    where enddate > due and demand_id is not null and owner_id is null
+    union all
+    select 301, 'Operation', 'Count', count(*)
+    from plan
+    union all
+    select 301, 'Operation', 'Quantity', coalesce(round(sum(quantity)),0)
+    from plan
+    union all
+    select 302, 'Resource', 'Usage', coalesce(round(sum(quantity * extract(epoch from enddate - startdate)) / 86400),0)
+    from operationplanresource
+    union all
+    select 401, 'Material', 'Produced', coalesce(round(sum(quantity)),0)
+    from operationplanmaterial
+    where quantity>0
+    union all
+    select 402, 'Material', 'Consumed', coalesce(round(sum(-quantity)),0)
+    from operationplanmaterial
+    where quantity<0
+    order by 1
+    ''')
+  return cursor.fetchall()
+
+
+def refreshBucketSummaries(database):
+  '''
+  Recompute the aggregation of the plan in all time buckets.
+  The pivot reports of the buffers, resources and demands read these tables,
+  which is a lot faster than aggregating the detailed plan in each request.
+  The summaries are computed at the end of the plan generation, when the
+  time buckets are regenerated and after the tasks loading data.
+  '''
+  from django.db import connections, transaction
+  with transaction.atomic(using=database):
+    cursor = connections[database].cursor()
+    BufferSummary.refresh(cursor)
+    ResourceBucketSummary.refresh(cursor)
+    DemandSummary.refresh(cursor)
@@ -15,10 +15,19 @@
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import csv
+from datetime import datetime, timedelta
+import json
+
 from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
 from django.test import TestCase
 from django.test.utils import override_settings
 
+from freppledb.execute.models import Task
+from freppledb.input.models import Demand
+from freppledb.output.models import Pegging, refreshBucketSummaries, saveKPIs
+
 
 @override_settings(INSTALLED_APPS=settings.INSTALLED_APPS + ('django.contrib.sessions',))
 class OutputTest(TestCase):
@@ -69,6 +78,28 @@ class OutputTest(TestCase):
     self.assertEqual(response.status_code, 200)
     self.assertTrue(response.__getitem__('Content-Type').startswith('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'))
 
+  # Pegging
+  def test_output_pegging(self):
+    # The fixture doesn't fill the pegging table: the report reads the json plan
+    response = self.client.get('/demandpegging/Demand%2001/?format=json')
+    self.assertEqual(response.status_code, 200)
+    records = json.loads(response.content.decode())['records']
+    self.assertGreater(records, 0)
+    # Store the pegging of the demo plan as rows, as the plan export does
+    dmd = Demand.objects.get(name='Demand 01')
+    Pegging.objects.bulk_create([
+      Pegging(demand=dmd.name, seq=seq, level=p['level'], operationplan=p['opplan'], quantity=p['quantity'])
+      for seq, p in enumerate(dmd.plan['pegging'], start=1)
+      ])
+    response = self.client.get('/demandpegging/Demand%2001/?format=json')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(json.loads(response.content.decode())['records'], records)
+    # Reverse lookup of the demands served by an operationplan
+    self.assertEqual(
+      list(Pegging.objects.filter(operationplan=1215).values_list('demand', flat=True)),
+      ['Demand 01']
+      )
+
   # Operation
   def test_output_operation(self):
     response = self.client.get('/operation/?format=json')
@@ -113,6 +144,94 @@ class OutputTest(TestCase):
     response = self.client.get('/kpi/?format=csvlist')
     self.assertEqual(response.status_code, 200)
     self.assertTrue(response.__getitem__('Content-Type').startswith('text/csv; charset='))
+    # The header is written only once
+    data = b''.join(response.streaming_content).decode(settings.CSV_CHARSET).lstrip('\ufeff')
+    rows = list(csv.reader(data.splitlines()))
+    self.assertEqual(sum(1 for r in rows if r == rows[0]), 1)
     response = self.client.get('/kpi/?format=spreadsheetlist')
     self.assertEqual(response.status_code, 200)
     self.assertTrue(response.__getitem__('Content-Type').startswith('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'))
+    # Indicators saved by the plan generation, compared with the previous run
+    now = datetime.now()
+    task = Task.objects.create(name='generate plan', submitted=now, started=now, finished=now, status='Done')
+    saveKPIs(DEFAULT_DB_ALIAS, [(201, 'Demand', 'Requested', 100), (202, 'Demand', 'Planned', 80)])
+    saveKPIs(DEFAULT_DB_ALIAS, [(201, 'Demand', 'Requested', 100), (202, 'Demand', 'Planned', 90)], task=task.id)
+    response = self.client.get('/kpi/?format=json')
+    self.assertEqual(response.status_code, 200)
+    rows = json.loads(response.content.decode())['rows']
+    self.assertEqual([ (r['name'], r['value'], r['previous']) for r in rows ], [('Requested', '100', '100'), ('Planned', '90', '80')])
+    # A task finishing later invalidates the saved indicators
+    now += timedelta(minutes=1)
+    Task.objects.create(name='load dataset', submitted=now, started=now, finished=now, status='Done')
+    response = self.client.get('/kpi/?format=json')
+    self.assertEqual(response.status_code, 200)
+    rows = json.loads(response.content.decode())['rows']
+    self.assertNotIn(('Planned', '90'), [ (r['name'], r['value']) for r in rows ])
+
+  # Bucket summaries
+  def test_output_bucket_summaries(self):
+    refreshBucketSummaries(DEFAULT_DB_ALIAS)
+    cursor = connections[DEFAULT_DB_ALIAS].cursor()
+    # Each bucket level aggregates all material movements within its dates
+    cursor.execute('''
+      select b.bucket_id, coalesce(s.produced, 0), coalesce(s.consumed, 0),
+        (select coalesce(sum(greatest(quantity, 0)), 0) from operationplanmaterial
+         where flowdate >= b.startdate and flowdate < b.enddate),
+        (select coalesce(-sum(least(quantity, 0)), 0) from operationplanmaterial
+         where flowdate >= b.startdate and flowdate < b.enddate)
+      from (
+        select bucket_id, min(startdate) startdate, max(enddate) enddate
+        from common_bucketdetail group by bucket_id
+        ) b
+      left outer join (
+        select out_bufferbucket.bucket, sum(produced) produced, sum(consumed) consumed
+        from out_bufferbucket
+        inner join common_bucketdetail
+          on common_bucketdetail.bucket_id = out_bufferbucket.bucket
+          and common_bucketdetail.startdate = out_bufferbucket.startdate
+        group by out_bufferbucket.bucket
+        ) s
+      on s.bucket = b.bucket_id
+      ''')
+    for bucket, produced, consumed, produced_detail, consumed_detail in cursor.fetchall():
+      self.assertEqual(produced, produced_detail, "Produced quantity mismatch for %s buckets" % bucket)
+      self.assertEqual(consumed, consumed_detail, "Consumed quantity mismatch for %s buckets" % bucket)
+    # The start inventory read by the report matches the last flowplan before
+    # the horizon, including the initial onhand dated before the first bucket
+    cursor.execute('''
+      select bucket_id, min(startdate) from common_bucketdetail group by bucket_id
+      union all
+      select bucket_id, startdate from common_bucketdetail
+      where startdate = (
+        select max(d.startdate) from common_bucketdetail d
+        where d.bucket_id = common_bucketdetail.bucket_id
+        and d.startdate <= (select min(flowdate) from operationplanmaterial where flowdate > '1980-01-01')
+        )
+      ''')
+    horizons = cursor.fetchall()
+    self.assertTrue(horizons)
+    for bucket, horizonstart in horizons:
+      cursor.execute('''
+        select distinct on (buffer) buffer, endoh
+        from out_bufferbucket
+        where bucket = %s and startdate < %s
+        order by buffer, startdate desc
+        ''', (bucket, horizonstart))
+      startoh = { r[0]: r[1] for r in cursor.fetchall() }
+      cursor.execute('''
+        select operationplanmaterial.buffer, operationplanmaterial.onhand
+        from operationplanmaterial,
+          (select buffer, max(id) as id
+           from operationplanmaterial
+           where flowdate < %s
+           group by buffer
+          ) maxid
+        where maxid.buffer = operationplanmaterial.buffer
+        and maxid.id = operationplanmaterial.id
+        ''', (horizonstart,))
+      oldstartoh = { r[0]: r[1] for r in cursor.fetchall() }
+      self.assertTrue(oldstartoh)
+      self.assertEqual(startoh, oldstartoh, "Start inventory mismatch for %s buckets at %s" % (bucket, horizonstart))
+    response = self.client.get('/buffer/?format=json')
+    self.assertEqual(response.status_code, 200)
+    self.assertContains(response, '"records":8,')
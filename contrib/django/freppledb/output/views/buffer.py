@@ -35,6 +35,7 @@ class OverviewReport(GridPivot):
   model = Buffer
   permissions = (('view_inventory_report', 'Can view inventory report'),)
   help_url = 'user-guide/user-interface/plan-analysis/inventory-report.html'
+  cacheable = True
   rows = (
     GridFieldText('buffer', title=_('buffer'), key=True, editable=False, field_name='name', formatter='detail', extra='"role":"input/buffer"'),
     GridFieldText('item', title=_('item'), editable=False, field_name='item__name', formatter='detail', extra='"role":"input/item"'),
@@ -66,37 +67,45 @@ class OverviewReport(GridPivot):
     # Assure the item hierarchy is up to date
     Buffer.rebuildHierarchy(database=basequery.db)
 
-    # Execute a query  to get the onhand value at the start of our horizon
+    # Execute a query to get the onhand value at the start of our horizon.
+    # It is the end inventory of the last bucket with material movements
+    # before the horizon. The lookup is done per buffer on the page, and
+    # only reads a single record of the unique index on out_bufferbucket.
     startohdict = {}
-    query = '''
-      select buffers.name, sum(oh.onhand)
-      from (%s) buffers
-      inner join buffer
-      on buffer.lft between buffers.lft and buffers.rght
-      inner join (
-      select operationplanmaterial.buffer as buffer, operationplanmaterial.onhand as onhand
-      from operationplanmaterial,
-        (select buffer, max(id) as id
-         from operationplanmaterial
-         where flowdate < '%s'
-         group by buffer
-        ) maxid
-      where maxid.buffer = operationplanmaterial.buffer
-      and maxid.id = operationplanmaterial.id
-      ) oh
-      on oh.buffer = buffer.name
-      group by buffers.name
-      ''' % (basesql, request.report_startdate)
-    cursor.execute(query, baseparams)
-    for row in cursor.fetchall():
-      startohdict[row[0]] = float(row[1])
+    cursor.execute(
+      "select min(startdate) from common_bucketdetail where bucket_id = %s and enddate > %s",
+      (request.report_bucket, request.report_startdate)
+      )
+    horizonstart = cursor.fetchone()[0]
+    if horizonstart:
+      query = '''
+        select buffers.name, sum(oh.endoh)
+        from (%s) buffers
+        inner join buffer
+        on buffer.lft between buffers.lft and buffers.rght
+        cross join lateral (
+          select endoh
+          from out_bufferbucket
+          where out_bufferbucket.buffer = buffer.name
+          and out_bufferbucket.bucket = %%s
+          and out_bufferbucket.startdate < %%s
+          order by out_bufferbucket.startdate desc
+          limit 1
+        ) oh
+        group by buffers.name
+        ''' % basesql
+      cursor.execute(query, baseparams + (request.report_bucket, horizonstart))
+      for row in cursor.fetchall():
+        startohdict[row[0]] = float(row[1])
 
-    # Execute the actual query
+    # Execute the actual query.
+    # The quantities are read from the aggregation per bucket computed
+    # at the end of the plan generation.
     query = '''
       select buf.name as row1, buf.item_id as row2, buf.location_id as row3,
              d.bucket as col1, d.startdate as col2, d.enddate as col3,
-             coalesce(sum(greatest(operationplanmaterial.quantity, 0)),0) as consumed,
-             coalesce(-sum(least(operationplanmaterial.quantity, 0)),0) as produced
+             coalesce(sum(out_bufferbucket.produced),0) as produced,
+             coalesce(sum(out_bufferbucket.consumed),0) as consumed
         from (%s) buf
         -- Multiply with buckets
         cross join (
@@ -108,12 +117,10 @@ class OverviewReport(GridPivot):
         inner join buffer
         on buffer.lft between buf.lft and buf.rght
         -- Consumed and produced quantities
-        left join operationplanmaterial
-        on buffer.name = operationplanmaterial.buffer
-        and d.startdate <= operationplanmaterial.flowdate
-        and d.enddate > operationplanmaterial.flowdate
-        and operationplanmaterial.flowdate >= %%s
-        and operationplanmaterial.flowdate < %%s
+        left join out_bufferbucket
+        on buffer.name = out_bufferbucket.buffer
+        and out_bufferbucket.bucket = %%s
+        and out_bufferbucket.startdate = d.startdate
         -- Grouping and sorting
         group by buf.name, buf.item_id, buf.location_id, buf.onhand, d.bucket, d.startdate, d.enddate
         order by %s, d.startdate
@@ -121,7 +128,7 @@ class OverviewReport(GridPivot):
         basesql, sortsql
       )
     cursor.execute(query, baseparams + (request.report_bucket, request.report_startdate, request.report_enddate,
-        request.report_startdate, request.report_enddate))
+        request.report_bucket))
 
     # Build the python result
     prevbuf = None
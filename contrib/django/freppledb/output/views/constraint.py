@@ -69,6 +69,7 @@ class BaseReport(GridReport):
   basequeryset = Constraint.objects.all()
   model = Constraint
   permissions = (("view_constraint_report", "Can view constraint report"),)
+  cacheable = True
   frozenColumns = 0
   editable = False
   multiselect = False
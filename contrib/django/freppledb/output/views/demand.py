@@ -26,6 +26,7 @@ from django.utils.text import capfirst
 from django.utils.encoding import force_text
 
 from freppledb.input.models import Demand, Item, PurchaseOrder, DistributionOrder, ManufacturingOrder, DeliveryOrder
+from freppledb.output.models import Pegging
 from freppledb.common.report import GridReport, GridPivot, GridFieldText, GridFieldNumber, GridFieldDateTime, GridFieldInteger
 
 
@@ -67,95 +68,81 @@ class OverviewReport(GridPivot):
     # Assure the item hierarchy is up to date
     Item.rebuildHierarchy(database=basequery.db)
 
-    # Execute a query to get the backlog at the start of the horizon
+    # Execute a query to get the backlog at the start of the horizon.
+    # The horizon starts with the first bucket of the report.
+    cursor.execute('''
+      select min(startdate) from common_bucketdetail
+      where bucket_id = %s and enddate > %s
+      ''', (request.report_bucket, request.report_startdate))
+    horizonstart = cursor.fetchone()[0] or request.report_startdate
     startbacklogdict = {}
     query = '''
-      select items.name, coalesce(req.qty, 0) - coalesce(pln.qty, 0)
+      select items.name,
+        coalesce((
+          select sum(demand.quantity)
+          from demand
+          inner join item
+          on demand.item_id = item.name
+          where item.lft between items.lft and items.rght
+          and demand.status in ('open', 'quote')
+          and demand.due < %%s
+          ), 0)
+        - coalesce((
+          select sum(out_demandbucket.supply)
+          from out_demandbucket
+          inner join item
+          on out_demandbucket.item = item.name
+          where item.lft between items.lft and items.rght
+          and out_demandbucket.bucket = %%s
+          and out_demandbucket.enddate <= %%s
+          ), 0)
       from (%s) items
-      left outer join (
-        select item_id, sum(quantity) qty
-        from demand
-        where status in ('open', 'quote')
-        and due < %%s
-        group by item_id
-        ) req
-      on req.item_id = items.name
-      left outer join (
-        select demand.item_id, sum(operationplan.quantity) qty
-        from operationplan
-        inner join demand
-        on operationplan.demand_id = demand.name
-        and operationplan.owner_id is null
-        and operationplan.enddate < %%s
-        group by demand.item_id
-        ) pln
-      on pln.item_id = items.name
       ''' % basesql
-    cursor.execute(query, baseparams + (request.report_startdate, request.report_startdate))
+    cursor.execute(query, (horizonstart, request.report_bucket, horizonstart) + baseparams)
     for row in cursor.fetchall():
       if row[0]:
         startbacklogdict[row[0]] = float(row[1])
 
-    # Execute the query
+    # Execute the query.
+    # The requested quantity is read from the demands. The planned quantity
+    # is read from the aggregation per bucket computed at the end of the
+    # plan generation.
     query = '''
-        select y.name as row1,
-               y.bucket as col1, y.startdate as col2, y.enddate as col3,
-               min(y.orders),
-               min(y.planned)
-        from (
-          select x.name as name, x.lft as lft, x.rght as rght,
-               x.bucket as bucket, x.startdate as startdate, x.enddate as enddate,
-               coalesce(sum(demand.quantity),0) as orders,
-               min(x.planned) as planned
-          from (
-          select items.name as name, items.lft as lft, items.rght as rght,
-                 d.bucket as bucket, d.startdate as startdate, d.enddate as enddate,
-                 coalesce(sum(operationplan.quantity),0) as planned
-          from (%s) items
-          -- Multiply with buckets
-          cross join (
-             select name as bucket, startdate, enddate
-             from common_bucketdetail
-             where bucket_id = %%s and enddate > %%s and startdate < %%s
-             ) d
-          -- Include hierarchical children
-          inner join item
-          on item.lft between items.lft and items.rght
-          -- Planned quantity
-          left outer join demand
-          on item.name = demand.item_id
-          left outer join operationplan
-          on demand.name = operationplan.demand_id
-          and d.startdate <= operationplan.enddate
-          and d.enddate > operationplan.enddate
-          and operationplan.enddate >= %%s
-          and operationplan.enddate < %%s
-          and operationplan.owner_id is null
-          -- Grouping
-          group by items.name, items.lft, items.rght, d.bucket, d.startdate, d.enddate
-        ) x
-        -- Requested quantity
-        inner join item
-        on item.lft between x.lft and x.rght
-        left join demand
-        on item.name = demand.item_id
-        and x.startdate <= demand.due
-        and x.enddate > demand.due
-        and demand.due >= %%s
-        and demand.due < %%s
-        and demand.status in ('open', 'quote')
-        -- Grouping
-        group by x.name, x.lft, x.rght, x.bucket, x.startdate, x.enddate
-        ) y
-        -- Ordering and grouping
-        group by y.name, y.lft, y.rght, y.bucket, y.startdate, y.enddate
-        order by %s, y.startdate
-       ''' % (basesql, sortsql)
+      select items.name as row1,
+             d.bucket as col1, d.startdate as col2, d.enddate as col3,
+             coalesce((
+               select sum(demand.quantity)
+               from demand
+               inner join item
+               on demand.item_id = item.name
+               where item.lft between items.lft and items.rght
+               and demand.status in ('open', 'quote')
+               and demand.due >= d.startdate
+               and demand.due < d.enddate
+               ), 0) as orders,
+             coalesce(sum(out_demandbucket.supply),0) as planned
+      from (%s) items
+      -- Multiply with buckets
+      cross join (
+         select name as bucket, startdate, enddate
+         from common_bucketdetail
+         where bucket_id = %%s and enddate > %%s and startdate < %%s
+         ) d
+      -- Include hierarchical children
+      inner join item
+      on item.lft between items.lft and items.rght
+      -- Planned quantity
+      left outer join out_demandbucket
+      on item.name = out_demandbucket.item
+      and out_demandbucket.bucket = %%s
+      and out_demandbucket.startdate = d.startdate
+      -- Ordering and grouping
+      group by items.name, items.lft, items.rght, d.bucket, d.startdate, d.enddate
+      order by %s, d.startdate
+      ''' % (basesql, sortsql)
     cursor.execute(query, baseparams + (
       request.report_bucket, request.report_startdate,
-      request.report_enddate, request.report_startdate,
-      request.report_enddate, request.report_startdate,
-      request.report_enddate
+      request.report_enddate, request.report_bucket
       ))
 
     # Build the python result
@@ -222,10 +209,16 @@ def OperationPlans(request):
   so_list = request.GET.getlist('demand')
 
   # Collect operationplans associated with the sales order(s)
-  id_list = []
-  for dm in Demand.objects.all().using(request.database).filter(pk__in=so_list).only('plan'):
-    for op in dm.plan['pegging']:
-      id_list.append(op['opplan'])
+  id_list = set()
+  pegged = set()
+  for dmd, opplan in Pegging.objects.all().using(request.database).filter(demand__in=so_list).order_by().values_list('demand', 'operationplan'):
+    pegged.add(dmd)
+    id_list.add(opplan)
+  # Plans that weren't exported only have the pegging in the json plan
+  for dm in Demand.objects.all().using(request.database).filter(pk__in=so_list).exclude(pk__in=pegged).only('plan'):
+    if dm.plan:
+      for op in dm.plan.get('pegging', []):
+        id_list.add(op['opplan'])
 
   # Collect details on the operationplans
   result = []
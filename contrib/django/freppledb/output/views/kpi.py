@@ -16,9 +16,10 @@
 #
 
 from django.utils.translation import ugettext_lazy as _
-from django.db import connections
 
+from freppledb.common.cache import isLatestTask
 from freppledb.common.models import Parameter
+from freppledb.output.models import getKPIs, computeKPIsFromDatabase
 from freppledb.common.report import GridReport, GridFieldText, GridFieldInteger
 
 
@@ -27,11 +28,13 @@ class Report(GridReport):
   frozenColumns = 0
   basequeryset = Parameter.objects.all()
   permissions = (("view_kpi_report", "Can view kpi report"),)
+  cacheable = True
   rows = (
     GridFieldText('category', title=_('category'), sortable=False, editable=False, align='center'),
     #. Translators: Translation included with Django
     GridFieldText('name', title=_('name'), sortable=False, editable=False, align='center'),
     GridFieldInteger('value', title=_('value'), sortable=False, editable=False, align='center'),
+    GridFieldInteger('previous', title=_('previous run'), sortable=False, editable=False, align='center'),
     )
   default_sort = (1, 'asc')
   filterable = False
@@ -40,65 +43,29 @@ class Report(GridReport):
 
   @staticmethod
   def query(request, basequery):
-    # Execute the query
-    cursor = connections[request.database].cursor()
-    cursor.execute('''
-      select 101 as id, 'Problem count' as category, name as name, count(*) as value
-      from out_problem
-      group by name
-      union all
-      select 102, 'Problem weight', name, round(sum(weight))
-      from out_problem
-      group by name
-      union all
-      select 201, 'Demand', 'Requested', coalesce(round(sum(quantity)),0)
-      from demand
-      where status in ('open', 'quote')
-      union all
-      select 202, 'Demand', 'Planned', coalesce(round(sum(quantity)),0)
-      from operationplan
-      where demand_id is not null and owner_id is null
-      union all
-      select 203, 'Demand', 'Planned late', coalesce(round(sum(quantity)),0)
-      from operationplan
-      where enddate > due and demand_id is not null and owner_id is null
-      union all
-      select 204, 'Demand', 'Planned on time', coalesce(round(sum(quantity)),0)
-      from operationplan
-      where enddate <= due and demand_id is not null and owner_id is null
-      union all
-      select 205, 'Demand', 'Unplanned', coalesce(round(sum(weight)),0)
-      from out_problem
-      where name = 'unplanned'
-      union all
-      select 206, 'Demand', 'Total lateness', coalesce(round(sum(quantity * extract(epoch from enddate - due)) / 86400),0)
-      from operationplan
-      where enddate > due and demand_id is not null and owner_id is null
-      union all
-      select 301, 'Operation', 'Count', count(*)
-      from operationplan
-      union all
-      select 301, 'Operation', 'Quantity', coalesce(round(sum(quantity)),0)
-      from operationplan
-      union all
-      select 302, 'Resource', 'Usage', coalesce(round(sum(quantity * extract(epoch from enddate - startdate)) / 86400),0)
-      from operationplanresource
-      union all
-      select 401, 'Material', 'Produced', coalesce(round(sum(quantity)),0)
-      from operationplanmaterial
-      where quantity>0
-      union all
-      select 402, 'Material', 'Consumed', coalesce(round(sum(-quantity)),0)
-      from operationplanmaterial
-      where quantity<0
-      order by 1
-      '''
-      )
+    # Use the indicators saved by the last plan generations, as long as no
+    # other task changed the plan since
+    runs = getKPIs(request.database, runs=2)
+    if runs and runs[0][1] and isLatestTask(request.database, runs[0][1][0].task):
+      previous = {}
+      if len(runs) > 1:
+        previous = { (k.code, k.category, k.name): k.value for k in runs[1][1] }
+      for k in runs[0][1]:
+        prev = previous.get((k.code, k.category, k.name), None)
+        yield {
+          'category': k.category,
+          'name': k.name,
+          'value': round(k.value),
+          'previous': round(prev) if prev is not None else None
+          }
+      return
 
-    # Build the python result
-    for row in cursor.fetchall():
+    # Compute the indicators from the plan in the database, when the plan
+    # wasn't generated with the indicators or changed since
+    for row in computeKPIsFromDatabase(request.database):
       yield {
         'category': row[1],
         'name': row[2],
         'value': row[3],
+        'previous': None,
         }
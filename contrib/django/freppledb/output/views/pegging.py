@@ -25,6 +25,7 @@ from django.utils.translation import ugettext_lazy as _
 from freppledb.input.models import Demand
 from freppledb.common.report import GridReport, GridFieldText, GridFieldNumber
 from freppledb.common.models import Parameter
+from freppledb.output.models import Pegging
 
 
 class ReportByDemand(GridReport):
@@ -41,6 +42,7 @@ class ReportByDemand(GridReport):
   multiselect = False
   heightmargin = 82
   help_url = 'user-guide/user-interface/plan-analysis/demand-gantt-report.html'
+  cacheable = True
   rows = (
     GridFieldText('depth', title=_('depth'), editable=False, sortable=False),
     GridFieldText('operation', title=_('operation'), editable=False, sortable=False, key=True, formatter='detail', extra='"role":"input/operation"'),
@@ -69,19 +71,14 @@ class ReportByDemand(GridReport):
     # Get the earliest and latest operationplan, and the demand due date
     cursor = connections[request.database].cursor()
     cursor.execute('''
-      with dmd as (
-        select
-          due,
-          cast(json_array_elements(plan->'pegging')->>'opplan' as integer) opplan
-        from demand
-        where name = %s
-        )
-      select min(dmd.due), min(startdate), max(enddate)
-      from dmd
+      select min(demand.due), min(operationplan.startdate), max(operationplan.enddate)
+      from (%s) pegging
+      inner join demand
+        on demand.name = %%s
       inner join operationplan
-      on dmd.opplan = operationplan.id
-      and type <> 'STCK'
-      ''', (args[0]))
+        on operationplan.id = pegging.operationplan
+        and operationplan.type <> 'STCK'
+      ''' % Pegging.sql, (args[0],) * 4)
     x = cursor.fetchone()
     (due, start, end) = x
     if not due:
@@ -130,19 +127,13 @@ class ReportByDemand(GridReport):
     query = '''
       with pegging as (
         select
-          min(rownum) as rownum, min(due) as due, opplan, min(lvl) as lvl, sum(quantity) as quantity
-        from (select
-          row_number() over () as rownum, opplan, due, lvl, quantity
-        from (select
-          due,
-          cast(json_array_elements(plan->'pegging')->>'opplan' as integer) as opplan,
-          cast(json_array_elements(plan->'pegging')->>'level' as integer) as lvl,
-          cast(json_array_elements(plan->'pegging')->>'quantity' as numeric) as quantity
-          from demand
-          where name = %s
-          ) d1
-          )d2
-        group by opplan
+          min(peg.seq) as rownum, min(demand.due) as due,
+          peg.operationplan as opplan, min(peg.level) as lvl,
+          sum(peg.quantity) as quantity
+        from (%s) peg
+        inner join demand
+          on demand.name = %%s
+        group by peg.operationplan
         )
       select
         pegging.due, operationplan.name, pegging.lvl, ops.pegged,
@@ -165,8 +156,8 @@ class ReportByDemand(GridReport):
       left outer join operationplanresource
         on pegging.opplan = operationplanresource.operationplan_id
       order by ops.rownum, pegging.rownum
-      '''
-    cursor.execute(query, baseparams)
+      ''' % Pegging.sql
+    cursor.execute(query, baseparams * 4)
 
     # Build the Python result
     prevrec = None
@@ -35,6 +35,7 @@ class OverviewReport(GridPivot):
   basequeryset = Resource.objects.all()
   model = Resource
   permissions = (("view_resource_report", "Can view resource report"),)
+  cacheable = True
   editable = False
   help_url = 'user-guide/user-interface/plan-analysis/resource-report.html'
 
@@ -108,21 +109,20 @@ class OverviewReport(GridPivot):
       -- Include child resources
       inner join %s res2
       on res2.lft between res.lft and res.rght
-      -- Utilization info
-      left join out_resourceplan
+      -- Utilization info, aggregated per bucket at the end of the plan generation
+      left join out_resourcebucket out_resourceplan
       on res2.name = out_resourceplan.resource
-      and d.startdate <= out_resourceplan.startdate
-      and d.enddate > out_resourceplan.startdate
-      and out_resourceplan.startdate >= '%s'
-      and out_resourceplan.startdate < '%s'
+      and out_resourceplan.bucket = '%s'
+      and out_resourceplan.startdate = d.startdate
       -- Average utilization info
       left join (
                 select
                   resource,
                   ( coalesce(sum(out_resourceplan.load),0) + coalesce(sum(out_resourceplan.setup),0) )
                    * 100.0 / coalesce(greatest(sum(out_resourceplan.available), 0.0001),1) as avg_util
-                from out_resourceplan
-                where out_resourceplan.startdate >= '%s'
+                from out_resourcebucket out_resourceplan
+                where out_resourceplan.bucket = '%s'
+                and out_resourceplan.enddate > '%s'
                 and out_resourceplan.startdate < '%s'
                 group by resource
                 ) plan_summary
@@ -135,8 +135,9 @@ class OverviewReport(GridPivot):
         basesql, request.report_bucket, request.report_startdate,
         request.report_enddate,
         connections[basequery.db].ops.quote_name('resource'),
-        request.report_startdate, request.report_enddate,
-        request.report_startdate, request.report_enddate, sortsql
+        request.report_bucket,
+        request.report_bucket, request.report_startdate, request.report_enddate,
+        sortsql
       )
     cursor.execute(query, baseparams)
 
@@ -41,6 +41,7 @@ class LateOrdersWidget(Widget):
   tooltip = _("Shows orders that will be delivered after their due date")
   permissions = (("view_problem_report", "Can view problem report"),)
   asynchronous = True
+  cacheable = True
   url = '/problem/?entity=demand&name=late&sord=asc&sidx=startdate'
   exporturl = True
   limit = 20
@@ -95,6 +96,7 @@ class ShortOrdersWidget(Widget):
   tooltip = _("Shows orders that are not planned completely")
   permissions = (("view_problem_report", "Can view problem report"),)
   asynchronous = True
+  cacheable = True
   # Note the gte filter lets pass "short" and "unplanned", and filters out
   # "late" and "early".
   url = '/problem/?entity=demand&name__gte=short&sord=asc&sidx=startdate'
@@ -149,6 +151,7 @@ class ManufacturingOrderWidget(Widget):
   tooltip = _("Shows manufacturing orders by start date")
   permissions = (("view_problem_report", "Can view problem report"),)
   asynchronous = True
+  cacheable = True
   url = '/data/input/manufacturingorder/?sord=asc&sidx=startdate&status__in=proposed,confirmed'
   exporturl = True
   fence1 = 7
@@ -375,6 +378,7 @@ class DistributionOrderWidget(Widget):
   tooltip = _("Shows distribution orders by start date")
   permissions = (("view_problem_report", "Can view problem report"),)
   asynchronous = True
+  cacheable = True
   url = '/data/input/distributionorder/?sord=asc&sidx=startdate&status__in=proposed,confirmed'
   exporturl = True
   fence1 = 7
@@ -595,6 +599,7 @@ class PurchaseOrderWidget(Widget):
   tooltip = _("Shows purchase orders by ordering date")
   permissions = (("view_problem_report", "Can view problem report"),)
   asynchronous = True
+  cacheable = True
   url = '/data/input/purchaseorder/?sord=asc&sidx=startdate&status__in=proposed,confirmed'
   exporturl = True
   fence1 = 7
@@ -824,6 +829,7 @@ class PurchaseQueueWidget(Widget):
   tooltip = _("Display a list of new purchase orders")
   permissions = (("view_purchaseorder", "Can view purchase orders"),)
   asynchronous = True
+  cacheable = True
   url = '/data/input/purchaseorder/?status=proposed&sidx=startdate&sord=asc'
   exporturl = True
   limit = 20
@@ -865,6 +871,7 @@ class DistributionQueueWidget(Widget):
   tooltip = _("Display a list of new distribution orders")
   permissions = (("view_distributionorder", "Can view distribution orders"),)
   asynchronous = True
+  cacheable = True
   url = '/data/input/distributionorder/?status=proposed&sidx=startdate&sord=asc'
   exporturl = True
   limit = 20
@@ -905,6 +912,7 @@ class ShippingQueueWidget(Widget):
   tooltip = _("Display a list of new distribution orders")
   permissions = (("view_distributionorder", "Can view distribution orders"),)
   asynchronous = True
+  cacheable = True
   url = '/data/input/distributionorder/?sidx=plandate&sord=asc'
   exporturl = True
   limit = 20
@@ -946,6 +954,7 @@ class ResourceQueueWidget(Widget):
   tooltip = _("Display planned activities for the resources")
   permissions = (("view_resource_report", "Can view resource report"),)
   asynchronous = True
+  cacheable = True
   url = '/loadplan/?sidx=startdate&sord=asc'
   exporturl = True
   limit = 20
@@ -986,6 +995,7 @@ class PurchaseAnalysisWidget(Widget):
   tooltip = _("Analyse the urgency of existing purchase orders")
   permissions = (("view_purchaseorder", "Can view purchase orders"),)
   asynchronous = True
+  cacheable = True
   url = '/data/input/purchaseorder/?status=confirmed&sidx=criticality&sord=asc'
   limit = 20
 
@@ -1023,6 +1033,7 @@ class AlertsWidget(Widget):
   tooltip = _("Overview of all alerts in the plan")
   permissions = (("view_problem_report", "Can view problem report"),)
   asynchronous = True
+  cacheable = True
   url = '/problem/'
   entities = 'material,capacity,demand,operation'
 
@@ -1093,6 +1104,7 @@ class ResourceLoadWidget(Widget):
   tooltip = _("Shows the resources with the highest utilization")
   permissions = (("view_resource_report", "Can view resource report"),)
   asynchronous = True
+  cacheable = True
   url = '/resource/'
   exporturl = True
   limit = 5
@@ -1194,6 +1206,7 @@ class InventoryByLocationWidget(Widget):
   title = _("inventory by location")
   tooltip = _("Display the locations with the highest inventory value")
   asynchronous = True
+  cacheable = True
   limit = 5
 
   def args(self):
@@ -1289,6 +1302,7 @@ class InventoryByItemWidget(Widget):
   title = _("inventory by item")
   tooltip = _("Display the items with the highest inventory value")
   asynchronous = True
+  cacheable = True
   limit = 20
 
   def args(self):
@@ -1380,6 +1394,7 @@ class DeliveryPerformanceWidget(Widget):
   title = _("delivery performance")
   tooltip = _("Shows the percentage of demands that are planned to be shipped completely on time")
   asynchronous = True
+  cacheable = True
   green = 90
   yellow = 80
 
@@ -238,6 +238,56 @@ DEFAULT_THEME = 'earth'
 # The default number of records to pull from the server as a page
 DEFAULT_PAGESIZE = 100
 
+# Counting the records of a report is expensive on large tables. This
+# setting controls how the number of records and pages is computed:
+#   - 'exact': count all records
+#   - 'estimate': use the estimate of the database when it is larger than
+#     GRID_COUNT_THRESHOLD, and count the records otherwise
+#   - 'none': don't count the records. The grid only knows whether there
+#     is a next page.
+# The argument "count" in the URL of a report overrides this setting.
+# Exact counts larger than GRID_COUNT_THRESHOLD are reused during
+# GRID_COUNT_CACHE seconds.
+GRID_COUNT = 'estimate'
+GRID_COUNT_THRESHOLD = 100000
+GRID_COUNT_CACHE = 60
+
+# Spreadsheet exports of a report with more rows than this number are
+# generated in a background task. The spreadsheet can then be downloaded
+# from the task status screen.
+SPREADSHEET_BACKGROUND_RECORDS = 100000
+
+# Cache for the results of the plan reports and dashboard widgets.
+# The results are invalidated automatically when a task finishes in the
+# scenario. A local-memory cache is private to every web server process.
+# A file based cache is shared between all processes:
+#   'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#   'LOCATION': os.path.join(FREPPLE_LOGDIR, 'cache'),
+# Remove the "reports" cache to disable the caching.
+CACHES = {
+  'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+  'reports': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'reports',
+    'TIMEOUT': 3600,
+    'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+  }
+
+# The test suite runs without report cache
+if 'test' in sys.argv:
+  CACHES['reports']['BACKEND'] = 'django.core.cache.backends.dummy.DummyCache'
+
+# Results larger than this number of characters aren't cached
+REPORT_CACHE_MAXSIZE = 10000000
+
+# Render the cacheable dashboard widgets at the end of the plan generation.
+# The dashboard then shows them without querying the plan, together with
+# the time they were rendered.
+PRERENDER_WIDGETS = True
+
 # Configuration of the default dashboard
 DEFAULT_DASHBOARD = [
   { 'rowname': 'Welcome', 'cols': [
@@ -294,6 +344,42 @@ DEFAULT_DASHBOARD = [
 # Port number for the CherryPy web server
 PORT = 8000
 
+# Idle time in seconds after which a resident planning engine exits.
+# When a positive value is set, plans are generated by a planning engine that
+# keeps the model of the scenario in memory between plan runs.
+# The default value 0 starts a new planning process for every plan.
+PLANNING_ENGINE_TIMEOUT = 0
+
+# Number of threads to run the steps of a plan generation.
+# Steps that don't depend on each other, such as exporting the plan to
+# different destinations, are executed in parallel.
+# The value 1 runs all steps one after the other.
+PLANTASK_THREADS = 4
+
+# Number of times a failed export of the plan is restarted before the plan
+# generation fails. The export starts again from erasing the previous plan,
+# but the plan isn't regenerated.
+PLANTASK_EXPORT_RETRIES = 1
+
+# Number of plan generations for which the performance indicators are kept.
+# The performance indicator report compares the last run with the previous
+# one. A simulation with the engine option saves a snapshot in every bucket.
+KPI_HISTORY = 50
+
+# Number of processes solving the variants of a what-if analysis in parallel,
+# started with "frepplectl frepple_whatif".
+# The value None uses a process per CPU core.
+PLANNING_WHATIF_PROCESSES = None
+
+# Settings of a worker pool, started with "frepplectl frepple_runworker --pool".
+# The pool processes the task queues of all scenarios, running at most
+# WORKER_CONCURRENCY tasks at the same time and never two tasks in the same
+# scenario. Tasks are only launched in parallel when their estimated memory
+# fits within WORKER_MEMORY_LIMIT megabytes. The default value 0 uses 80% of
+# the physical memory of the server.
+WORKER_CONCURRENCY = 4
+WORKER_MEMORY_LIMIT = 0
+
 REST_FRAMEWORK = {
   # Use Django's standard `django.contrib.auth` permissions,
   # or allow read-only access for unauthenticated users.
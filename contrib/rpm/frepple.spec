@@ -26,7 +26,7 @@ BuildRoot: %(mktemp -ud %{_tmppath}/%{name}-%{version}-XXXXXX)
 # Note on dependencies: Django is also required, but we need a custom install.
 Requires: xerces-c, openssl, httpd, python3-mod_wsgi, python3
 Requires(pre): shadow-utils
-BuildRequires: python3-devel, automake, autoconf, libtool, xerces-c-devel, python3-sphinx
+BuildRequires: python3-devel, automake, autoconf, libtool, xerces-c-devel, zlib-devel, python3-sphinx
 # Note: frePPLe requires a custom install of django and also some
 # additional python modules. Users install all these using the python packager "pip3"
 # BEFORE compiling frePPLe.
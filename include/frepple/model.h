@@ -8945,6 +8945,18 @@ class ProblemMaterialExcess : public Problem
 class CommandCreateOperationPlan : public Command
 {
   public:
+    /** Commands are allocated from a per-thread pool. */
+    static void* operator new(size_t sz)
+    {
+      return SlotPool<sizeof(CommandCreateOperationPlan)>::allocate(sz);
+    }
+
+    /** Commands are allocated from a per-thread pool. */
+    static void operator delete(void* p, size_t sz)
+    {
+      SlotPool<sizeof(CommandCreateOperationPlan)>::release(p, sz);
+    }
+
     /** Constructor. */
     CommandCreateOperationPlan
     (const Operation* o, double q, Date d1, Date d2, Demand* l,
@@ -8953,6 +8965,7 @@ class CommandCreateOperationPlan : public Command
       opplan = o ?
           o->createOperationPlan(q, d1, d2, l, ow, 0, makeflowsloads)
           : nullptr;
+      if (opplan) ++countCreated;
     }
 
     void commit()
@@ -8966,6 +8979,7 @@ class CommandCreateOperationPlan : public Command
 
     virtual void rollback()
     {
+      if (opplan) ++countRolledBack;
       delete opplan;
       opplan = nullptr;
     }
@@ -8990,6 +9004,16 @@ class CommandCreateOperationPlan : public Command
       return opplan;
     }
 
+    /** Number of operationplans created with this command by the current
+      * thread. The counter is used to profile the solver algorithms.
+      */
+    static thread_local unsigned long countCreated;
+
+    /** Number of operationplans rolled back with this command by the
+      * current thread. The counter is used to profile the solver algorithms.
+      */
+    static thread_local unsigned long countRolledBack;
+
   private:
     /** Pointer to the newly created operationplan. */
     OperationPlan *opplan;
@@ -9003,6 +9027,18 @@ class CommandCreateOperationPlan : public Command
 class CommandDeleteOperationPlan : public Command
 {
   public:
+    /** Commands are allocated from a per-thread pool. */
+    static void* operator new(size_t sz)
+    {
+      return SlotPool<sizeof(CommandDeleteOperationPlan)>::allocate(sz);
+    }
+
+    /** Commands are allocated from a per-thread pool. */
+    static void operator delete(void* p, size_t sz)
+    {
+      SlotPool<sizeof(CommandDeleteOperationPlan)>::release(p, sz);
+    }
+
     /** Constructor. */
     CommandDeleteOperationPlan(OperationPlan* o);
 
@@ -9071,6 +9107,18 @@ class CommandDeleteOperationPlan : public Command
 class CommandMoveOperationPlan : public Command
 {
   public:
+    /** Commands are allocated from a per-thread pool. */
+    static void* operator new(size_t sz)
+    {
+      return SlotPool<sizeof(CommandMoveOperationPlan)>::allocate(sz);
+    }
+
+    /** Commands are allocated from a per-thread pool. */
+    static void operator delete(void* p, size_t sz)
+    {
+      SlotPool<sizeof(CommandMoveOperationPlan)>::release(p, sz);
+    }
+
     /** Constructor.<br>
       * Unlike most other commands the constructor already executes the change.
       * @param opplanptr Pointer to the operationplan being moved.
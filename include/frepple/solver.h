@@ -26,6 +26,8 @@
 #ifndef DOXYGEN
 #include <deque>
 #include <cmath>
+#include <chrono>
+#include <atomic>
 #endif
 
 namespace frepple
@@ -540,6 +542,41 @@ class SolverMRP : public Solver
       iteration_max = d;
     }
 
+    /** Return the number of slowest demands the solver keeps track of.<br>
+      * A value of 0 disables the sampling of the demands.
+      */
+    unsigned long getSlowDemands() const
+    {
+      return slowdemands;
+    }
+
+    /** Update the number of slowest demands the solver keeps track of.<br>
+      * When the value is positive, the solver measures the effort spent
+      * on each demand and remembers the slowest ones. The default value
+      * is 0 which disables this instrumentation.
+      */
+    void setSlowDemands(unsigned long d)
+    {
+      slowdemands = d;
+    }
+
+    /** Request the solver to stop.<br>
+      * The request is checked before solving each cluster and each demand.
+      * It is thus safe to call this method from another thread while the
+      * solver is running. The plan of the demands that were already solved
+      * is kept.
+      */
+    void cancel()
+    {
+      cancelled = true;
+    }
+
+    /** Returns true when the last solver run was cancelled. */
+    bool getCancelled() const
+    {
+      return cancelled;
+    }
+
     /** Return whether or not we automatically commit the changes after
       * planning a demand. */
     bool getAutocommit() const
@@ -623,6 +660,138 @@ class SolverMRP : public Solver
     /** Python method for undoing the plan changes. */
     static PyObject* rollback(PyObject*, PyObject*);
 
+    /** Python method to cancel a running solver. */
+    static PyObject* cancelPython(PyObject*, PyObject*);
+
+    /** Python method returning the progress of the running solver as a
+      * dictionary. It reads a couple of counters, and can thus be called
+      * frequently from another thread while the solver is running.
+      */
+    static PyObject* getProgressPython(PyObject*, PyObject*);
+
+    /** Python method returning the profiling counters of the last solver
+      * run as a dictionary.
+      */
+    static PyObject* getCountersPython(PyObject*, PyObject*);
+
+    /** @brief Counters to profile the effort spent by the solver.
+      *
+      * The counters are collected per cluster by each solver thread, and are
+      * merged in the solver when the cluster is planned. Collecting them
+      * doesn't require any locking in the solver algorithms.
+      */
+    struct Counters
+    {
+      /** Number of calls to the demand solver. */
+      unsigned long demands = 0;
+
+      /** Number of calls to the buffer solvers. */
+      unsigned long buffers = 0;
+
+      /** Number of calls to the operation solvers. */
+      unsigned long operations = 0;
+
+      /** Number of calls to the resource solvers. */
+      unsigned long resources = 0;
+
+      /** Number of alternates evaluated by the alternate operation solver. */
+      unsigned long alternates = 0;
+
+      /** Number of rollbacks of the command manager. */
+      unsigned long rollbacks = 0;
+
+      /** Number of times a lazy delay was applied to retry a request. */
+      unsigned long lazydelays = 0;
+
+      /** Number of events inserted in the flowplan and loadplan timelines. */
+      unsigned long timeline_inserts = 0;
+
+      /** Number of events erased from the flowplan and loadplan timelines. */
+      unsigned long timeline_erases = 0;
+
+      /** Wall clock time spent planning, expressed in seconds. */
+      double time = 0.0;
+
+      /** Add the values of another set of counters. */
+      Counters& operator += (const Counters& o)
+      {
+        demands += o.demands;
+        buffers += o.buffers;
+        operations += o.operations;
+        resources += o.resources;
+        alternates += o.alternates;
+        rollbacks += o.rollbacks;
+        lazydelays += o.lazydelays;
+        timeline_inserts += o.timeline_inserts;
+        timeline_erases += o.timeline_erases;
+        time += o.time;
+        return *this;
+      }
+
+      /** Write the counters to the log file. */
+      void log(const string&) const;
+
+      /** Return the counters as a Python dictionary. */
+      PyObject* toPython() const;
+    };
+
+    /** Return the counters of a cluster planned in the last solver run.<br>
+      * A nullptr is returned when the cluster wasn't planned.
+      */
+    const Counters* getCounters(int c) const
+    {
+      auto i = counters_cluster.find(c);
+      return i == counters_cluster.end() ? nullptr : &(i->second);
+    }
+
+    /** Return the total of the counters of the last solver run. */
+    Counters getCounters() const;
+
+    /** Python method returning the slowest demands of the last solver run
+      * as a list of dictionaries.
+      */
+    static PyObject* getSlowDemandsPython(PyObject*, PyObject*);
+
+    /** @brief Measurement of the effort spent to plan a single demand.
+      * @see SolverMRP::setSlowDemands
+      */
+    struct DemandSample
+    {
+      /** Demand being planned. */
+      const Demand* demand = nullptr;
+
+      /** Wall clock time spent planning the demand, in seconds. */
+      double time = 0.0;
+
+      /** Number of asks to the buffer solvers. */
+      unsigned long iterations = 0;
+
+      /** Number of operationplans created. */
+      unsigned long created = 0;
+
+      /** Number of operationplans created and rolled back again. */
+      unsigned long rolledback = 0;
+
+      /** Description of the last constraint found while planning the
+        * demand, or the error that aborted the search.
+        */
+      string constraint;
+
+      /** Comparison operator, used to keep the slowest samples. */
+      bool operator > (const DemandSample& o) const
+      {
+        return time > o.time;
+      }
+    };
+
+    /** Return the slowest demands of the last solver run, sorted from
+      * slow to fast.
+      */
+    const vector<DemandSample>& getSlowDemandSamples() const
+    {
+      return slowdemand_samples;
+    }
+
     bool getRotateResources() const
     {
       return rotateResources;
@@ -685,7 +854,9 @@ class SolverMRP : public Solver
       m->addBoolField<Cls>(SolverMRP::tag_rotateresources, &Cls::getRotateResources, &Cls::setRotateResources);
       m->addBoolField<Cls>(SolverMRP::tag_planSafetyStockFirst, &Cls::getPlanSafetyStockFirst, &Cls::setPlanSafetyStockFirst);
       m->addUnsignedLongField<Cls>(SolverMRP::tag_iterationmax, &Cls::getIterationMax, &Cls::setIterationMax);
+      m->addUnsignedLongField<Cls>(SolverMRP::tag_slowdemands, &Cls::getSlowDemands, &Cls::setSlowDemands);
       m->addIntField<Cls>(Tags::cluster, &Cls::getCluster, &Cls::setCluster);
+      m->addBoolField<Cls>(SolverMRP::tag_cancelled, &Cls::getCancelled, nullptr, BOOL_FALSE, DONT_SERIALIZE);
     }
 
   private:
@@ -693,6 +864,47 @@ class SolverMRP : public Solver
     typedef classified_demand::iterator cluster_iterator;
     classified_demand demands_per_cluster;
 
+    /** Profiling counters of each cluster planned in the last solver run. */
+    map<int, Counters> counters_cluster;
+
+    /** Protects the cluster counters while the solver threads merge their
+      * results.
+      */
+    mutex counters_lock;
+
+    /** Wall clock time of the phases of the last solver run, expressed in
+      * seconds.
+      */
+    vector< pair<string, double> > counters_phases;
+
+    /** Slowest demands of the last solver run. */
+    vector<DemandSample> slowdemand_samples;
+
+    /** Progress of the running solver: the number of clusters and demands
+      * planned so far, their totals, and the number of demands in the
+      * cluster that was started last.<br>
+      * The counters are updated by the solver threads.
+      */
+    atomic<unsigned long> progress_clusters{0};
+    atomic<unsigned long> progress_clusters_total{0};
+    atomic<unsigned long> progress_demands{0};
+    atomic<unsigned long> progress_demands_total{0};
+    atomic<unsigned long> progress_cluster_size{0};
+
+    /** Merge the slowest demands of a cluster with the ones collected
+      * from other clusters. This method is called from the solver threads.
+      */
+    void addSlowDemands(vector<DemandSample>&);
+
+    /** Store the counters of a cluster. This method is called from the
+      * solver threads.
+      */
+    void addCounters(int c, const Counters& cnt)
+    {
+      lock_guard<mutex> l(counters_lock);
+      counters_cluster[c] += cnt;
+    }
+
     static const Keyword tag_iterationthreshold;
     static const Keyword tag_iterationaccuracy;
     static const Keyword tag_lazydelay;
@@ -700,6 +912,8 @@ class SolverMRP : public Solver
     static const Keyword tag_rotateresources;
     static const Keyword tag_planSafetyStockFirst;
     static const Keyword tag_iterationmax;
+    static const Keyword tag_slowdemands;
+    static const Keyword tag_cancelled;
 
     /** Type of plan to be created. */
     short plantype;
@@ -730,6 +944,14 @@ class SolverMRP : public Solver
       */
     unsigned long iteration_max;
 
+    /** Number of slowest demands to keep track of. */
+    unsigned long slowdemands = 0;
+
+    /** Flag set when the solver is requested to stop. It is reset at the
+      * start of every solver run.
+      */
+    atomic<bool> cancelled{false};
+
     /** Enable or disable automatically committing the changes in the plan
       * after planning each demand.<br>
       * The flag is only respected when planning incremental changes, and
@@ -986,6 +1208,15 @@ class SolverMRP : public Solver
         /** Collect all purchase operations. */
         set<const OperationItemSupplier*> purchase_operations;
 
+        /** Profiling counters of this solver thread. */
+        Counters counters;
+
+        /** Slowest demands of this solver thread, stored as a min-heap. */
+        vector<DemandSample> slowdemands;
+
+        /** Plan a demand, and measure the effort spent doing so. */
+        void solveAndSample(Demand*);
+
       public:
         /** Pointer to the current solver status. */
         State* state;
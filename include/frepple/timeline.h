@@ -607,6 +607,16 @@ template <class type> class TimeLine
     /** This function is used to trace the consistency of the data structure. */
     bool check() const;
 
+    /** Number of events inserted in timelines of this type by the current
+      * thread. The counter is used to profile the solver algorithms.
+      */
+    static thread_local unsigned long countInserts;
+
+    /** Number of events erased from timelines of this type by the current
+      * thread. The counter is used to profile the solver algorithms.
+      */
+    static thread_local unsigned long countErases;
+
   private:
     /** A pointer to the first event in the timeline. */
     Event* first;
@@ -625,8 +635,16 @@ template <class type> class TimeLine
 };
 
 
+template <class type> thread_local unsigned long TimeLine<type>::countInserts = 0;
+
+
+template <class type> thread_local unsigned long TimeLine<type>::countErases = 0;
+
+
 template <class type> void TimeLine<type>::insert (Event* e)
 {
+  ++countInserts;
+
   // Loop through all entities till we find the insertion point
   // While searching from the end, update the onhand and cumulative produced
   // quantity of all nodes passed
@@ -761,6 +779,8 @@ template <class type> void TimeLine<type>::insert (Event* e)
 
 template <class type> void TimeLine<type>::erase(Event* e)
 {
+  ++countErases;
+
   // Update later entries
   double qty = e->getQuantity();
   if (qty > 0.0)
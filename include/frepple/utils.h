@@ -514,8 +514,10 @@ class NonCopyable
   *       - resource.loadplans
   *       - setup_matrices()
   *       - solvers()
-  *   - <b>printsize()</b>:<br>
-  *     Prints information about the memory consumption.
+  *   - <b>printsize([bool])</b>:<br>
+  *     Prints information about the memory consumption.<br>
+  *     The number of objects and their memory size are also returned as
+  *     a dictionary. Passing False only returns them, without printing.
   *   - <b>loadmodule(string)</b>:<br>
   *     Dynamically load a module in memory.
   *   - <b>readXMLdata(string [,bool] [,bool])</b>:<br>
@@ -523,10 +525,17 @@ class NonCopyable
   *   - <b>log(string)</b>:<br>
   *     Prints a string to the frePPLe log file.<br>
   *     This is used for redirecting the stdout and stderr of Python.
-  *   - <b>readXMLfile(string [,bool] [,bool])</b>:<br>
-  *     Read an XML-file.
-  *   - <b>saveXMLfile(string)</b>:<br>
-  *     Save the model to an XML-file.
+  *   - <b>readXMLfile(string [,bool] [,bool] [,function] [,int])</b>:<br>
+  *     Read an XML-file.<br>
+  *     The last argument activates a streaming mode that processes the
+  *     objects in batches of the specified size. Files with the extension
+  *     ".gz" are decompressed on the fly.
+  *   - <b>saveXMLfile(string [,string] [,bool] [,bool])</b>:<br>
+  *     Save the model to an XML-file.<br>
+  *     The optional arguments are the content type (BASE, PLAN or DETAIL),
+  *     a flag to write compact output without indentation and a flag to
+  *     serialize the different categories in parallel.
+  *     Files with the extension ".gz" or ".zst" are compressed.
   *   - <b>saveplan(string)</b>:<br>
   *     Save the main plan information to a file.
   *   - <b>erase(boolean)</b>:<br>
@@ -2926,6 +2935,21 @@ class XMLData : public DataValue
       m_obj = nullptr;
     }
 
+    /** Re-initializes an existing element and also frees the memory
+      * allocated for its string buffer.
+      */
+    void release()
+    {
+      string().swap(m_strData);
+      m_obj = nullptr;
+    }
+
+    /** Returns the number of bytes allocated for the string buffer. */
+    size_t getMemory() const
+    {
+      return m_strData.capacity();
+    }
+
     /** Add some characters to this data field of this element.<br>
       * The second argument is the number of bytes, not the number of
       * characters.
@@ -4460,6 +4484,158 @@ class Tree : public NonCopyable
 };
 
 
+//
+// UTILITY CLASS "SLOTPOOL": recycling memory of short-lived objects
+//
+
+/** @brief A per-thread pool of fixed size memory slots.
+  *
+  * Classes of which objects are created and deleted at a high rate can
+  * allocate them from this pool instead of from the heap. This is used for
+  * the commands and bookmarks created by the solver: every tentative plan
+  * change is recorded in such an object, and most of them are rolled back
+  * shortly after.
+  *
+  * The slots are carved from blocks that are allocated as a contiguous
+  * array. Released slots are put on a free list of the current thread and
+  * reused for the next allocation. When a thread exits, its free slots are
+  * handed over to a shared list from which other threads can pick them up.
+  * The memory blocks are never returned to the heap: the memory footprint
+  * is determined by the peak number of objects that is alive at any time.
+  *
+  * A class uses the pool by overloading its new and delete operators:
+  * <pre>
+  *   static void* operator new(size_t sz)
+  *   {
+  *     return SlotPool<sizeof(MyClass)>::allocate(sz);
+  *   }
+  *
+  *   static void operator delete(void* p, size_t sz)
+  *   {
+  *     SlotPool<sizeof(MyClass)>::release(p, sz);
+  *   }
+  * </pre>
+  * Objects of a different size, eg subclasses with extra fields, fall back
+  * to the normal heap allocation.
+  *
+  * The test "slotpool" compares the pool with the heap allocator, using
+  * the allocation pattern of the solver.
+  * Defining the macro FREPPLE_NO_SLOTPOOL at compile time disables the
+  * pool, which is useful to debug memory errors.
+  */
+template <size_t SIZE> class SlotPool
+{
+  public:
+    /** Allocate memory for an object. */
+    static void* allocate(size_t sz)
+    {
+#ifndef FREPPLE_NO_SLOTPOOL
+      if (sz == SIZE)
+      {
+        FreeList& l = freelist;
+        if (!l.head)
+          l.refill();
+        Slot* s = l.head;
+        l.head = s->next;
+        return s;
+      }
+#endif
+      return ::operator new(sz);
+    }
+
+    /** Release the memory of an object. */
+    static void release(void* p, size_t sz)
+    {
+      if (!p)
+        return;
+#ifndef FREPPLE_NO_SLOTPOOL
+      if (sz == SIZE)
+      {
+        FreeList& l = freelist;
+        Slot* s = static_cast<Slot*>(p);
+        s->next = l.head;
+        l.head = s;
+        return;
+      }
+#endif
+      ::operator delete(p);
+    }
+
+  private:
+    /** Number of slots allocated at once. */
+    static const size_t SLOTSPERBLOCK = 1024;
+
+    /** A memory slot. */
+    union Slot
+    {
+      Slot* next;
+      double align_double;
+      void* align_pointer;
+      char data[SIZE];
+    };
+
+    /** The list of free slots of a thread. */
+    struct FreeList
+    {
+      Slot* head = nullptr;
+
+      /** Get free slots from the shared list, or allocate a new block. */
+      void refill()
+      {
+        {
+          lock_guard<mutex> l(sharedlock);
+          if (sharedhead)
+          {
+            head = sharedhead;
+            sharedhead = nullptr;
+            return;
+          }
+        }
+        Slot* block = static_cast<Slot*>(
+          ::operator new(sizeof(Slot) * SLOTSPERBLOCK)
+          );
+        for (size_t i = 0; i < SLOTSPERBLOCK - 1; ++i)
+          block[i].next = &block[i + 1];
+        block[SLOTSPERBLOCK - 1].next = nullptr;
+        head = block;
+      }
+
+      /** Hand over the free slots to the shared list when the thread
+        * exits. */
+      ~FreeList()
+      {
+        if (!head)
+          return;
+        Slot* tail = head;
+        while (tail->next)
+          tail = tail->next;
+        lock_guard<mutex> l(sharedlock);
+        tail->next = sharedhead;
+        sharedhead = head;
+        head = nullptr;
+      }
+    };
+
+    /** Free slots of the current thread. */
+    static thread_local FreeList freelist;
+
+    /** Free slots left behind by threads that exited. */
+    static Slot* sharedhead;
+
+    /** Protects the shared list. */
+    static mutex sharedlock;
+};
+
+
+template <size_t SIZE> thread_local typename SlotPool<SIZE>::FreeList SlotPool<SIZE>::freelist;
+
+
+template <size_t SIZE> typename SlotPool<SIZE>::Slot* SlotPool<SIZE>::sharedhead = nullptr;
+
+
+template <size_t SIZE> mutex SlotPool<SIZE>::sharedlock;
+
+
 //
 // UTILITY CLASS "COMMAND": for executing & undoing actions
 //
@@ -4907,6 +5083,18 @@ class CommandManager
         Bookmark* parent = nullptr;
         Bookmark(Bookmark* p=nullptr) : parent(p) {}
       public:
+        /** Bookmarks are allocated from a per-thread pool. */
+        static void* operator new(size_t sz)
+        {
+          return SlotPool<sizeof(Bookmark)>::allocate(sz);
+        }
+
+        /** Bookmarks are allocated from a per-thread pool. */
+        static void operator delete(void* p, size_t sz)
+        {
+          SlotPool<sizeof(Bookmark)>::release(p, sz);
+        }
+
         /** Returns true if the bookmark commands are active. */
         bool isActive() const
         {
@@ -5055,6 +5243,9 @@ class CommandManager
       */
     Bookmark* currentBookmark;
 
+    /** Number of rollbacks executed by this manager. */
+    unsigned long countRollbacks = 0;
+
   public:
     /** Constructor. */
     CommandManager()
@@ -5138,6 +5329,14 @@ class CommandManager
 
     /** Rolling back all commands. */
     void rollback();
+
+    /** Return the number of rollbacks executed by this manager.<br>
+      * The counter is used to profile the solver algorithms.
+      */
+    unsigned long getRollbackCount() const
+    {
+      return countRollbacks;
+    }
 };
 
 
@@ -41,6 +41,20 @@
 #include <xercesc/framework/StdInInputSource.hpp>
 #include <xercesc/framework/URLInputSource.hpp>
 #include <xercesc/util/XMLException.hpp>
+#include <xercesc/util/BinInputStream.hpp>
+#include <xercesc/sax/InputSource.hpp>
+#endif
+
+// Header file for the optional zlib compression library
+#if defined(HAVE_ZLIB_H) && defined(HAVE_LIBZ) && !defined(DOXYGEN)
+#include <zlib.h>
+#define FREPPLE_ZLIB
+#endif
+
+// Header file for the optional zstd compression library
+#if defined(HAVE_ZSTD_H) && defined(HAVE_LIBZSTD) && !defined(DOXYGEN)
+#include <zstd.h>
+#define FREPPLE_ZSTD
 #endif
 
 namespace frepple
@@ -141,6 +155,28 @@ class XMLInput : public DataInput, public NonCopyable,  private xercesc::Default
       */
     bool abortOnDataException = true;
 
+    /** Number of top level objects after which the changes are committed
+      * and the transient parser data is released.<br>
+      * This streaming mode is intended for processing very large files with
+      * a bounded memory footprint. The default value 0 disables it.
+      */
+    unsigned long batchsize = 0;
+
+    /** Number of XML elements processed. */
+    unsigned long countElements = 0;
+
+    /** Number of top level objects processed. */
+    unsigned long countObjects = 0;
+
+    /** Peak number of bytes held in the data stack of the parser. */
+    size_t peakTransient = 0;
+
+    /** Releases the memory held by the data stack between the two indices.
+      * When a complete batch of objects has been read, the changes are also
+      * committed in the command manager.
+      */
+    void releaseTransientData(int, int);
+
     /** A buffer used for transcoding XML data. */
     char encodingbuffer[4*1024];
 
@@ -215,6 +251,42 @@ class XMLInput : public DataInput, public NonCopyable,  private xercesc::Default
       return abortOnDataException;
     }
 
+    /** Updates the number of top level objects in a batch of the streaming
+      * mode. Passing 0 switches off the streaming mode.
+      */
+    void setBatchSize(unsigned long b)
+    {
+      batchsize = b;
+    }
+
+    /** Returns the number of top level objects in a batch of the streaming
+      * mode. 0 is returned when the streaming mode isn't active.
+      */
+    unsigned long getBatchSize() const
+    {
+      return batchsize;
+    }
+
+    /** Returns the number of XML elements processed. */
+    unsigned long getElementCount() const
+    {
+      return countElements;
+    }
+
+    /** Returns the number of top level objects processed. */
+    unsigned long getObjectCount() const
+    {
+      return countObjects;
+    }
+
+    /** Returns the peak number of bytes held in the data stack of the
+      * parser. This value is only tracked in streaming mode.
+      */
+    size_t getPeakTransientMemory() const
+    {
+      return peakTransient;
+    }
+
     /** Transcode the Xerces XML characters to our UTF8 encoded buffer. */
     char* transcodeUTF8(const XMLCh*);
 
@@ -273,7 +345,9 @@ class XMLInputString : public XMLInput
   *
   * The filename argument can be the name of a file or a directory.
   * If a directory is passed, all files with the extension ".xml"
-  * will be read from it. Subdirectories are not recursed.
+  * will be read from it. Subdirectories are not recursed.<br>
+  * Files with the extension ".gz" are decompressed while they are being
+  * read. This requires the zlib library to be available at compile time.
   */
 class XMLInputFile : public XMLInput
 {
@@ -315,6 +389,60 @@ class XMLInputFile : public XMLInput
 };
 
 
+#ifdef FREPPLE_ZLIB
+/** @brief This class is a Xerces input stream that decompresses a gzip
+  * file on the fly.
+  *
+  * The file is never expanded on disk or in memory: the parser pulls
+  * blocks of decompressed data as it needs them.
+  */
+class GzipInputStream : public xercesc::BinInputStream
+{
+  public:
+    /** Constructor. */
+    GzipInputStream(const string&);
+
+    /** Destructor. */
+    ~GzipInputStream();
+
+    /** Return the current position in the decompressed stream. */
+    XMLFilePos curPos() const;
+
+    /** Read a block of decompressed data. */
+    XMLSize_t readBytes(XMLByte* const, const XMLSize_t);
+
+    /** Return the content type of the stream, which we don't know. */
+    const XMLCh* getContentType() const
+    {
+      return nullptr;
+    }
+
+  private:
+    /** Handle of the gzip file. */
+    gzFile fd;
+};
+
+
+/** @brief This class is a Xerces input source for a gzip compressed file. */
+class GzipInputSource : public xercesc::InputSource
+{
+  public:
+    /** Constructor. */
+    GzipInputSource(const string& f) : InputSource(f.c_str()), filename(f) {}
+
+    /** Create a new stream to read the file. */
+    xercesc::BinInputStream* makeStream() const
+    {
+      return new GzipInputStream(filename);
+    }
+
+  private:
+    /** Name of the file. */
+    string filename;
+};
+#endif
+
+
 /** @brief This class represents a list of XML key+value pairs.
   *
   * The method is a thin wrapper around one of the internal data
@@ -392,6 +520,26 @@ class XMLSerializer : public Serializer
       return headerAtts;
     }
 
+    /** Updates whether the output is written without indentation.<br>
+      * The compact output is smaller and faster to write. The default is
+      * false.
+      */
+    void setCompact(bool b)
+    {
+      compact = b;
+      if (compact)
+      {
+        m_nIndent = 0;
+        indentstring[0] = '\0';
+      }
+    }
+
+    /** Returns true when the output is written without indentation. */
+    bool getCompact() const
+    {
+      return compact;
+    }
+
     /** Constructor with a given stream. */
     XMLSerializer(ostream& os) : Serializer(os), m_nIndent(0),
       headerStart("<?xml version=\"1.0\" encoding=\"UTF-8\"?>"),
@@ -685,6 +833,20 @@ class XMLSerializer : public Serializer
       */
     void writeElementWithHeader(const Keyword& tag, const Object* object);
 
+    /** This method writes a serializable object with a complete XML compliant
+      * header, just like the writeElementWithHeader method.<br>
+      * Each field of the root object (e.g. the list of items, operations,
+      * operationplans...) is serialized in a separate chunk, and the chunks
+      * are written concurrently in worker threads. The chunks are then
+      * concatenated in the output in the original field order.<br>
+      * This method trades memory for speed: all chunks are kept in memory
+      * till they are written to the output.<br>
+      * The serialization of the chunks must only read the model. Any data
+      * computed lazily during the serialization, such as the problems of
+      * the operationplans, must be computed before calling this method.
+      */
+    void writeElementWithHeaderParallel(const Keyword& tag, const Object* object);
+
     /** Returns a pointer to the object that is currently being saved. */
     Object* getCurrentObject() const
     {
@@ -710,6 +872,11 @@ class XMLSerializer : public Serializer
     }
 
   private:
+    /** Function to serialize a chunk of a document in a worker thread.
+      * @see writeElementWithHeaderParallel
+      */
+    static void writeChunk(void*);
+
     /** Write the argument to the output stream, while escaping any
       * special characters.
       * The following characters are replaced:
@@ -725,9 +892,15 @@ class XMLSerializer : public Serializer
       * This method works fine with UTF-8 and single-byte encodings, but will
       * NOT work with other multibyte encodings (such as UTF-116 or UTF-32).
       * FrePPLe consistently uses UTF-8 in its internal representation.
+      *
+      * Sequences of characters without special characters are written as
+      * a single block to the output stream.
       */
     void escape(const string&);
 
+    /** Flag to write the output without indentation. */
+    bool compact = false;
+
     /** This variable keeps track of the indentation level.
       * @see incIndent, decIndent
       */
@@ -761,11 +934,85 @@ class XMLSerializer : public Serializer
 };
 
 
+#ifdef FREPPLE_ZLIB
+/** @brief A stream buffer that writes gzip compressed data to a file. */
+class GzipOutputBuffer : public streambuf
+{
+  public:
+    /** Constructor. */
+    GzipOutputBuffer(const string&);
+
+    /** Destructor. */
+    ~GzipOutputBuffer();
+
+  protected:
+    /** Called when the buffer is full. */
+    int overflow(int);
+
+    /** Compress and write the buffer. */
+    int sync();
+
+  private:
+    /** Compress and write the content of the buffer. */
+    bool flushBuffer();
+
+    /** Handle of the gzip file. */
+    gzFile fd;
+
+    /** Buffer with uncompressed data. */
+    char buffer[64*1024];
+};
+#endif
+
+
+#ifdef FREPPLE_ZSTD
+/** @brief A stream buffer that writes zstd compressed data to a file. */
+class ZstdOutputBuffer : public streambuf
+{
+  public:
+    /** Constructor. */
+    ZstdOutputBuffer(const string&);
+
+    /** Destructor. */
+    ~ZstdOutputBuffer();
+
+  protected:
+    /** Called when the buffer is full. */
+    int overflow(int);
+
+    /** Compress and write the buffer. */
+    int sync();
+
+  private:
+    /** Compress and write the content of the buffer. */
+    bool flushBuffer();
+
+    /** Output file. */
+    FILE* fd;
+
+    /** Compression context. */
+    ZSTD_CStream* cstream;
+
+    /** Buffer with compressed data. */
+    char* outbuffer;
+
+    /** Size of the buffer with compressed data. */
+    size_t outsize;
+
+    /** Buffer with uncompressed data. */
+    char buffer[64*1024];
+};
+#endif
+
+
 /** @brief This class writes XML data to a flat file.
   *
   * Note that an object of this class can write only to a single file. If
   * multiple files are required multiple XMLOutputFile objects will be
-  * required too.
+  * required too.<br>
+  * When the file name ends with ".gz" or ".zst" the output is compressed
+  * with gzip or zstd respectively. This requires the zlib or zstd library
+  * to be available at compile time.
   * @see XMLOutput
   */
 class XMLSerializerFile : public XMLSerializer
@@ -773,21 +1020,26 @@ class XMLSerializerFile : public XMLSerializer
   public:
     /** Constructor with a filename as argument. An exception will be
       * thrown if the output file can't be properly initialized. */
-    XMLSerializerFile(const string& chFilename)
-    {
-      of.open(chFilename.c_str(), ios::out);
-      if(!of) throw RuntimeException("Could not open output file");
-      setOutput(of);
-    }
+    XMLSerializerFile(const string&);
 
     /** Destructor. */
-    ~XMLSerializerFile()
-    {
-      of.close();
-    }
+    ~XMLSerializerFile();
 
   private:
+    /** Size of the output buffer for uncompressed files. */
+    static const size_t buffersize = 1024*1024;
+
+    /** Stream for uncompressed files. */
     ofstream of;
+
+    /** Stream for compressed files. */
+    ostream compressedstream;
+
+    /** Stream buffer for compressed files. */
+    streambuf* compressed = nullptr;
+
+    /** Output buffer for uncompressed files. */
+    char* buffer = nullptr;
 };
 
 
@@ -35,8 +35,9 @@ PyObject* readXMLfile(PyObject* self, PyObject* args)
   char *filename = nullptr;
   int validate(1), validate_only(0);
   PyObject *userexit = nullptr;
-  int ok = PyArg_ParseTuple(args, "|siiO:readXMLfile",
-    &filename, &validate, &validate_only, &userexit);
+  unsigned long batchsize = 0;
+  int ok = PyArg_ParseTuple(args, "|siiOk:readXMLfile",
+    &filename, &validate, &validate_only, &userexit, &batchsize);
   if (!ok) return nullptr;
 
   // Execute and catch exceptions
@@ -49,6 +50,7 @@ PyObject* readXMLfile(PyObject* self, PyObject* args)
       xercesc::StdInInputSource in;
       XMLInput p;
       if (userexit) p.setUserExit(userexit);
+      p.setBatchSize(batchsize);
       if (validate_only!=0)
         // When no root object is passed, only the input validation happens
         p.parse(in, nullptr, true);
@@ -59,6 +61,7 @@ PyObject* readXMLfile(PyObject* self, PyObject* args)
     {
       XMLInputFile p(filename);
       if (userexit) p.setUserExit(userexit);
+      p.setBatchSize(batchsize);
       if (validate_only!=0)
         // Read and validate a file
         p.parse(nullptr, true);
@@ -128,7 +131,9 @@ PyObject* saveXMLfile(PyObject* self, PyObject* args)
   // Pick up arguments
   char *filename;
   char *content = nullptr;
-  int ok = PyArg_ParseTuple(args, "s|s:saveXMLfile", &filename, &content);
+  int compact(0), parallel(0);
+  int ok = PyArg_ParseTuple(args, "s|sii:saveXMLfile",
+    &filename, &content, &compact, &parallel);
   if (!ok) return nullptr;
 
   // Execute and catch exceptions
@@ -147,7 +152,23 @@ PyObject* saveXMLfile(PyObject* self, PyObject* args)
       else
         throw DataException("Invalid content type '" + string(content) + "'");
     }
-    o.writeElementWithHeader(Tags::plan, &Plan::instance());
+    o.setCompact(compact!=0);
+    if (parallel!=0)
+    {
+      if (o.getContentType() != BASE)
+      {
+        // Problems are created and deleted on the fly when they are
+        // serialized, which isn't thread-safe. Several chunks serialize the
+        // same operationplans, so we compute all problems upfront and the
+        // worker threads only read them.
+        Plannable::computeProblems();
+        for (OperationPlan::iterator i = OperationPlan::begin(); i != OperationPlan::end(); ++i)
+          i->updateProblems();
+      }
+      o.writeElementWithHeaderParallel(Tags::plan, &Plan::instance());
+    }
+    else
+      o.writeElementWithHeader(Tags::plan, &Plan::instance());
   }
   catch (...)
   {
@@ -291,6 +312,14 @@ PyObject* savePlan(PyObject* self, PyObject* args)
 }
 
 
+//
+// CREATE OPERATIONPLAN
+//
+
+thread_local unsigned long CommandCreateOperationPlan::countCreated = 0;
+thread_local unsigned long CommandCreateOperationPlan::countRolledBack = 0;
+
+
 //
 // MOVE OPERATIONPLAN
 //
@@ -472,6 +501,22 @@ PyObject* eraseModel(PyObject* self, PyObject* args)
 
 PyObject* printModelSize(PyObject* self, PyObject* args)
 {
+  // Pick up arguments
+  int print(1);
+  int ok = PyArg_ParseTuple(args, "|i:printsize", &print);
+  if (!ok) return nullptr;
+
+  // Count and size of each object type
+  vector< pair<string, pair<size_t, size_t> > > sizes;
+  size_t total = 0;
+  auto report = [&sizes, print](const string& label, size_t cnt, size_t mem)
+  {
+    if (print)
+      logger << label << string(label.size() < 22 ? 22 - label.size() : 0, ' ')
+        << "\t" << cnt << "\t" << mem << endl;
+    sizes.push_back(make_pair(label, make_pair(cnt, mem)));
+  };
+
   // Free Python interpreter for other threads
   Py_BEGIN_ALLOW_THREADS
 
@@ -480,24 +525,27 @@ PyObject* printModelSize(PyObject* self, PyObject* args)
   {
     size_t count, memsize;
 
-    // Intro
-    logger << endl << "Size information of frePPLe " << PACKAGE_VERSION
-      << " (" << __DATE__ << ")" << endl << endl;
+    if (print)
+    {
+      // Intro
+      logger << endl << "Size information of frePPLe " << PACKAGE_VERSION
+        << " (" << __DATE__ << ")" << endl << endl;
 
-    // Print loaded modules
-    Environment::printModules();
+      // Print loaded modules
+      Environment::printModules();
 
-    // Print the number of clusters
-    logger << "Clusters: " << HasLevel::getNumberOfClusters() << endl << endl;
+      // Print the number of clusters
+      logger << "Clusters: " << HasLevel::getNumberOfClusters() << endl << endl;
 
-    // Header for memory size
-    logger << "Memory usage:" << endl;
-    logger << "Model                 \tCount\tMemory" << endl;
-    logger << "-----                 \t-----\t------" << endl;
+      // Header for memory size
+      logger << "Memory usage:" << endl;
+      logger << "Model                 \tCount\tMemory" << endl;
+      logger << "-----                 \t-----\t------" << endl;
+    }
 
     // Plan
-    size_t total = Plan::instance().getSize();
-    logger << "Plan                  \t1\t"<< Plan::instance().getSize() << endl;
+    total = Plan::instance().getSize();
+    report("Plan", 1, Plan::instance().getSize());
 
     // Locations
     memsize = 0;
@@ -512,42 +560,42 @@ PyObject* printModelSize(PyObject* self, PyObject* args)
         memItemDistributions += rs->getSize();
       }
     }
-    logger << "Location              \t" << Location::size() << "\t" << memsize << endl;
+    report("Location", Location::size(), memsize);
     total += memsize;
 
     // Customers
     memsize = 0;
     for (Customer::iterator c = Customer::begin(); c != Customer::end(); ++c)
       memsize += c->getSize();
-    logger << "Customer              \t" << Customer::size() << "\t" << memsize << endl;
+    report("Customer", Customer::size(), memsize);
     total += memsize;
 
     // Suppliers
     memsize = 0;
     for (Supplier::iterator c = Supplier::begin(); c != Supplier::end(); ++c)
       memsize += c->getSize();
-    logger << "Supplier              \t" << Supplier::size() << "\t" << memsize << endl;
+    report("Supplier", Supplier::size(), memsize);
     total += memsize;
 
     // Buffers
     memsize = 0;
     for (Buffer::iterator b = Buffer::begin(); b != Buffer::end(); ++b)
       memsize += b->getSize();
-    logger << "Buffer                \t" << Buffer::size() << "\t" << memsize << endl;
+    report("Buffer", Buffer::size(), memsize);
     total += memsize;
 
     // Setup matrices
     memsize = 0;
     for (SetupMatrix::iterator s = SetupMatrix::begin(); s != SetupMatrix::end(); ++s)
       memsize += s->getSize();
-    logger << "Setup matrix          \t" << SetupMatrix::size() << "\t" << memsize << endl;
+    report("Setup matrix", SetupMatrix::size(), memsize);
     total += memsize;
 
     // Resources
     memsize = 0;
     for (Resource::iterator r = Resource::begin(); r != Resource::end(); ++r)
       memsize += r->getSize();
-    logger << "Resource              \t" << Resource::size() << "\t" << memsize << endl;
+    report("Resource", Resource::size(), memsize);
     total += memsize;
 
     // Skills and resourceskills
@@ -563,8 +611,8 @@ PyObject* printModelSize(PyObject* self, PyObject* args)
         memResourceSkills += r->getSize();
       }
     }
-    logger << "Skill                 \t" << Skill::size() << "\t" << memsize << endl;
-    logger << "Resource skill        \t" << countResourceSkills << "\t" << memResourceSkills << endl;
+    report("Skill", Skill::size(), memsize);
+    report("Resource skill", countResourceSkills, memResourceSkills);
     total += memsize;
 
     // Operations, flows and loads
@@ -586,16 +634,16 @@ PyObject* printModelSize(PyObject* self, PyObject* args)
         memLoads += ld->getSize();
       }
     }
-    logger << "Operation             \t" << Operation::size() << "\t" << memsize << endl;
-    logger << "Operation material    \t" << countFlows << "\t" << memFlows  << endl;
-    logger << "operation resource    \t" << countLoads << "\t" << memLoads  << endl;
+    report("Operation", Operation::size(), memsize);
+    report("Operation material", countFlows, memFlows);
+    report("operation resource", countLoads, memLoads);
     total += memsize + memFlows + memLoads;
 
     // Calendars (which includes the buckets)
     memsize = 0;
     for (Calendar::iterator cl = Calendar::begin(); cl != Calendar::end(); ++cl)
       memsize += cl->getSize();
-    logger << "Calendar              \t" << Calendar::size() << "\t" << memsize  << endl;
+    report("Calendar", Calendar::size(), memsize);
     total += memsize;
 
     // Items
@@ -611,9 +659,9 @@ PyObject* printModelSize(PyObject* self, PyObject* args)
         memItemSuppliers += rs->getSize();
       }
     }
-    logger << "Item                  \t" << Item::size() << "\t" << memsize  << endl;
-    logger << "Item suppliers        \t" << countItemSuppliers << "\t" << memItemSuppliers << endl;
-    logger << "Item distributions    \t" << countItemDistributions << "\t" << memItemDistributions << endl;
+    report("Item", Item::size(), memsize);
+    report("Item suppliers", countItemSuppliers, memItemSuppliers);
+    report("Item distributions", countItemDistributions, memItemDistributions);
     total += memsize + memItemSuppliers;
 
     // Demands
@@ -629,8 +677,8 @@ PyObject* printModelSize(PyObject* self, PyObject* args)
         c_memsize += cstrnt->getSize();
       }
     }
-    logger << "Demand                \t" << Demand::size() << "\t" << memsize  << endl;
-    logger << "Constraints           \t" << c_count << "\t" << c_memsize  << endl;
+    report("Demand", Demand::size(), memsize);
+    report("Constraints", c_count, c_memsize);
     total += memsize + c_memsize;
 
     // Operationplans
@@ -645,17 +693,17 @@ PyObject* printModelSize(PyObject* self, PyObject* args)
       countflowplans += j->sizeFlowPlans();
     }
     total += memsize;
-    logger << "OperationPlan         \t" << count << "\t" << memsize << endl;
+    report("OperationPlan", count, memsize);
 
     // Flowplans
     memsize = countflowplans * sizeof(FlowPlan);
     total +=  memsize;
-    logger << "OperationPlan material\t" << countflowplans << "\t" << memsize << endl;
+    report("OperationPlan material", countflowplans, memsize);
 
     // Loadplans
     memsize = countloadplans * sizeof(LoadPlan);
     total +=  memsize;
-    logger << "OperationPlan resource\t" << countloadplans << "\t" << memsize << endl;
+    report("OperationPlan resource", countloadplans, memsize);
 
     // Problems
     memsize = count = 0;
@@ -666,10 +714,11 @@ PyObject* printModelSize(PyObject* self, PyObject* args)
       memsize += pr->getSize();
     }
     total += memsize;
-    logger << "Problem               \t" << count << "\t" << memsize << endl;
+    report("Problem", count, memsize);
 
     // TOTAL
-    logger << "Total                 \t\t" << total << endl << endl;
+    if (print)
+      logger << "Total                 \t\t" << total << endl << endl;
   }
   catch (...)
   {
@@ -678,7 +727,23 @@ PyObject* printModelSize(PyObject* self, PyObject* args)
     return nullptr;
   }
   Py_END_ALLOW_THREADS   // Reclaim Python interpreter
-  return Py_BuildValue("");
+
+  // Return the counts as a dictionary
+  PyObject* result = PyDict_New();
+  for (auto & i : sizes)
+  {
+    PyObject* val = Py_BuildValue(
+      "{s:K,s:K}",
+      "count", static_cast<unsigned long long>(i.second.first),
+      "memory", static_cast<unsigned long long>(i.second.second)
+      );
+    PyDict_SetItemString(result, i.first.c_str(), val);
+    Py_DECREF(val);
+  }
+  PyObject* val = Py_BuildValue("{s:K}", "memory", static_cast<unsigned long long>(total));
+  PyDict_SetItemString(result, "Total", val);
+  Py_DECREF(val);
+  return result;
 }
 
 } // end namespace
@@ -107,7 +107,7 @@ void LibraryModel::initialize()
 
   // Register new methods in Python
   PythonInterpreter::registerGlobalMethod(
-    "printsize", printModelSize, METH_NOARGS,
+    "printsize", printModelSize, METH_VARARGS,
     "Print information about the memory consumption.");
   PythonInterpreter::registerGlobalMethod(
     "erase", eraseModel, METH_VARARGS,
@@ -36,6 +36,7 @@ void SolverMRP::solve(const Buffer* b, void* v)
 {
   // Call the user exit
   SolverMRPdata* data = static_cast<SolverMRPdata*>(v);
+  ++data->counters.buffers;
   if (userexit_buffer) userexit_buffer.call(b, PythonData(data->constrainedPlanning));
 
   // Verify the iteration limit isn't exceeded.
@@ -622,6 +623,7 @@ void SolverMRP::solveSafetyStock(const Buffer* b, void* v)
 void SolverMRP::solve(const BufferInfinite* b, void* v)
 {
   SolverMRPdata* data = static_cast<SolverMRPdata*>(v);
+  ++data->counters.buffers;
 
   // Call the user exit
   if (userexit_buffer) userexit_buffer.call(b, PythonData(data->constrainedPlanning));
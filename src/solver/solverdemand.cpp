@@ -37,6 +37,7 @@ void SolverMRP::solve(const Demand* l, void* v)
 	typedef list<pair<Location* , double > > SortedLocation;
 	// Set a bookmark at the current command
   SolverMRPdata* data = static_cast<SolverMRPdata*>(v);
+  ++data->counters.demands;
   CommandManager::Bookmark* topcommand = data->setBookmark();
 
   // Create a state stack
@@ -304,6 +305,7 @@ void SolverMRP::solve(const Demand* l, void* v)
 					  // Print a warning and simply try one day later.
 					  if (loglevel > 0)
 						  logger << "Warning: Demand '" << l << "': Lazy retry" << endl;
+					  ++data->counters.lazydelays;
 					  plan_date = copy_plan_date + data->getSolver()->getLazyDelay();
 				  }
 				  else
@@ -492,6 +492,7 @@ void SolverMRP::solve(const Operation* oper, void* v)
   assert(oper);
 
   SolverMRPdata* data = static_cast<SolverMRPdata*>(v);
+  ++data->counters.operations;
   OperationPlan *z;
 
   // Call the user exit
@@ -609,6 +610,7 @@ void SolverMRP::solve(const Operation* oper, void* v)
     if (data->getSolver()->getLogLevel()>1)
       logger << indent(oper->getLevel()) << "   Applying lazy delay " << data->getSolver()->getLazyDelay() << endl;
     data->state->a_date = orig_q_date + data->getSolver()->getLazyDelay();
+    ++data->counters.lazydelays;
   }
   assert(data->state->a_qty >= 0);
 
@@ -632,7 +634,10 @@ void SolverMRP::solve(const OperationItemSupplier* o, void* v)
 {
   SolverMRPdata* data = static_cast<SolverMRPdata*>(v);
   if (v)
+  {
+    ++data->counters.operations;
     data->purchase_operations.insert(o);
+  }
 
 	// Manage global replenishment
   Item* item = o->getBuffer()->getItem();
@@ -679,6 +684,7 @@ void SolverMRP::solve(const OperationItemSupplier* o, void* v)
 void SolverMRP::solve(const OperationRouting* oper, void* v)
 {
   SolverMRPdata* data = static_cast<SolverMRPdata*>(v);
+  ++data->counters.operations;
 
   // Call the user exit
   if (userexit_operation) userexit_operation.call(oper, PythonData(data->constrainedPlanning));
@@ -857,6 +863,7 @@ void SolverMRP::solve(const OperationRouting* oper, void* v)
     // This situation is possible when capacity or material constraints of routing steps create
     // slack in the routing. The real constrained next date becomes very hard to estimate.
     delay = data->getSolver()->getLazyDelay();
+    ++data->counters.lazydelays;
     if (data->getSolver()->getLogLevel()>1)
       logger << indent(oper->getLevel()) << "   Applying lazy delay " << delay << " in routing" << endl;
     data->state->a_date = top_q_date + delay;
@@ -879,6 +886,7 @@ void SolverMRP::solve(const OperationRouting* oper, void* v)
 void SolverMRP::solve(const OperationAlternate* oper, void* v)
 {
   SolverMRPdata *data = static_cast<SolverMRPdata*>(v);
+  ++data->counters.operations;
   Date origQDate = data->state->q_date;
   double origQqty = data->state->q_qty;
   Buffer *buf = data->state->curBuffer;
@@ -968,6 +976,7 @@ void SolverMRP::solve(const OperationAlternate* oper, void* v)
       }
 
       // Establish the ask date
+      ++data->counters.alternates;
       ask_date = effectiveOnly ? origQDate : (*altIter)->getEffectiveEnd();
 
       // Find the flow into the requesting buffer. It may or may not exist, since
@@ -1314,6 +1323,7 @@ void SolverMRP::solve(const OperationAlternate* oper, void* v)
       logger << indent(oper->getLevel()) << "   Applying lazy delay " <<
         data->getSolver()->getLazyDelay() << " in alternate" << endl;
     data->state->a_date = origQDate + data->getSolver()->getLazyDelay();
+    ++data->counters.lazydelays;
   }
   assert(data->state->a_qty >= 0);
 
@@ -1340,6 +1350,7 @@ void SolverMRP::solve(const OperationAlternate* oper, void* v)
 void SolverMRP::solve(const OperationSplit* oper, void* v)
 {
   SolverMRPdata *data = static_cast<SolverMRPdata*>(v);
+  ++data->counters.operations;
   Date origQDate = data->state->q_date;
   double origQqty = data->state->q_qty;
   Buffer *buf = data->state->curBuffer;
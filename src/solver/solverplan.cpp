@@ -31,6 +31,8 @@ const Keyword SolverMRP::tag_allowsplits("allowsplits");
 const Keyword SolverMRP::tag_rotateresources("rotateresources");
 const Keyword SolverMRP::tag_planSafetyStockFirst("plansafetystockfirst");
 const Keyword SolverMRP::tag_iterationmax("iterationmax");
+const Keyword SolverMRP::tag_slowdemands("slowdemands");
+const Keyword SolverMRP::tag_cancelled("cancelled");
 
 
 void LibrarySolver::initialize()
@@ -71,6 +73,10 @@ int SolverMRP::initialize()
   x.addMethod("solve", solve, METH_NOARGS, "run the solver");
   x.addMethod("commit", commit, METH_NOARGS, "commit the plan changes");
   x.addMethod("rollback", rollback, METH_NOARGS, "rollback the plan changes");
+  x.addMethod("cancel", cancelPython, METH_NOARGS, "stop the running solver");
+  x.addMethod("progress", getProgressPython, METH_NOARGS, "return the progress of the running solver");
+  x.addMethod("counters", getCountersPython, METH_NOARGS, "return the profiling counters of the last solver run");
+  x.addMethod("slowestdemands", getSlowDemandsPython, METH_NOARGS, "return the slowest demands of the last solver run");
   const_cast<MetaClass*>(metadata)->pythonClass = x.type_object();
   return x.typeReady();
 }
@@ -136,10 +142,26 @@ void SolverMRP::SolverMRPdata::commit()
   if (!demands || !solver)
     throw LogicException("Missing demands or solver.");
 
+  // Skip the cluster when the solver is cancelled
+  if (solver->getCancelled())
+  {
+    demands->clear();
+    return;
+  }
+  solver->progress_cluster_size = demands->size();
+
   // Message
   if (solver->getLogLevel()>0)
     logger << "Start solving cluster " << cluster << " at " << Date::now() << endl;
 
+  // Initialize the profiling counters
+  auto starttime = chrono::steady_clock::now();
+  unsigned long start_inserts =
+    TimeLine<FlowPlan>::countInserts + TimeLine<LoadPlan>::countInserts;
+  unsigned long start_erases =
+    TimeLine<FlowPlan>::countErases + TimeLine<LoadPlan>::countErases;
+  unsigned long start_rollbacks = getRollbackCount();
+
   // Solve the planning problem
   try
   {
@@ -161,13 +183,16 @@ void SolverMRP::SolverMRPdata::commit()
     safety_stock_planning = false;
     constrainedPlanning = (solver->getPlanType() == 1);
     for (deque<Demand*>::const_iterator i = demands->begin();
-        i != demands->end(); ++i)
+        i != demands->end() && !solver->getCancelled(); ++i)
     {
       iteration_count = 0;
       try
       {
         // Plan the demand
-        (*i)->solve(*solver, this);
+        if (solver->getSlowDemands())
+          solveAndSample(*i);
+        else
+          (*i)->solve(*solver, this);
       }
       catch (...)
       {
@@ -179,6 +204,7 @@ void SolverMRP::SolverMRPdata::commit()
         catch (const exception& e) {logger << "  " << e.what() << endl;}
         catch (...) {logger << "  Unknown type" << endl;}
       }
+      ++solver->progress_demands;
     }
 
     // Clean the list of demands of this cluster
@@ -217,7 +243,7 @@ void SolverMRP::SolverMRPdata::commit()
     purchase_operations.clear();
 
     // Solve for safety stock in buffers.
-    if (!solver->getPlanSafetyStockFirst())
+    if (!solver->getPlanSafetyStockFirst() && !solver->getCancelled())
       solveSafetyStock(solver);
   }
   catch (...)
@@ -244,9 +270,77 @@ void SolverMRP::SolverMRPdata::commit()
     demands->clear();
   }
 
+  // Store the profiling counters in the solver
+  counters.timeline_inserts +=
+    TimeLine<FlowPlan>::countInserts + TimeLine<LoadPlan>::countInserts - start_inserts;
+  counters.timeline_erases +=
+    TimeLine<FlowPlan>::countErases + TimeLine<LoadPlan>::countErases - start_erases;
+  counters.rollbacks += getRollbackCount() - start_rollbacks;
+  counters.time += chrono::duration<double>(chrono::steady_clock::now() - starttime).count();
+  solver->addCounters(cluster, counters);
+  if (!slowdemands.empty())
+    solver->addSlowDemands(slowdemands);
+  ++solver->progress_clusters;
+
   // Message
   if (solver->getLogLevel()>0)
+  {
     logger << "End solving cluster " << cluster << " at " << Date::now() << endl;
+    if (solver->getLogLevel()>1)
+      counters.log("  Cluster " + to_string(cluster) + " solver counters");
+  }
+}
+
+
+void SolverMRP::SolverMRPdata::solveAndSample(Demand* d)
+{
+  // Take a snapshot of the counters
+  DemandSample sample;
+  sample.demand = d;
+  unsigned long start_buffers = counters.buffers;
+  unsigned long start_created = CommandCreateOperationPlan::countCreated;
+  unsigned long start_rolledback = CommandCreateOperationPlan::countRolledBack;
+  auto starttime = chrono::steady_clock::now();
+
+  // Plan the demand
+  exception_ptr error;
+  try
+  {
+    d->solve(*sol, this);
+    Problem* p = d->getConstraints().top();
+    if (p)
+      sample.constraint = p->getDescription();
+  }
+  catch (...)
+  {
+    error = current_exception();
+    try {throw;}
+    catch (const exception& e) {sample.constraint = string("Error: ") + e.what();}
+    catch (...) {sample.constraint = "Error: unknown type";}
+  }
+
+  // Measure the effort
+  sample.time = chrono::duration<double>(chrono::steady_clock::now() - starttime).count();
+  sample.iterations = counters.buffers - start_buffers;
+  sample.created = CommandCreateOperationPlan::countCreated - start_created;
+  sample.rolledback = CommandCreateOperationPlan::countRolledBack - start_rolledback;
+
+  // Keep only the slowest demands in a min-heap
+  if (slowdemands.size() < sol->getSlowDemands())
+  {
+    slowdemands.push_back(sample);
+    push_heap(slowdemands.begin(), slowdemands.end(), greater<DemandSample>());
+  }
+  else if (sample.time > slowdemands.front().time)
+  {
+    pop_heap(slowdemands.begin(), slowdemands.end(), greater<DemandSample>());
+    slowdemands.back() = sample;
+    push_heap(slowdemands.begin(), slowdemands.end(), greater<DemandSample>());
+  }
+
+  // Errors are reported by the caller
+  if (error)
+    rethrow_exception(error);
 }
 
 
@@ -307,6 +401,13 @@ void SolverMRP::update_user_exits()
 
 void SolverMRP::solve(void *v)
 {
+  // Reset the profiling counters
+  cancelled = false;
+  counters_cluster.clear();
+  slowdemand_samples.clear();
+  counters_phases.clear();
+  auto phasetime = chrono::steady_clock::now();
+
   // Configure user exits
   update_user_exits();
 
@@ -331,6 +432,22 @@ void SolverMRP::solve(void *v)
           demands_per_cluster[0].push_back(&*i);
   }
 
+  // Initialize the progress counters
+  progress_clusters = 0;
+  progress_clusters_total = cl;
+  progress_demands = 0;
+  progress_cluster_size = 0;
+  unsigned long cnt = 0;
+  for (auto & d : demands_per_cluster)
+    cnt += d.size();
+  progress_demands_total = cnt;
+
+  auto now = chrono::steady_clock::now();
+  counters_phases.push_back(make_pair(
+    "classify demands", chrono::duration<double>(now - phasetime).count()
+    ));
+  phasetime = now;
+
   // Delete of operationplans
   // This deletion is not multi-threaded... But on the other hand we need to
   // loop through the operations only once
@@ -340,6 +457,11 @@ void SolverMRP::solve(void *v)
     for (Operation::iterator e=Operation::begin(); e!=Operation::end(); ++e)
       if (cluster == -1 || e->getCluster() == cluster)
         e->deleteOperationPlans();
+    now = chrono::steady_clock::now();
+    counters_phases.push_back(make_pair(
+      "erase previous plan", chrono::duration<double>(now - phasetime).count()
+      ));
+    phasetime = now;
   }
 
   // Solve in parallel threads.
@@ -359,12 +481,100 @@ void SolverMRP::solve(void *v)
 
   // Run the planning command threads and wait for them to exit
   threads.execute();
+  if (cancelled)
+    logger << "Solver cancelled at " << Date::now() << endl;
+  now = chrono::steady_clock::now();
+  counters_phases.push_back(make_pair(
+    "solve clusters", chrono::duration<double>(now - phasetime).count()
+    ));
+  phasetime = now;
 
   // @todo Check the resource setups that were broken - needs to be removed
   for (Resource::iterator res = Resource::begin(); res != Resource::end(); ++res)
     if (res->getSetupMatrix()
       && (cluster == -1 || res->getCluster() == cluster))
         res->updateSetups();
+  counters_phases.push_back(make_pair(
+    "update setups",
+    chrono::duration<double>(chrono::steady_clock::now() - phasetime).count()
+    ));
+
+  // Report the profiling counters
+  if (getLogLevel()>0)
+  {
+    getCounters().log("Solver counters");
+    for (auto & p : counters_phases)
+      logger << "  Phase '" << p.first << "': " << p.second << "s" << endl;
+    if (!slowdemand_samples.empty())
+    {
+      logger << "Slowest demands:" << endl;
+      for (auto & d : slowdemand_samples)
+        logger << "  " << d.demand << ": " << d.time << "s, "
+          << d.iterations << " iterations, "
+          << d.created << " operationplans created, "
+          << d.rolledback << " rolled back"
+          << (d.constraint.empty() ? "" : ", ") << d.constraint << endl;
+    }
+  }
+}
+
+
+void SolverMRP::addSlowDemands(vector<DemandSample>& samples)
+{
+  lock_guard<mutex> l(counters_lock);
+  slowdemand_samples.insert(
+    slowdemand_samples.end(), samples.begin(), samples.end()
+    );
+  sort(
+    slowdemand_samples.begin(), slowdemand_samples.end(),
+    greater<DemandSample>()
+    );
+  if (slowdemand_samples.size() > slowdemands)
+    slowdemand_samples.resize(slowdemands);
+  samples.clear();
+}
+
+
+SolverMRP::Counters SolverMRP::getCounters() const
+{
+  Counters total;
+  for (auto & c : counters_cluster)
+    total += c.second;
+  return total;
+}
+
+
+void SolverMRP::Counters::log(const string& title) const
+{
+  logger << title << ":" << endl
+    << "    demand solves: " << demands << endl
+    << "    buffer solves: " << buffers << endl
+    << "    operation solves: " << operations << endl
+    << "    resource solves: " << resources << endl
+    << "    alternate evaluations: " << alternates << endl
+    << "    rollbacks: " << rollbacks << endl
+    << "    lazy delay retries: " << lazydelays << endl
+    << "    timeline inserts: " << timeline_inserts << endl
+    << "    timeline erases: " << timeline_erases << endl
+    << "    time: " << time << "s" << endl;
+}
+
+
+PyObject* SolverMRP::Counters::toPython() const
+{
+  return Py_BuildValue(
+    "{s:k,s:k,s:k,s:k,s:k,s:k,s:k,s:k,s:k,s:d}",
+    "demands", demands,
+    "buffers", buffers,
+    "operations", operations,
+    "resources", resources,
+    "alternates", alternates,
+    "rollbacks", rollbacks,
+    "lazydelays", lazydelays,
+    "timeline_inserts", timeline_inserts,
+    "timeline_erases", timeline_erases,
+    "time", time
+    );
 }
 
 
@@ -445,4 +655,106 @@ PyObject* SolverMRP::rollback(PyObject *self, PyObject *args)
   return Py_BuildValue("");
 }
 
+
+PyObject* SolverMRP::cancelPython(PyObject *self, PyObject *args)
+{
+  // Only an atomic flag is set: there is no need to release the Python
+  // interpreter, and the method can be called while the solver is running.
+  static_cast<SolverMRP*>(self)->cancel();
+  return Py_BuildValue("");
+}
+
+
+PyObject* SolverMRP::getProgressPython(PyObject *self, PyObject *args)
+{
+  SolverMRP* sol = static_cast<SolverMRP*>(self);
+  return Py_BuildValue(
+    "{s:k,s:k,s:k,s:k,s:k}",
+    "clusters", sol->progress_clusters.load(),
+    "clusters_total", sol->progress_clusters_total.load(),
+    "demands", sol->progress_demands.load(),
+    "demands_total", sol->progress_demands_total.load(),
+    "cluster_size", sol->progress_cluster_size.load()
+    );
+}
+
+
+PyObject* SolverMRP::getCountersPython(PyObject *self, PyObject *args)
+{
+  try
+  {
+    SolverMRP* sol = static_cast<SolverMRP*>(self);
+
+    // Totals
+    PyObject* result = sol->getCounters().toPython();
+    if (!result) return nullptr;
+
+    // Counters per cluster
+    PyObject* clusters = PyDict_New();
+    for (auto & c : sol->counters_cluster)
+    {
+      PyObject* key = PyLong_FromLong(c.first);
+      PyObject* val = c.second.toPython();
+      PyDict_SetItem(clusters, key, val);
+      Py_DECREF(key);
+      Py_DECREF(val);
+    }
+    PyDict_SetItemString(result, "clusters", clusters);
+    Py_DECREF(clusters);
+
+    // Time per solver phase
+    PyObject* phases = PyDict_New();
+    for (auto & p : sol->counters_phases)
+    {
+      PyObject* val = PyFloat_FromDouble(p.second);
+      PyDict_SetItemString(phases, p.first.c_str(), val);
+      Py_DECREF(val);
+    }
+    PyDict_SetItemString(result, "phases", phases);
+    Py_DECREF(phases);
+
+    // Counters of the incremental planning commands
+    Counters cmds = sol->commands.counters;
+    cmds.rollbacks = sol->commands.getRollbackCount();
+    PyObject* incremental = cmds.toPython();
+    PyDict_SetItemString(result, "incremental", incremental);
+    Py_DECREF(incremental);
+    return result;
+  }
+  catch(...)
+  {
+    PythonType::evalException();
+    return nullptr;
+  }
+}
+
+PyObject* SolverMRP::getSlowDemandsPython(PyObject *self, PyObject *args)
+{
+  try
+  {
+    SolverMRP* sol = static_cast<SolverMRP*>(self);
+    PyObject* result = PyList_New(0);
+    for (auto & d : sol->getSlowDemandSamples())
+    {
+      PyObject* sample = Py_BuildValue(
+        "{s:O,s:d,s:k,s:k,s:k,s:s}",
+        "demand", static_cast<PyObject*>(const_cast<Demand*>(d.demand)),
+        "time", d.time,
+        "iterations", d.iterations,
+        "created", d.created,
+        "rolledback", d.rolledback,
+        "constraint", d.constraint.c_str()
+        );
+      PyList_Append(result, sample);
+      Py_DECREF(sample);
+    }
+    return result;
+  }
+  catch(...)
+  {
+    PythonType::evalException();
+    return nullptr;
+  }
+}
+
 } // end namespace
@@ -28,6 +28,7 @@ namespace frepple
 void SolverMRP::solve(const BufferProcure* b, void* v)
 {
   SolverMRPdata* data = static_cast<SolverMRPdata*>(v);
+  ++data->counters.buffers;
   bool safetystock = (data->state->q_qty == -1.0);
 
   // TODO create a more performant procurement solver. Instead of creating a list of operationplans
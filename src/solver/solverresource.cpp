@@ -29,6 +29,7 @@ namespace frepple
 void SolverMRP::solve(const Resource* res, void* v)
 {
   SolverMRPdata* data = static_cast<SolverMRPdata*>(v);
+  ++data->counters.resources;
 
   // Call the user exit
   if (userexit_resource) userexit_resource.call(res, PythonData(data->constrainedPlanning));
@@ -473,6 +474,7 @@ void SolverMRP::solve(const Resource* res, void* v)
 void SolverMRP::solve(const ResourceInfinite* res, void* v)
 {
   SolverMRPdata* data = static_cast<SolverMRPdata*>(v);
+  ++data->counters.resources;
 
   // Call the user exit
   if (userexit_resource) userexit_resource.call(res, PythonData(data->constrainedPlanning));
@@ -501,6 +503,7 @@ void SolverMRP::solve(const ResourceInfinite* res, void* v)
 void SolverMRP::solve(const ResourceBuckets* res, void* v)
 {
   SolverMRPdata* data = static_cast<SolverMRPdata*>(v);
+  ++data->counters.resources;
 
   // Call the user exit
   if (userexit_resource) userexit_resource.call(res, PythonData(data->constrainedPlanning));
@@ -179,6 +179,7 @@ void CommandManager::rollback(CommandManager::Bookmark* b)
     throw LogicException("Can't rollback nullptr bookmark");
   if (b == &firstBookmark)
     throw LogicException("Can't rollback default bookmark");
+  ++countRollbacks;
 
   // Remove all later child bookmarks
   Bookmark* i = lastBookmark;
@@ -227,6 +228,7 @@ void CommandManager::commit()
 
 void CommandManager::rollback()
 {
+  ++countRollbacks;
   for (Bookmark* i = lastBookmark; i != &firstBookmark;)
   {
     i->rollback();
@@ -22,6 +22,7 @@
 #include "frepple/utils.h"
 #include "frepple/xml.h"
 #include <sys/stat.h>
+#include <chrono>
 
 /* Uncomment the next line to create a lot of debugging messages during
  * the parsing of XML-data. */
@@ -129,6 +130,7 @@ void XMLInput::startElement(const XMLCh* const uri,
   const xercesc::Attributes& atts)
 {
   string ename_utf8 = transcodeUTF8(ename);
+  ++countElements;
 
   // Currently ignoring all input?
   if (ignore)
@@ -698,11 +700,46 @@ void XMLInput::endElement(const XMLCh* const uri,
     else logger << "Continuing after data error: " << e.what() << endl;
   }
 
+  // Release the data of a top level object in streaming mode
+  if (objectindex == 1)
+  {
+    ++countObjects;
+    if (batchsize)
+      releaseTransientData(objects[objectindex].start, dataindex);
+  }
+
   // Update indexes for data and object
   dataindex = objects[objectindex--].start - 1;
 }
 
 
+void XMLInput::releaseTransientData(int from, int to)
+{
+  // Track the peak memory held in the data stack
+  size_t mem = 0;
+  for (int idx = 0; idx <= to; ++idx)
+    mem += data[idx].value.getMemory() + data[idx].name.capacity();
+  if (mem > peakTransient)
+    peakTransient = mem;
+
+  // Free the buffers of the fields of the object
+  for (int idx = from; idx <= to; ++idx)
+  {
+    data[idx].value.release();
+    string().swap(data[idx].name);
+  }
+
+  // Commit the changes once a complete batch has been read
+  if (countObjects % batchsize == 0)
+  {
+    if (getCommandManager())
+      getCommandManager()->commit();
+    logger << "Processed " << countObjects << " objects and "
+      << countElements << " XML elements" << endl;
+  }
+}
+
+
 void XMLInput::characters(const XMLCh *const c, const XMLSize_t n)
 {
   if (reading && dataindex >= 0)
@@ -754,6 +791,7 @@ XMLInput::~XMLInput()
 
 void XMLInput::parse(xercesc::InputSource &in, Object *pRoot, bool validate)
 {
+  chrono::steady_clock::time_point start = chrono::steady_clock::now();
   try
   {
     // Create a Xerces parser
@@ -818,6 +856,25 @@ void XMLInput::parse(xercesc::InputSource &in, Object *pRoot, bool validate)
 
     // Parse the input
     parser->parse(in);
+
+    if (batchsize && pRoot)
+    {
+      // Commit the last incomplete batch
+      if (getCommandManager())
+        getCommandManager()->commit();
+
+      // Report the throughput of the streaming mode
+      double secs = chrono::duration<double>(
+        chrono::steady_clock::now() - start
+        ).count();
+      logger << "Streamed " << countElements << " XML elements and "
+        << countObjects << " objects in " << secs << " seconds";
+      if (secs > 0)
+        logger << " (" << static_cast<unsigned long>(countElements / secs)
+          << " elements/s)";
+      logger << ", peak transient parser memory " << peakTransient
+        << " bytes" << endl;
+    }
   }
   catch (const xercesc::XMLException& toCatch)
   {
@@ -850,23 +907,34 @@ void XMLInput::parse(xercesc::InputSource &in, Object *pRoot, bool validate)
 
 void XMLSerializer::escape(const string& x)
 {
-  for (const char* p = x.c_str(); *p; ++p)
+  const char* start = x.c_str();
+  const char* p = start;
+  for (; *p; ++p)
   {
+    const char* replacement;
     switch (*p)
     {
-      case '&': *m_fp << "&amp;"; break;
-      case '<': *m_fp << "&lt;"; break;
-      case '>': *m_fp << "&gt;"; break;
-      case '"': *m_fp << "&quot;"; break;
-      case '\'': *m_fp << "&apos;"; break;
-      default: *m_fp << *p;
+      case '&': replacement = "&amp;"; break;
+      case '<': replacement = "&lt;"; break;
+      case '>': replacement = "&gt;"; break;
+      case '"': replacement = "&quot;"; break;
+      case '\'': replacement = "&apos;"; break;
+      default: continue;
     }
+    // Write the block of regular characters and the escaped character
+    if (p > start)
+      m_fp->write(start, p - start);
+    *m_fp << replacement;
+    start = p + 1;
   }
+  if (p > start)
+    m_fp->write(start, p - start);
 }
 
 
 void XMLSerializer::incIndent()
 {
+  if (compact) return;
   indentstring[m_nIndent++] = '\t';
   if (m_nIndent > 40) m_nIndent = 40;
   indentstring[m_nIndent] = '\0';
@@ -875,6 +943,7 @@ void XMLSerializer::incIndent()
 
 void XMLSerializer::decIndent()
 {
+  if (compact) return;
   if (--m_nIndent < 0) m_nIndent = 0;
   indentstring[m_nIndent] = '\0';
 }
@@ -954,6 +1023,308 @@ void XMLSerializer::writeElementWithHeader(const Keyword& tag, const Object* obj
 }
 
 
+/** @brief A chunk of an XML document that is serialized in a worker thread.
+  * @see XMLSerializer::writeElementWithHeaderParallel
+  */
+struct XMLSerializerChunk
+{
+  /** Field to serialize. */
+  const MetaFieldBase* field;
+
+  /** Object owning the field. */
+  const Object* object;
+
+  /** Output of the chunk. */
+  XMLSerializerString output;
+
+  /** Error message when serializing the chunk failed. */
+  string error;
+};
+
+
+void XMLSerializer::writeChunk(void* args)
+{
+  XMLSerializerChunk* chunk = static_cast<XMLSerializerChunk*>(args);
+  try
+  {
+    chunk->output.pushCurrentObject(const_cast<Object*>(chunk->object));
+    chunk->field->writeField(chunk->output);
+  }
+  catch (const exception& e)
+  {
+    chunk->error = e.what();
+  }
+  catch (...)
+  {
+    chunk->error = "Unknown exception";
+  }
+}
+
+
+void XMLSerializer::writeElementWithHeaderParallel(const Keyword& tag, const Object* object)
+{
+  // Root object can't be null...
+  if (!object)
+    throw RuntimeException("Can't accept a nullptr object as XML root");
+
+  // There should not be any saved objects yet
+  if (numObjects > 0)
+    throw LogicException("Can't have multiple headers in a document");
+  assert(!parentObject);
+  assert(!currentObject);
+
+  // Write the first line for the xml document
+  writeString(getHeaderStart());
+
+  // Write the head of the root object
+  currentObject = object;
+  ++numObjects;
+  BeginObject(tag, getHeaderAtts());
+
+  // Select the fields to write, in the same way as Object::writeElement
+  unsigned int mask;
+  switch (getContentType())
+  {
+    case MANDATORY: mask = MANDATORY; break;
+    case BASE: mask = BASE + MANDATORY; break;
+    case DETAIL: mask = DETAIL + MANDATORY; break;
+    case PLAN: mask = BASE + PLAN + MANDATORY; break;
+    default: throw LogicException("Unknown serialization mode");
+  }
+  vector<const MetaFieldBase*> fields;
+  const MetaClass& meta = object->getType();
+  if (meta.category)
+    for (MetaClass::fieldlist::const_iterator i = meta.category->getFields().begin(); i != meta.category->getFields().end(); ++i)
+      if ((*i)->getFlag(mask))
+        fields.push_back(*i);
+  for (MetaClass::fieldlist::const_iterator i = meta.getFields().begin(); i != meta.getFields().end(); ++i)
+    if ((*i)->getFlag(mask))
+      fields.push_back(*i);
+
+  // Serialize all chunks in parallel
+  vector<XMLSerializerChunk*> chunks;
+  for (vector<const MetaFieldBase*>::iterator f = fields.begin(); f != fields.end(); ++f)
+  {
+    chunks.push_back(new XMLSerializerChunk());
+    chunks.back()->field = *f;
+  }
+  ThreadGroup threads;
+  vector<XMLSerializerChunk*>::iterator c;
+  for (c = chunks.begin(); c != chunks.end(); ++c)
+  {
+    (*c)->object = object;
+    (*c)->output.setContentType(getContentType());
+    (*c)->output.setCompact(compact);
+    (*c)->output.setWriteHidden(getWriteHidden());
+    for (short i = 0; i < m_nIndent; ++i)
+      static_cast<XMLSerializer&>((*c)->output).incIndent();
+    threads.add(writeChunk, *c);
+  }
+  threads.execute();
+
+  // Concatenate the chunks in the output
+  string error;
+  for (c = chunks.begin(); c != chunks.end(); ++c)
+  {
+    if (!(*c)->error.empty())
+      error = (*c)->error;
+    else
+    {
+      *m_fp << (*c)->output.getData();
+      numObjects += (*c)->output.countObjects();
+    }
+    delete *c;
+  }
+  if (!error.empty())
+    throw RuntimeException("Error during XML serialization: " + error);
+
+  // Write the tail of the root object
+  object->writeProperties(*this);
+  EndObject(tag);
+
+  // Adjust current and parent object pointer
+  currentObject = nullptr;
+  parentObject = nullptr;
+}
+
+
+XMLSerializerFile::XMLSerializerFile(const string& chFilename)
+  : compressedstream(nullptr)
+{
+  size_t len = chFilename.size();
+  if (len > 3 && !chFilename.compare(len - 3, 3, ".gz"))
+  {
+  #ifdef FREPPLE_ZLIB
+    compressed = new GzipOutputBuffer(chFilename);
+  #else
+    throw RuntimeException(
+      "No support for compressed output file '" + chFilename + "'"
+      );
+  #endif
+  }
+  else if (len > 4 && !chFilename.compare(len - 4, 4, ".zst"))
+  {
+  #ifdef FREPPLE_ZSTD
+    compressed = new ZstdOutputBuffer(chFilename);
+  #else
+    throw RuntimeException(
+      "No support for compressed output file '" + chFilename + "'"
+      );
+  #endif
+  }
+
+  if (compressed)
+  {
+    compressedstream.rdbuf(compressed);
+    setOutput(compressedstream);
+  }
+  else
+  {
+    // A big buffer reduces the number of write calls to the file system.
+    // The buffer needs to be set before opening the file.
+    buffer = new char[buffersize];
+    of.rdbuf()->pubsetbuf(buffer, buffersize);
+    of.open(chFilename.c_str(), ios::out);
+    if (!of)
+    {
+      delete[] buffer;
+      throw RuntimeException("Could not open output file");
+    }
+    setOutput(of);
+  }
+}
+
+
+XMLSerializerFile::~XMLSerializerFile()
+{
+  if (compressed)
+  {
+    compressedstream.flush();
+    delete compressed;
+  }
+  else
+  {
+    of.close();
+    delete[] buffer;
+  }
+}
+
+
+#ifdef FREPPLE_ZLIB
+GzipOutputBuffer::GzipOutputBuffer(const string& f)
+{
+  fd = gzopen(f.c_str(), "wb");
+  if (!fd)
+    throw RuntimeException("Could not open output file");
+  setp(buffer, buffer + sizeof(buffer) - 1);
+}
+
+
+GzipOutputBuffer::~GzipOutputBuffer()
+{
+  flushBuffer();
+  gzclose(fd);
+}
+
+
+int GzipOutputBuffer::overflow(int c)
+{
+  if (c != EOF)
+  {
+    // The buffer has room for one more character
+    *pptr() = c;
+    pbump(1);
+  }
+  return flushBuffer() ? traits_type::not_eof(c) : EOF;
+}
+
+
+int GzipOutputBuffer::sync()
+{
+  return flushBuffer() ? 0 : -1;
+}
+
+
+bool GzipOutputBuffer::flushBuffer()
+{
+  int n = static_cast<int>(pptr() - pbase());
+  if (n && gzwrite(fd, pbase(), n) != n)
+    return false;
+  pbump(-n);
+  return true;
+}
+#endif
+
+
+#ifdef FREPPLE_ZSTD
+ZstdOutputBuffer::ZstdOutputBuffer(const string& f)
+{
+  fd = fopen(f.c_str(), "wb");
+  if (!fd)
+    throw RuntimeException("Could not open output file");
+  cstream = ZSTD_createCStream();
+  ZSTD_initCStream(cstream, 3);
+  outsize = ZSTD_CStreamOutSize();
+  outbuffer = new char[outsize];
+  setp(buffer, buffer + sizeof(buffer) - 1);
+}
+
+
+ZstdOutputBuffer::~ZstdOutputBuffer()
+{
+  flushBuffer();
+
+  // Write the end of the frame
+  size_t remaining;
+  do
+  {
+    ZSTD_outBuffer out = {outbuffer, outsize, 0};
+    remaining = ZSTD_endStream(cstream, &out);
+    fwrite(outbuffer, 1, out.pos, fd);
+  }
+  while (remaining && !ZSTD_isError(remaining));
+
+  ZSTD_freeCStream(cstream);
+  fclose(fd);
+  delete[] outbuffer;
+}
+
+
+int ZstdOutputBuffer::overflow(int c)
+{
+  if (c != EOF)
+  {
+    // The buffer has room for one more character
+    *pptr() = c;
+    pbump(1);
+  }
+  return flushBuffer() ? traits_type::not_eof(c) : EOF;
+}
+
+
+int ZstdOutputBuffer::sync()
+{
+  return flushBuffer() ? 0 : -1;
+}
+
+
+bool ZstdOutputBuffer::flushBuffer()
+{
+  int n = static_cast<int>(pptr() - pbase());
+  ZSTD_inBuffer in = {pbase(), static_cast<size_t>(n), 0};
+  while (in.pos < in.size)
+  {
+    ZSTD_outBuffer out = {outbuffer, outsize, 0};
+    size_t r = ZSTD_compressStream(cstream, &out, &in);
+    if (ZSTD_isError(r) || fwrite(outbuffer, 1, out.pos, fd) != out.pos)
+      return false;
+  }
+  pbump(-n);
+  return true;
+}
+#endif
+
+
 const XMLData* XMLDataValueDict::get(const Keyword& key) const
 {
   for (int i = strt; i <= nd; ++i)
@@ -1136,7 +1507,9 @@ void XMLInputFile::parse(Object *pRoot, bool validate)
     do
     {
       f = filename + '/' + dir_entry_p.cFileName;
-      XMLInputFile(f.c_str()).parse(pRoot);
+      XMLInputFile nested(f.c_str());
+      nested.setBatchSize(getBatchSize());
+      nested.parse(pRoot);
     }
     while (FindNextFile(h, &dir_entry_p));
     FindClose(h);
@@ -1146,10 +1519,13 @@ void XMLInputFile::parse(Object *pRoot, bool validate)
     while (nullptr != (dir_entry_p = readdir(dir_p)))
     {
       int n = NAMLEN(dir_entry_p);
-      if (n > 4 && !strcmp(".xml", dir_entry_p->d_name + n - 4))
+      if ((n > 4 && !strcmp(".xml", dir_entry_p->d_name + n - 4))
+        || (n > 7 && !strcmp(".xml.gz", dir_entry_p->d_name + n - 7)))
       {
         string f = filename + '/' + dir_entry_p->d_name;
-        XMLInputFile(f.c_str()).parse(pRoot, validate);
+        XMLInputFile nested(f.c_str());
+        nested.setBatchSize(getBatchSize());
+        nested.parse(pRoot, validate);
       }
     }
     closedir(dir_p);
@@ -1157,6 +1533,19 @@ void XMLInputFile::parse(Object *pRoot, bool validate)
     throw RuntimeException("Can't process a directory on your platform");
   #endif
   }
+  else if (filename.size() > 3
+    && !filename.compare(filename.size() - 3, 3, ".gz"))
+  {
+    // Compressed file
+  #ifdef FREPPLE_ZLIB
+    GzipInputSource in(filename);
+    XMLInput::parse(in, pRoot, validate);
+  #else
+    throw RuntimeException(
+      "No support for compressed input file '" + filename + "'"
+      );
+  #endif
+  }
   else
   {
     // Normal file
@@ -1168,5 +1557,38 @@ void XMLInputFile::parse(Object *pRoot, bool validate)
   }
 }
 
+
+#ifdef FREPPLE_ZLIB
+GzipInputStream::GzipInputStream(const string& f)
+{
+  fd = gzopen(f.c_str(), "rb");
+  if (!fd)
+    throw RuntimeException("Couldn't open input file '" + f + "'");
+  // Decompress in bigger chunks than the default 8K
+  gzbuffer(fd, 128*1024);
+}
+
+
+GzipInputStream::~GzipInputStream()
+{
+  if (fd) gzclose(fd);
+}
+
+
+XMLFilePos GzipInputStream::curPos() const
+{
+  return gztell(fd);
+}
+
+
+XMLSize_t GzipInputStream::readBytes(XMLByte* const toFill, const XMLSize_t maxToRead)
+{
+  int n = gzread(fd, toFill, static_cast<unsigned int>(maxToRead));
+  if (n < 0)
+    throw RuntimeException("Error decompressing input file");
+  return n;
+}
+#endif
+
 } // end namespace
 } // end namespace
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2016 by frePPLe bvba
+#
+# This library is free software; you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero
+# General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#
+# This script compares the run time of the test models with alternate
+# operations and flows between two builds of frePPLe: one with the slot
+# pool, and one compiled with the macro FREPPLE_NO_SLOTPOOL.
+# It isn't part of the test suite, since timings depend on the machine.
+#
+# Usage:
+#   ./compare.py {frepple with the pool} {frepple without the pool} [runs]
+#
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+models = ('operation_alternate', 'flow_alternate_1', 'flow_alternate_2')
+
+testdir = os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), '..'))
+
+
+def runModel(executable, model, workdir, runs):
+  # Returns the best run time of a model in seconds
+  best = None
+  for i in range(runs):
+    start = time.time()
+    subprocess.check_call(
+      [executable, os.path.join(testdir, model, '%s.xml' % model)],
+      cwd=workdir, stdout=subprocess.DEVNULL
+      )
+    t = time.time() - start
+    if best is None or t < best:
+      best = t
+  return best
+
+
+if __name__ == "__main__":
+  if len(sys.argv) < 3:
+    print("Usage: %s {frepple with the pool} {frepple without the pool} [runs]" % sys.argv[0])
+    sys.exit(1)
+  runs = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+  os.environ['TZ'] = 'EST'
+  workdir = tempfile.mkdtemp()
+  try:
+    print("%-20s %10s %10s %8s" % ('model', 'pool', 'heap', 'ratio'))
+    for model in models:
+      pool = runModel(sys.argv[1], model, workdir, runs)
+      heap = runModel(sys.argv[2], model, workdir, runs)
+      print("%-20s %9.3fs %9.3fs %8.2f" % (model, pool, heap, pool / heap))
+  finally:
+    shutil.rmtree(workdir)
@@ -0,0 +1,150 @@
+/***************************************************************************
+ *                                                                         *
+ * Copyright (C) 2016 by frePPLe bvba                                      *
+ *                                                                         *
+ * This library is free software; you can redistribute it and/or modify it *
+ * under the terms of the GNU Affero General Public License as published   *
+ * by the Free Software Foundation; either version 3 of the License, or    *
+ * (at your option) any later version.                                     *
+ *                                                                         *
+ * This library is distributed in the hope that it will be useful,         *
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of          *
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the            *
+ * GNU Affero General Public License for more details.                     *
+ *                                                                         *
+ * You should have received a copy of the GNU Affero General Public        *
+ * License along with this program.                                        *
+ * If not, see <http://www.gnu.org/licenses/>.                             *
+ *                                                                         *
+ ***************************************************************************/
+
+/* This test compares the slot pool with the heap allocator, using the
+ * allocation pattern of the solver: bursts of commands of which most are
+ * rolled back right away, in reverse order, and the others are kept until
+ * the plan of the demand is committed.
+ * The output file only contains the checks of the pool. The run times are
+ * printed on the standard error for information only, since timings depend
+ * on the machine. The script compare.py compares the run times of complete
+ * test models between builds with and without the pool.
+ */
+
+#include "frepple.h"
+#include <chrono>
+#include <vector>
+using namespace frepple;
+
+
+/* A command of about the size of the commands of the solver. */
+template <bool POOL> class TestCommand
+{
+  public:
+    TestCommand* prev;
+    double payload[13];
+
+    TestCommand(TestCommand* p) : prev(p) {}
+
+    static void* operator new(size_t sz)
+    {
+      if (POOL)
+        return SlotPool<sizeof(TestCommand)>::allocate(sz);
+      else
+        return ::operator new(sz);
+    }
+
+    static void operator delete(void* p, size_t sz)
+    {
+      if (POOL)
+        SlotPool<sizeof(TestCommand)>::release(p, sz);
+      else
+        ::operator delete(p);
+    }
+};
+
+
+/* Runs the solver allocation pattern, and returns the run time in seconds. */
+template <bool POOL> double run(unsigned int iterations)
+{
+  typedef TestCommand<POOL> Cmd;
+  unsigned int seed = 12345;
+  vector<Cmd*> committed;
+  auto start = chrono::steady_clock::now();
+  for (unsigned int i = 1; i <= iterations; ++i)
+  {
+    // A burst of tentative changes
+    seed = seed * 1103515245 + 12345;
+    unsigned int burst = 1 + (seed >> 16) % 32;
+    Cmd* last = nullptr;
+    for (unsigned int j = 0; j < burst; ++j)
+      last = new Cmd(last);
+    if ((seed >> 8) % 4)
+    {
+      // Rollback, in reverse order
+      while (last)
+      {
+        Cmd* tmp = last->prev;
+        delete last;
+        last = tmp;
+      }
+    }
+    else
+    {
+      // Keep the changes
+      for (; last; last = last->prev)
+        committed.push_back(last);
+    }
+    if (!(i % 1000))
+    {
+      // Commit the plan
+      for (auto c : committed)
+        delete c;
+      committed.clear();
+    }
+  }
+  for (auto c : committed)
+    delete c;
+  return chrono::duration<double>(chrono::steady_clock::now() - start).count();
+}
+
+
+int main (int argc, char *argv[])
+{
+  // A released slot is reused by the next allocation
+  TestCommand<true>* c1 = new TestCommand<true>(nullptr);
+  void* p1 = c1;
+  delete c1;
+  TestCommand<true>* c2 = new TestCommand<true>(nullptr);
+  logger << "Released slot reused: " << (p1 == c2 ? "yes" : "no") << endl;
+
+  // Live objects get different slots
+  TestCommand<true>* c3 = new TestCommand<true>(c2);
+  logger << "Live slots distinct: " << (c2 != c3 ? "yes" : "no") << endl;
+  delete c3;
+  delete c2;
+
+  // Objects of a different size are allocated from the heap: they don't
+  // take the free slot, and releasing them doesn't add a slot.
+  typedef SlotPool<sizeof(TestCommand<true>)> Pool;
+  TestCommand<true>* c4 = new TestCommand<true>(nullptr);
+  void* p4 = c4;
+  delete c4;
+  void* p5 = Pool::allocate(2 * sizeof(TestCommand<true>));
+  Pool::release(p5, 2 * sizeof(TestCommand<true>));
+  TestCommand<true>* c6 = new TestCommand<true>(nullptr);
+  logger << "Other sizes on the heap: "
+    << (p5 != p4 && static_cast<void*>(c6) == p4 ? "yes" : "no") << endl;
+  delete c6;
+
+  // Compare the run times, taking the best of a few runs
+  const unsigned int iterations = 2000000;
+  double heap = 1e9, pool = 1e9;
+  for (int r = 0; r < 3; ++r)
+  {
+    double t = run<false>(iterations);
+    if (t < heap) heap = t;
+    t = run<true>(iterations);
+    if (t < pool) pool = t;
+  }
+  cerr << "heap: " << heap << "s  pool: " << pool << "s  ratio: "
+    << (pool / heap) << endl;
+  return 0;
+}